@@ -1,6 +1,11 @@
 # This script contains functions which generate a snapshot of the value of (1) an account, (2) account type or (3)
 # a balance sheet item (asset, liability, equity) given a transaction dataset
 
+import numpy as np
+import pandas as pd
+from instrumentation import instrument, report_progress
+
+@instrument
 def get_account_level_balance_sheet(self):
 
     """This block of code calculates the start value, end value and delta for each specific account.
@@ -8,55 +13,124 @@ def get_account_level_balance_sheet(self):
 
     # For each account, we determine the baseline and calculate the change in value between the start and end dates
     Unique_Accounts = list(self.Accounts["acc_ID"].drop_duplicates())
-    Baseline_Value = self.Accounts.iloc[:,[0,7]]
-    Change = calculate_change(Unique_Accounts,self.Transactions)
+    Change = calculate_change(Unique_Accounts,self.Postings)
+    self.Acct_Level_Summary = summarize_accounts(self.Accounts,Change)
+
+    report_progress('finished preparing Account-level report')
+
+@instrument
+def get_account_type_level_balance_sheet(self):
+
+    """This block of code calculates the start value, end value and delta for the three sub-items of the balance sheet
+    For example, cash is a specific account type"""
+
+    self.Class_Level_Summary = summarize_account_types(self.Accounts,self.Acct_Level_Summary)
+
+    report_progress('finished preparing Class-level report')
+
+@instrument
+def get_overall_balance_sheet(self):
+
+    """This block of code calculates the start value, end value and delta for the three line items of the balance
+    balance - asset, liability and equity"""
+
+    self.BS_Level_Summary = summarize_balance_sheet(self.Accounts,self.Class_Level_Summary)
+
+    report_progress('finished preparing overall Balance Sheet')
+
+@instrument
+def get_balance_sheets_as_of(self,As_Of_Dates):
+
+    """This block of code produces the account-level, class-level and overall balance sheets for every date in
+    As_Of_Dates in one call. The postings are sorted and accumulated once per account, and the balance of each account
+    on each date is then looked up by binary search instead of re-filtering the transactions. Market value overwrites
+    from Accounts describe End_Date, so they are only applied to dates on or after End_Date. Dates later than End_Date
+    see no transactions beyond End_Date, since those were dropped during preprocessing. Repeated dates are reported
+    once; with no dates, the reports are empty"""
+
+    # (1) Look up every account's net change on each distinct date
+    if getattr(self,'Balance_Index',None) is None:
+        self.Balance_Index = cumulative_balance_index(self.Postings)
+    As_Of_Dates = pd.to_datetime(pd.Series(list(As_Of_Dates),dtype=object)).dt.normalize().drop_duplicates().sort_values()
+    Changes = self.Balance_Index.change_as_of(As_Of_Dates)
+
+    # (2) Summarize each date, or keep just the columns if there are none
+    Acct_Level, Class_Level, BS_Level = [], [], []
+    for As_Of_Date, Change in Changes.groupby("As_Of_Date",sort=True):
+        apply_overwrite = As_Of_Date.date() >= self.end_date
+        df_acct = summarize_accounts(self.Accounts,Change.drop(columns=["As_Of_Date"]),apply_overwrite)
+        df_class = summarize_account_types(self.Accounts,df_acct)
+        df_bs = summarize_balance_sheet(self.Accounts,df_class)
+        for df, ls in [(df_acct,Acct_Level),(df_class,Class_Level),(df_bs,BS_Level)]:
+            df.insert(0,"As_Of_Date",As_Of_Date)
+            ls += [df]
+    if not BS_Level:
+        df_acct = summarize_accounts(self.Accounts,Changes.drop(columns=["As_Of_Date"]))
+        df_class = summarize_account_types(self.Accounts,df_acct)
+        df_bs = summarize_balance_sheet(self.Accounts,df_class)
+        for df, ls in [(df_acct,Acct_Level),(df_class,Class_Level),(df_bs,BS_Level)]:
+            df = df.iloc[:0].copy()
+            df.insert(0,"As_Of_Date",pd.Series(dtype='datetime64[ns]'))
+            ls += [df]
+
+    self.Acct_Level_Summary_As_Of = pd.concat(Acct_Level,ignore_index=True)
+    self.Class_Level_Summary_As_Of = pd.concat(Class_Level,ignore_index=True)
+    self.BS_Level_Summary_As_Of = pd.concat(BS_Level,ignore_index=True)
+
+    report_progress('finished preparing Balance Sheets for ' + str(len(BS_Level)) + ' as-of dates')
+
+def summarize_accounts(Accounts,Change,apply_overwrite=True):
+
+    """This block of code combines each account's baseline with its net change (from calculate_change), applies the
+    market value overwrites from Accounts and books the resulting unrealized gain / loss"""
+
+    Baseline_Value = Accounts.iloc[:,[0,7]]
     df = Baseline_Value.merge(Change,left_on=["acc_ID"],right_on=["Impacted_Acc_ID"],how="left")
     df.fillna(value=0,inplace=True)
     df["End_Value"] = df["acc_baseline_value"] + df["Net_Change"]
 
     # Overwrite end value if it already exists in Accounts (this is the case for equities)
-    self.Acct_Level_Summary = df.merge(self.Accounts,on=["acc_ID"],how="left")
-    self.Acct_Level_Summary.rename(columns={"acc_baseline_value_x":"Baseline_Value",
-                                                "Net_Change":"Net_Change_From_Operations"},inplace=True)
-    self.Acct_Level_Summary["End_Value_Overwrite"] = self.Acct_Level_Summary["acc_end_value_overwrite"]
-    self.Acct_Level_Summary.loc[self.Acct_Level_Summary["acc_end_value_overwrite"].isnull(),"End_Value_Overwrite"] = self.Acct_Level_Summary["End_Value"]
-    self.Acct_Level_Summary["Net_Change_From_Market_Adjustment"] = self.Acct_Level_Summary["End_Value_Overwrite"] - self.Acct_Level_Summary["End_Value"]
-    self.Acct_Level_Summary.sort_values(by=["acc_report_rank"],ascending=True,inplace=True)
-    self.Acct_Level_Summary = self.Acct_Level_Summary[["acc_A/L/E_classification","acc_A/L/E_sign","acc_type","acc_ID","acc_name","Baseline_Value","Net_Change_From_Operations","Net_Change_From_Market_Adjustment","End_Value_Overwrite"]]
+    Acct_Level_Summary = df.merge(Accounts,on=["acc_ID"],how="left")
+    Acct_Level_Summary.rename(columns={"acc_baseline_value_x":"Baseline_Value",
+                                       "Net_Change":"Net_Change_From_Operations"},inplace=True)
+    if not apply_overwrite:
+        Acct_Level_Summary["acc_end_value_overwrite"] = np.nan
+    Acct_Level_Summary["End_Value_Overwrite"] = Acct_Level_Summary["acc_end_value_overwrite"]
+    Acct_Level_Summary.loc[Acct_Level_Summary["acc_end_value_overwrite"].isnull(),"End_Value_Overwrite"] = Acct_Level_Summary["End_Value"]
+    Acct_Level_Summary["Net_Change_From_Market_Adjustment"] = Acct_Level_Summary["End_Value_Overwrite"] - Acct_Level_Summary["End_Value"]
+    Acct_Level_Summary.sort_values(by=["acc_report_rank"],ascending=True,inplace=True)
+    Acct_Level_Summary = Acct_Level_Summary[["acc_A/L/E_classification","acc_A/L/E_sign","acc_type","acc_ID","acc_name","Baseline_Value","Net_Change_From_Operations","Net_Change_From_Market_Adjustment","End_Value_Overwrite"]]
 
     # Calculating unrealized gain / loss due to Market Valuation
-    Unrealized_gain = self.Acct_Level_Summary[self.Acct_Level_Summary["Net_Change_From_Market_Adjustment"] > 0]["Net_Change_From_Market_Adjustment"].sum()
-    Unrealized_loss = self.Acct_Level_Summary[self.Acct_Level_Summary["Net_Change_From_Market_Adjustment"] < 0]["Net_Change_From_Market_Adjustment"].sum()
+    Unrealized_gain = Acct_Level_Summary[Acct_Level_Summary["Net_Change_From_Market_Adjustment"] > 0]["Net_Change_From_Market_Adjustment"].sum()
+    Unrealized_loss = Acct_Level_Summary[Acct_Level_Summary["Net_Change_From_Market_Adjustment"] < 0]["Net_Change_From_Market_Adjustment"].sum()
 
-    self.Acct_Level_Summary.loc[self.Acct_Level_Summary["acc_name"].str.contains("Unrealized Investment Gain"),"End_Value_Overwrite"] = Unrealized_gain
-    self.Acct_Level_Summary.loc[self.Acct_Level_Summary["acc_name"].str.contains("Unrealized Investment Gain"),"Net_Change_From_Market_Adjustment"] = Unrealized_gain
+    Acct_Level_Summary.loc[Acct_Level_Summary["acc_name"].str.contains("Unrealized Investment Gain"),"End_Value_Overwrite"] = Unrealized_gain
+    Acct_Level_Summary.loc[Acct_Level_Summary["acc_name"].str.contains("Unrealized Investment Gain"),"Net_Change_From_Market_Adjustment"] = Unrealized_gain
 
-    self.Acct_Level_Summary.loc[self.Acct_Level_Summary["acc_name"].str.contains("Unrealized Investment Loss"),"End_Value_Overwrite"] = Unrealized_loss * -1
-    self.Acct_Level_Summary.loc[self.Acct_Level_Summary["acc_name"].str.contains("Unrealized Investment Loss"),"Net_Change_From_Market_Adjustment"] = Unrealized_loss * -1
+    Acct_Level_Summary.loc[Acct_Level_Summary["acc_name"].str.contains("Unrealized Investment Loss"),"End_Value_Overwrite"] = Unrealized_loss * -1
+    Acct_Level_Summary.loc[Acct_Level_Summary["acc_name"].str.contains("Unrealized Investment Loss"),"Net_Change_From_Market_Adjustment"] = Unrealized_loss * -1
 
     # Keep only rows with at least one non-NULL value in {End_Value}
-    self.Acct_Level_Summary = self.Acct_Level_Summary[(self.Acct_Level_Summary["Baseline_Value"] != 0) | (self.Acct_Level_Summary["End_Value_Overwrite"] != 0)]
-
-    print('finished preparing Account-level report')
+    return Acct_Level_Summary[(Acct_Level_Summary["Baseline_Value"] != 0) | (Acct_Level_Summary["End_Value_Overwrite"] != 0)]
 
-def get_account_type_level_balance_sheet(self):
+def summarize_account_types(Accounts,Acct_Level_Summary):
 
-    """This block of code calculates the start value, end value and delta for the three sub-items of the balance sheet
-    For example, cash is a specific account type"""
+    """This block of code rolls the account-level summary up to account types"""
 
-    self.Class_Level_Summary = self.Acct_Level_Summary.groupby(["acc_A/L/E_classification","acc_A/L/E_sign","acc_type"],as_index=False)["Baseline_Value","Net_Change_From_Operations","Net_Change_From_Market_Adjustment","End_Value_Overwrite"].sum()
-    Acc_type_priority = self.Accounts.groupby("acc_type",as_index=False)["acc_report_rank"].min()
-    self.Class_Level_Summary = self.Class_Level_Summary.merge(Acc_type_priority,on="acc_type",how="left")
-    self.Class_Level_Summary.sort_values(by=["acc_report_rank"],ascending=True,inplace=True)
+    Class_Level_Summary = Acct_Level_Summary.groupby(["acc_A/L/E_classification","acc_A/L/E_sign","acc_type"],as_index=False)[["Baseline_Value","Net_Change_From_Operations","Net_Change_From_Market_Adjustment","End_Value_Overwrite"]].sum()
+    Acc_type_priority = Accounts.groupby("acc_type",as_index=False)["acc_report_rank"].min()
+    Class_Level_Summary = Class_Level_Summary.merge(Acc_type_priority,on="acc_type",how="left")
+    Class_Level_Summary.sort_values(by=["acc_report_rank"],ascending=True,inplace=True)
 
-    print('finished preparing Class-level report')
+    return Class_Level_Summary
 
-def get_overall_balance_sheet(self):
+def summarize_balance_sheet(Accounts,Class_Level_Summary):
 
-    """This block of code calculates the start value, end value and delta for the three line items of the balance
-    balance - asset, liability and equity"""
+    """This block of code rolls the class-level summary up to asset, liability and equity, flipping the sign of
+    contra items"""
 
-    Parts = self.Class_Level_Summary.copy()
+    Parts = Class_Level_Summary.copy()
 
     Parts.loc[Parts["acc_A/L/E_sign"] == "[+ve]","Vector"] = 1
     Parts.loc[Parts["acc_A/L/E_sign"] == "[-ve]","Vector"] = -1
@@ -65,44 +139,78 @@ def get_overall_balance_sheet(self):
     Parts["Net_Change_From_Market_Adjustment"] = Parts["Vector"] * Parts["Net_Change_From_Market_Adjustment"]
     Parts["End_Value_Overwrite"] = Parts["Vector"] * Parts["End_Value_Overwrite"]
 
-    self.BS_Level_Summary = Parts.groupby("acc_A/L/E_classification",as_index=False)[["Baseline_Value","Net_Change_From_Operations","Net_Change_From_Market_Adjustment","End_Value_Overwrite"]].sum()
-    BS_Item_Priority = self.Accounts.groupby("acc_A/L/E_classification",as_index=False)["acc_report_rank"].min()
+    BS_Level_Summary = Parts.groupby("acc_A/L/E_classification",as_index=False)[["Baseline_Value","Net_Change_From_Operations","Net_Change_From_Market_Adjustment","End_Value_Overwrite"]].sum()
+    BS_Item_Priority = Accounts.groupby("acc_A/L/E_classification",as_index=False)["acc_report_rank"].min()
 
-    self.BS_Level_Summary = self.BS_Level_Summary.merge(BS_Item_Priority,on="acc_A/L/E_classification",how="left")
-    self.BS_Level_Summary.sort_values(by=["acc_report_rank"],ascending=True,inplace=True)
+    BS_Level_Summary = BS_Level_Summary.merge(BS_Item_Priority,on="acc_A/L/E_classification",how="left")
+    BS_Level_Summary.sort_values(by=["acc_report_rank"],ascending=True,inplace=True)
 
-    print('finished preparing overall Balance Sheet')
+    return BS_Level_Summary
 
-def calculate_change(S,Transactions):
+@instrument
+def calculate_change(S,Postings):
 
     """This block of code takes as input a list of accounts, and returns the (operational) net change in the amount of
     that account between Start_Date and End_Date as a result of the recorded transactions. Since each line of
-    transaction involves two accounts, Acc_1 and Acc_2, we have to repeat this twice"""
-
-    # (1) Amounts coming from Acc_1 side
-    df_Acc_1 = Transactions[Transactions["Impacted_Acc_ID_1"].isin(S)]
-    df_Acc_1 = df_Acc_1[["Impacted_Acc_ID_1","Tr_Date","Impacted_Acc_1_Sign","Impacted_Acc_1_Mag"]]
-    df_Acc_1.rename(columns={"Impacted_Acc_ID_1":"Impacted_Acc_ID",
-                             "Impacted_Acc_1_Sign":"Sign",
-                             "Impacted_Acc_1_Mag":"Mag"},inplace=True)
-
-    # (2) Amounts coming from Acc_2 side
-    df_Acc_2 = Transactions[Transactions["Impacted_Acc_ID_2"].isin(S)]
-    df_Acc_2 = df_Acc_2[["Impacted_Acc_ID_2","Tr_Date","Impacted_Acc_2_Sign","Impacted_Acc_2_Mag"]]
-    df_Acc_2.rename(columns={"Impacted_Acc_ID_2":"Impacted_Acc_ID",
-                                        "Impacted_Acc_2_Sign":"Sign",
-                                        "Impacted_Acc_2_Mag":"Mag"},inplace=True)
-
-    # (3) Append amounts coming from both sides
-    df = df_Acc_1.append(df_Acc_2,ignore_index=True)
-
-    # (4) Calculate net change
-    df.loc[df["Sign"] == "[+ve]","Vector"] = 1
-    df.loc[df["Sign"] == "[-ve]","Vector"] = -1
-    df["Net_Change"] = df["Vector"] * df["Mag"]
-
-    # (5) Group by account
-    Change = df.groupby(["Impacted_Acc_ID"],as_index=False)["Net_Change"].sum()
+    transaction involves two accounts, Acc_1 and Acc_2, both legs of the posting matrix are counted"""
+
+    # (1) Net change of every account in one pass over both legs
+    Net_Change, Postings_Count = Postings.net_change()
+
+    # (2) Keep accounts in S which have at least one posting
+    relevant = np.isin(Postings.acc_IDs,S) & (Postings_Count > 0)
+    Change = pd.DataFrame({"Impacted_Acc_ID":Postings.acc_IDs[relevant],
+                           "Net_Change":Net_Change[relevant]})
     Change.sort_values(by=["Impacted_Acc_ID"],ascending=True,inplace=True)
 
     return Change
+
+class cumulative_balance_index(object):
+
+    """Per-account running totals of the postings, sorted by date, for answering as-of queries by binary search"""
+    def __init__(self,Postings):
+        """Sorts the postings of both legs by (account, date) once and accumulates the signed amounts. Preprocessed
+        postings are already in date order, so sorting them by account alone (stably) is enough"""
+
+        # (1) Sort by (account, date) and accumulate
+        code, change, day = Postings.legs()
+        day = day.astype(np.int64)
+        self.acc_IDs = Postings.acc_IDs
+        if (day[1:] >= day[:-1]).all():
+            order = np.argsort(code,kind='stable')
+        else:
+            order = np.lexsort((day,code))
+        self.code = code[order].astype(np.int64)
+        self.day = day[order]
+        self.prefix = np.concatenate([[0.0],np.cumsum(change[order])])
+        self.segment_start = np.searchsorted(self.code,np.arange(len(self.acc_IDs)),side='left')
+
+        # (2) Fold (account, date) into one sorted int64 key, so that all lookups are a single searchsorted call
+        self.first_day = self.day.min() if len(self.day) else 0
+        self.key_span = (self.day.max() - self.first_day + 3) if len(self.day) else 2
+        self.key = self.code * self.key_span + (self.day - self.first_day + 1)
+
+        # (3) Postings before detail_start are only known as per-account opening balances
+        self.opening = Postings.Opening[0]
+        self.detail_start = Postings.detail_start
+
+    def change_as_of(self,As_Of_Dates):
+        """Returns the net change of every account from its postings dated on or before each as-of date, in the same
+        layout as calculate_change plus an As_Of_Date column. With opening balances, as-of dates must be on or after
+        the day before detail_start (i.e. Start_Date)"""
+
+        as_of = pd.to_datetime(pd.Series(As_Of_Dates)).to_numpy().astype('datetime64[D]')
+        if self.detail_start is not None and (as_of < self.detail_start - 1).any():
+            raise ValueError("as-of dates must be on or after " + str(self.detail_start - 1) + ", since earlier postings are only kept as opening balances")
+        n_acc, n_dates = len(self.acc_IDs), len(as_of)
+
+        # Binary search each account's date segment for every as-of date (as-of dates outside the posting range are
+        # clipped to just before / after the segment)
+        codes = np.repeat(np.arange(n_acc),n_dates)
+        offset = np.clip(np.tile(as_of.astype(np.int64),n_acc) - self.first_day + 1,0,self.key_span - 1)
+        position = np.searchsorted(self.key,codes * self.key_span + offset,side='right')
+        net_change = self.opening[codes] + self.prefix[position] - self.prefix[self.segment_start[codes]]
+
+        return pd.DataFrame({"As_Of_Date":np.tile(as_of.astype('datetime64[ns]'),n_acc),
+                             "Impacted_Acc_ID":self.acc_IDs[codes],
+                             "Net_Change":net_change})
@@ -0,0 +1,121 @@
+# This script runs the full pipeline (main_script.main) for many workbooks / households in one invocation, each in
+# its own worker process, several at a time
+
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+import traceback
+
+import pandas as pd
+
+def read_manifest(manifest_file):
+
+    """This block of code reads the manifest of jobs: a CSV with one row per workbook and the columns path, filename,
+    start_date and end_date (YYYY-MM-DD), plus an optional job_name. Each job writes its Output.xlsx into its own path,
+    so jobs which share a path would overwrite each other's; they get a manifest_error, which fails them (and only
+    them) in run_batch"""
+
+    Manifest = pd.read_csv(manifest_file,dtype={"path":str,"filename":str})
+    missing = {"path","filename","start_date","end_date"} - set(Manifest.columns)
+    if missing:
+        raise ValueError("manifest is missing columns: " + ", ".join(sorted(missing)))
+    if "job_name" not in Manifest.columns:
+        Manifest["job_name"] = Manifest["filename"]
+    Manifest["job_name"] = Manifest["job_name"].fillna(Manifest["filename"])
+    Manifest["start_date"] = pd.to_datetime(Manifest["start_date"]).dt.date
+    Manifest["end_date"] = pd.to_datetime(Manifest["end_date"]).dt.date
+
+    Shared_Path = Manifest["path"].duplicated(keep=False)
+    Manifest["manifest_error"] = ''
+    Manifest.loc[Shared_Path,"manifest_error"] = "jobs would overwrite each other's Output.xlsx in: " + Manifest.loc[Shared_Path,"path"]
+
+    return Manifest
+
+def run_job(job):
+
+    """This block of code runs one job in a worker process and reports its status and timing instead of raising, so
+    that one bad workbook doesn't abort the batch"""
+
+    from main_script import main
+
+    start = time.perf_counter()
+    try:
+        main(path=job["path"],filename=job["filename"],Start_Date=job["start_date"],End_Date=job["end_date"])
+        status, error = 'succeeded', ''
+    except Exception as e:
+        status, error = 'failed', ''.join(traceback.format_exception_only(type(e),e)).strip()
+
+    return {"job_name":job["job_name"],
+            "status":status,
+            "seconds":time.perf_counter() - start,
+            "worker_pid":os.getpid(),
+            "error":error}
+
+def run_job_in_process(job,sender):
+
+    """This block of code is the target of each job's worker process: it runs the job and sends back its result"""
+
+    sender.send(run_job(job))
+    sender.close()
+
+def run_batch(Manifest,workers=None):
+
+    """This block of code runs every job in the manifest, each in its own short-lived worker process with up to
+    workers (by default one per CPU) running at a time, and returns one row of status and timing per job, in manifest
+    order. A worker which dies before it reports (e.g. out of memory) only fails its own job, unlike a shared process
+    pool which breaks and fails every job still pending"""
+
+    Jobs = Manifest.to_dict('records')
+    workers = workers or os.cpu_count() or 1
+    Results, Running = {}, {}
+    start = time.perf_counter()
+
+    # Jobs with an invalid manifest row fail without running
+    for i, job in enumerate(Jobs):
+        if job.get("manifest_error"):
+            Results[i] = {"job_name":job["job_name"],"status":'failed',"seconds":0.0,"worker_pid":None,"error":job["manifest_error"]}
+    Pending = [i for i in range(len(Jobs)) if i not in Results]
+
+    while Pending or Running:
+        # (1) Start jobs while there are free workers
+        while Pending and len(Running) < workers:
+            i = Pending.pop(0)
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=run_job_in_process,args=(Jobs[i],sender),daemon=True)
+            process.start()
+            sender.close()    # so that the receiver sees end-of-file if the worker dies
+            Running[i] = (process,receiver,time.perf_counter())
+
+        # (2) Collect the jobs which reported or whose worker exited
+        multiprocessing.connection.wait([receiver for process, receiver, _ in Running.values()])
+        for i, (process, receiver, job_start) in list(Running.items()):
+            if not receiver.poll():
+                continue
+            try:
+                Results[i] = receiver.recv()
+            except EOFError:    # the worker died (e.g. out of memory) before it could report
+                process.join()
+                Results[i] = {"job_name":Jobs[i]["job_name"],"status":'failed',"seconds":time.perf_counter() - job_start,"worker_pid":process.pid,"error":'worker process died (exit code ' + str(process.exitcode) + ')'}
+            process.join()
+            receiver.close()
+            del Running[i]
+            print('(' + str(len(Results)) + '/' + str(len(Jobs)) + ') ' + Results[i]["job_name"] + ': ' + Results[i]["status"])
+
+    Batch_Status = pd.DataFrame([Results[i] for i in range(len(Jobs))],columns=["job_name","status","seconds","worker_pid","error"])
+    print('batch completed in ' + str(round(time.perf_counter() - start,1)) + 's: '
+          + str((Batch_Status["status"] == 'succeeded').sum()) + ' succeeded, '
+          + str((Batch_Status["status"] == 'failed').sum()) + ' failed')
+
+    return Batch_Status
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the reporting pipeline for every workbook in a manifest")
+    parser.add_argument("manifest",help="CSV with columns path, filename, start_date, end_date and optionally job_name")
+    parser.add_argument("--workers",type=int,default=None,help="number of jobs to run at a time (default: one per CPU)")
+    parser.add_argument("--status",default="batch_status.csv",help="where to write the per-job status and timing")
+    args = parser.parse_args()
+
+    Batch_Status = run_batch(read_manifest(args.manifest),workers=args.workers)
+    Batch_Status.to_csv(args.status,index=False)
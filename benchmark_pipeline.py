@@ -0,0 +1,141 @@
+# This script times and memory-profiles each stage of main_script.main on synthetic ledgers of increasing size, and saves
+# the results so that regressions can be spotted by comparing runs
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from data_ingestion import ingestion_pipeline
+from stage_scheduler import build_pipeline_stages
+from synthetic_ledger import generate_ledger, write_workbook, Excel_Max_Rows
+
+def benchmark_pipeline(sizes=(10000,100000,1000000),start_date=datetime.date(2013,1,1),end_date=datetime.date(2022,12,31),with_ingestion=False,with_memory=True,seed=0):
+
+    """This block of code generates a synthetic ledger for every size in sizes and runs every stage of main_script.main
+    on it, recording wall time, CPU time, rows and (in a second pass, since tracing slows the stages down) the peak
+    memory allocated by each stage. Reading the workbook is only timed with with_ingestion, and only for sizes which
+    fit in one Excel sheet; otherwise the pipeline is given the generated sheets directly"""
+
+    Results = []
+    for n in sizes:
+        print('benchmarking ' + str(n) + ' transactions')
+        sheets = generate_ledger(n_transactions=n,n_capex=max(n // 1000,10),start_date=start_date,end_date=end_date,seed=seed)
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = work_dir + os.sep
+            if with_ingestion and len(sheets['Transactions']) <= Excel_Max_Rows:
+                write_workbook(sheets,work_dir + 'Data Structure.xlsx')
+                use_workbook = True
+            else:
+                use_workbook = False
+
+            Timings = run_stages(sheets,work_dir,use_workbook,start_date,end_date,trace_memory=False)
+            if with_memory:
+                Memory = run_stages(sheets,work_dir,use_workbook,start_date,end_date,trace_memory=True)
+                for timing, memory in zip(Timings,Memory):
+                    timing["peak_memory_mb"] = memory["peak_memory_mb"]
+
+        for timing in Timings:
+            timing["transactions"] = n
+        Results += Timings
+
+    return pd.DataFrame(Results)[["transactions","stage","wall_seconds","cpu_seconds","peak_memory_mb","rows"]]
+
+def run_stages(sheets,work_dir,use_workbook,start_date,end_date,trace_memory):
+
+    """This block of code runs ingestion and then every stage of the pipeline once, measuring each of them"""
+
+    Measurements = []
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        datasets = measure(Measurements,'read_workbook' if use_workbook else 'load_sheets',trace_memory,lambda: ingestion_pipeline(
+            path=work_dir,
+            filename='Data Structure.xlsx',
+            start_date=start_date,
+            end_date=end_date,
+            use_cache=False,
+            sheets=None if use_workbook else sheets))
+        Measurements[-1]["rows"] = len(datasets.Transactions)
+
+        for stage in build_pipeline_stages():
+            measure(Measurements,stage.name,trace_memory,lambda: stage.function(datasets,*stage.args))
+            Measurements[-1]["rows"] = len(datasets.Transactions)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return Measurements
+
+def measure(Measurements,stage,trace_memory,function):
+
+    """This block of code calls function and appends its wall time, CPU time and peak memory to Measurements"""
+
+    if trace_memory:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = function()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    peak = (tracemalloc.get_traced_memory()[1] - before) / 2**20 if trace_memory else np.nan
+
+    Measurements += [{"stage":stage,"wall_seconds":wall,"cpu_seconds":cpu,"peak_memory_mb":peak}]
+    return result
+
+def save_results(Results,results_dir):
+
+    """This block of code saves the results with the environment they were measured in, and returns the file name"""
+
+    os.makedirs(results_dir,exist_ok=True)
+    results_file = os.path.join(results_dir,'benchmark_' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+    with open(results_file,'w') as f:
+        json.dump({"created":datetime.datetime.now().isoformat(timespec='seconds'),
+                   "python":platform.python_version(),
+                   "pandas":pd.__version__,
+                   "numpy":np.__version__,
+                   "machine":platform.machine(),
+                   "results":json.loads(Results.to_json(orient='records'))},f,indent=2)
+
+    return results_file
+
+def compare_with_previous(Results,results_dir,results_file,threshold=1.25):
+
+    """This block of code compares the results with the latest earlier results file in results_dir. Stages which got
+    slower by more than threshold (and take more than 10ms) are flagged as regressions"""
+
+    Earlier = sorted(f for f in os.listdir(results_dir) if f.startswith('benchmark_') and f.endswith('.json') and f != os.path.basename(results_file))
+    if not Earlier:
+        return None
+
+    with open(os.path.join(results_dir,Earlier[-1])) as f:
+        Previous = pd.DataFrame(json.load(f)["results"])
+    Comparison = Results.merge(Previous,on=["transactions","stage"],how="inner",suffixes=("","_previous"))
+    Comparison["time_ratio"] = Comparison["wall_seconds"] / Comparison["wall_seconds_previous"]
+    Comparison["memory_ratio"] = Comparison["peak_memory_mb"] / Comparison["peak_memory_mb_previous"]
+    Comparison["regression"] = (Comparison["time_ratio"] > threshold) & (Comparison["wall_seconds"] > 0.01)
+    print('compared with ' + Earlier[-1] + ': ' + str(Comparison["regression"].sum()) + ' regressions')
+
+    return Comparison[["transactions","stage","wall_seconds_previous","wall_seconds","time_ratio","memory_ratio","regression"]]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic ledgers")
+    parser.add_argument("--sizes",type=int,nargs='+',default=[10000,100000,1000000],help="numbers of transactions")
+    parser.add_argument("--results-dir",default="benchmark_results")
+    parser.add_argument("--with-ingestion",action='store_true',help="also time reading the workbook (slow to generate for large sizes)")
+    parser.add_argument("--no-memory",action='store_true',help="skip the memory profiling pass")
+    parser.add_argument("--seed",type=int,default=0)
+    args = parser.parse_args()
+
+    Results = benchmark_pipeline(args.sizes,with_ingestion=args.with_ingestion,with_memory=not args.no_memory,seed=args.seed)
+    print(Results.to_string(index=False))
+    results_file = save_results(Results,args.results_dir)
+    print('saved results to ' + results_file)
+    Comparison = compare_with_previous(Results,args.results_dir,results_file)
+    if Comparison is not None:
+        print(Comparison.to_string(index=False))
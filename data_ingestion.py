@@ -1,115 +1,348 @@
 # This script contains parts for reading + cleaning the transactions and other input datasets
 
+import os
+import numpy as np
 import pandas as pd
+from input_cache import read_workbook_sheets
+from instrumentation import instrument, report_progress
+from posting_matrix import posting_matrix, sign_to_vector
+from run_qc_tests import count_pushed_down_offenders
+from flow_cube import flow_cube
+
+# Capex categories which are depreciated monthly over tr_SKU_lifetime, and the depreciation entries they generate
+Depreciable_Expenses = {
+    'Housing Expense - Fixture Investment':{'tr_description':'Fixture Depreciation',
+                                            'tr_impacted_acc_1':'PP&E - Fixtures',
+                                            'tr_impacted_acc_1_sign':'[-ve]',
+                                            'tr_impacted_acc_2':'Expense - Housing',
+                                            'tr_impacted_acc_2_sign':'[+ve]',
+                                            'tr_expense':'Housing Expense - Depreciation'},
+}
+
+# Columns of the Transactions sheet which aren't used in any report
+Unused_Transaction_Columns = ['tr_supplier','tr_qty','tr_qty_units','tr_rate','tr_notes']
+
+# Flags set by coerce_amounts, as {QC check: column}
+Amount_Flag_Columns = {'missing_amounts':'tr_amt_missing','non_numeric_amounts':'tr_amt_non_numeric'}
+
+# Columns of the enriched transactions which are only needed to derive the QC flags
+Enrichment_Only_Columns = ['tr_init_date','tr_close_date','tr_SKU_lifetime'] + list(Amount_Flag_Columns.values())
+
+# Low-cardinality label columns of the preprocessed transactions, which are stored as categoricals
+Categorical_Columns = ['Impacted_Acc_1','Impacted_Acc_2','Impacted_Acc_1_Sign','Impacted_Acc_2_Sign','tr_expense','tr_income']
+
+Input_Sheets = ['Transactions','Accounts','tblpl_expense','tblpl_expense_group','tblpl_income','tblpl_income_group']
 
 class ingestion_pipeline(object):
 
     """Object to store shared state and processing methods"""
+    @instrument
     def __init__(
             self,
             path,
             filename,
             start_date,
-            end_date
+            end_date,
+            use_cache=True,
+            cache_dir=None,
+            sheets=None
     ):
-        """Initializes Pipeline object with shared state and inputs"""
+        """Initializes Pipeline object with shared state and inputs. All sheets are read in one pass over the workbook,
+        and reused from the local input cache (by default a '.input_cache' folder next to the workbook) if the workbook
+        has not changed since the last run. Alternatively, sheets can be passed in as {sheet name: DataFrame} (e.g.
+        from synthetic_ledger), in which case the workbook is not read"""
         self.path = path
         self.filename = filename
         self.start_date = start_date
         self.end_date = end_date
         self.Days_Ellapsed = (end_date - start_date).days
-        self.Transactions = pd.read_excel(path+filename,sheet_name='Transactions')
-        self.Accounts = pd.read_excel(path+filename,sheet_name='Accounts')
-        self.Expense_Picklist = pd.read_excel(path+filename,sheet_name='tblpl_expense')
-        self.Expense_Group_Picklist = pd.read_excel(path+filename,sheet_name='tblpl_expense_group')
-        self.Income_Picklist = pd.read_excel(path+filename,sheet_name='tblpl_income')
-        self.Income_Group_Picklist = pd.read_excel(path+filename,sheet_name='tblpl_income_group')
-        print("finished reading inputs")
+        if use_cache and cache_dir is None:
+            cache_dir = os.path.join(path,'.input_cache')
+        if sheets is None:
+            sheets, self.Input_Cache_Hit = read_workbook_sheets(path+filename,Input_Sheets,cache_dir if use_cache else None)
+        else:
+            sheets, self.Input_Cache_Hit = {sheet:sheets[sheet].copy() for sheet in Input_Sheets}, False
+        self.Transactions = sheets['Transactions']
+        self.Accounts = sheets['Accounts']
+        self.Expense_Picklist = sheets['tblpl_expense']
+        self.Expense_Group_Picklist = sheets['tblpl_expense_group']
+        self.Income_Picklist = sheets['tblpl_income']
+        self.Income_Group_Picklist = sheets['tblpl_income_group']
+        report_progress("finished reading inputs")
 
+    @instrument
     def preprocess_transactions(self):
 
-        # Drop unused columns
-        self.Transactions.drop(columns=['tr_ID','tr_supplier','tr_qty','tr_qty_units','tr_rate','tr_notes'],inplace=True)
+        # Drop unused columns, and read the amounts as numbers
+        self.drop_unused_columns()
+        self.Transactions = coerce_amounts(self.Transactions)
+
+        # Keep only in-window transactions; earlier ones are pre-aggregated into opening balances
+        self.Opening_Balances = self.QC_Pushed_Down_Counts = None
+        In_Window = self.push_down_window(self.Transactions)
+
+        # Add depreciation expenses
+        Transactions_with_depex = self.add_fixture_depreciation_expense(In_Window)
+        del In_Window
+        report_progress('finished adding depreciation expenses')
+
+        # Derive dates and add account IDs, and sort by date (which cumulative_balance_index relies on)
+        Enriched = self.enrich_transactions(Transactions_with_depex)
+        Enriched = Enriched.take(np.argsort(Enriched["Tr_Date"].to_numpy(),kind='stable')).reset_index(drop=True)
+        del Transactions_with_depex
+
+        # Keep the QC flags and only the relevant columns, in compact dtypes
+        self.QC_Flags = get_qc_flags(Enriched)
+        self.Transactions = compact_transactions(Enriched.drop(columns=Enrichment_Only_Columns))
+        del Enriched
+
+        # Encode both legs of every transaction once, for the balance sheet and QC functions
+        self.Postings = posting_matrix(self.Transactions,self.Accounts).with_opening_balances(*self.Opening_Balances,self.start_date)
+
+        # Aggregate income and expenses by category, year and month once, for the trend reports
+        self.Revenue_Cube = self.Expense_Cube = None
+        self.build_flow_cubes(self.Transactions)
+        report_progress('finished preprocessing Transactions dataset')
+
+    @instrument
+    def push_down_window(self,Transactions):
+
+        """This block of code keeps only the transactions closed between Start_Date and End_Date, before anything is
+        derived from them. Transactions closed before Start_Date only matter for the balance sheet, so they are
+        pre-aggregated into per-account opening balances (added to Opening_Balances) instead of being carried through
+        preprocessing. Later (or undated) transactions are dropped. Since the QC checks only see the kept rows, the
+        undated rows, the later rows (e.g. a mistyped year) and the earlier rows failing any row-level error check (see
+        count_pushed_down_offenders) are counted in QC_Pushed_Down_Counts"""
+
+        Close_Day = pd.to_datetime(Transactions['tr_close_date']).dt.normalize()
+        before_start = (Close_Day < pd.Timestamp(self.start_date)).to_numpy()
+        in_window = ((Close_Day >= pd.Timestamp(self.start_date)) & (Close_Day <= pd.Timestamp(self.end_date))).to_numpy()
+
+        Net_Change, Postings_Count = get_opening_balances(Transactions.take(np.flatnonzero(before_start)),self.Accounts)
+        if getattr(self,'Opening_Balances',None) is not None:
+            Net_Change, Postings_Count = Net_Change + self.Opening_Balances[0], Postings_Count + self.Opening_Balances[1]
+        self.Opening_Balances = (Net_Change,Postings_Count)
+
+        IDs = Transactions["tr_ID"] if "tr_ID" in Transactions.columns else pd.Series(np.nan,index=Transactions.index)
+        Dated_IDs = IDs[before_start | in_window]
+        Duplicate_ID = (IDs.isin(Dated_IDs[Dated_IDs.duplicated()]) & IDs.notnull()).to_numpy()[before_start]
+        Counts = count_pushed_down_offenders(self,Transactions.take(np.flatnonzero(before_start)),Duplicate_ID)
+        Counts['undated_transactions'] = int(Close_Day.isnull().sum())
+        Counts['out_of_window_dates'] = int((Close_Day > pd.Timestamp(self.end_date)).sum())
+        if getattr(self,'QC_Pushed_Down_Counts',None) is not None:
+            Counts = Counts.add(self.QC_Pushed_Down_Counts,fill_value=0).astype(np.int64)
+        self.QC_Pushed_Down_Counts = Counts
+
+        return Transactions.take(np.flatnonzero(in_window))
+
+    @instrument
+    def build_flow_cubes(self,Transactions):
+
+        """This block of code aggregates the income and expenses of the given (preprocessed) transactions into cubes,
+        or folds them into the existing cubes if there are any"""
+
+        Revenue_Cube = flow_cube(Transactions,'income',self.Income_Picklist,self.Income_Group_Picklist)
+        Expense_Cube = flow_cube(Transactions,'expense',self.Expense_Picklist,self.Expense_Group_Picklist)
+        if getattr(self,'Revenue_Cube',None) is not None:
+            Revenue_Cube, Expense_Cube = self.Revenue_Cube.append(Revenue_Cube), self.Expense_Cube.append(Expense_Cube)
+        self.Revenue_Cube, self.Expense_Cube = Revenue_Cube, Expense_Cube
+
+    @instrument
+    def drop_unused_columns(self):
+
+        """This block of code drops the input columns which aren't used in any report. tr_ID is kept since it
+        identifies transactions across runs (see incremental_ledger). Transactions is None when they are streamed
+        (see streaming_ingestion)"""
+
+        if self.Transactions is not None:
+            self.Transactions.drop(columns=Unused_Transaction_Columns,inplace=True)
         self.Accounts.drop(columns=['acc_notes','acc_last_refresh','acc_baseline_date','Unnamed: 12','Unnamed: 13','Signs'],inplace=True)
         self.Expense_Picklist.drop(columns=['exp_ID'],inplace=True)
         self.Income_Picklist.drop(columns=['inc_ID'],inplace=True)
 
-        # Add depreciation expenses
-        Transactions_with_depex = self.add_fixture_depreciation_expense()
-        print('finished adding depreciation expenses')
+    @instrument
+    def enrich_transactions(self,Transactions_with_depex):
 
-        # Define Date-related variables
-        Transactions_with_depex['Tr_Date'] = pd.to_datetime(Transactions_with_depex['tr_close_date'], format="%m/%d/%y")
-        Transactions_with_depex['Tr_Week'] = Transactions_with_depex['tr_close_date'].dt.isocalendar().week
-        Transactions_with_depex['Tr_Month'] = Transactions_with_depex['tr_close_date'].dt.month
-        Transactions_with_depex['Tr_Year'] = Transactions_with_depex['tr_close_date'].dt.isocalendar().year
-        Transactions_with_depex['Tr_Date'] = pd.to_datetime(Transactions_with_depex['tr_close_date']).dt.date
+        """This block of code derives the date-related variables and adds the IDs of both impacted accounts, for
+        transactions already restricted to the window by push_down_window. It only looks at one row at a time, so it
+        can be applied to any subset of rows"""
 
-        # Keep only in-window transactions
-        Transactions_relevant_timeframe = Transactions_with_depex[Transactions_with_depex['Tr_Date'] <= self.end_date]
+        Close_Date = pd.to_datetime(Transactions_with_depex['tr_close_date'])
+        Enriched = Transactions_with_depex.copy(deep=False)    # new columns only, so the input is left unchanged
+
+        # Define Date-related variables, as datetime64 and small integers rather than Python objects. Tr_Year is the
+        # calendar year of Tr_Month; ISO weeks go with their own ISO year (e.g. 2021-01-01 is in week 53 of 2020)
+        ISO_Calendar = Close_Date.dt.isocalendar()
+        Enriched['Tr_Date'] = Close_Date.dt.normalize().to_numpy()
+        Enriched['Tr_Week'] = ISO_Calendar['week'].astype(np.int8).to_numpy()
+        Enriched['Tr_Week_Year'] = ISO_Calendar['year'].astype(np.int16).to_numpy()
+        Enriched['Tr_Month'] = Close_Date.dt.month.astype(np.int8).to_numpy()
+        Enriched['Tr_Year'] = Close_Date.dt.year.astype(np.int16).to_numpy()
 
         # Fill in the Impact Magnitudes based on tr_amt
-        Transactions_relevant_timeframe["Impacted_Acc_1_Mag"] = Transactions_relevant_timeframe["tr_amt"]
-        Transactions_relevant_timeframe["Impacted_Acc_2_Mag"] = Transactions_relevant_timeframe["tr_amt"]
+        Enriched["Impacted_Acc_1_Mag"] = Enriched["tr_amt"]
+        Enriched["Impacted_Acc_2_Mag"] = Enriched["tr_amt"]
 
-        # Add Account ID
-        Transactions_temp_1 = Transactions_relevant_timeframe.merge(self.Accounts.iloc[:,0:2],left_on="tr_impacted_acc_1",right_on="acc_name",how="left")
-        self.Transactions_temp_2 = Transactions_temp_1.merge(self.Accounts.iloc[:,0:2],left_on="tr_impacted_acc_2",right_on="acc_name",how="left",suffixes=('_1','_2'))
+        # Add Account ID, by lookup rather than by merging (which copies the whole table twice)
+        Account_IDs = self.Accounts.drop_duplicates(subset=["acc_name"]).set_index("acc_name")["acc_ID"]
+        Enriched["Impacted_Acc_ID_1"] = Enriched["tr_impacted_acc_1"].map(Account_IDs)
+        Enriched["Impacted_Acc_ID_2"] = Enriched["tr_impacted_acc_2"].map(Account_IDs)
 
         # Rename columns
-        self.Transactions_temp_2.rename(columns={"acc_ID_1":"Impacted_Acc_ID_1",
-                                                 "acc_ID_2":"Impacted_Acc_ID_2",
-                                                 "tr_impacted_acc_1":"Impacted_Acc_1",
-                                                 "tr_impacted_acc_2":"Impacted_Acc_2",
-                                                 "tr_impacted_acc_1_sign":"Impacted_Acc_1_Sign",
-                                                 "tr_impacted_acc_2_sign":"Impacted_Acc_2_Sign"},inplace=True)
+        Enriched.rename(columns={"tr_impacted_acc_1":"Impacted_Acc_1",
+                                 "tr_impacted_acc_2":"Impacted_Acc_2",
+                                 "tr_impacted_acc_1_sign":"Impacted_Acc_1_Sign",
+                                 "tr_impacted_acc_2_sign":"Impacted_Acc_2_Sign"},inplace=True)
 
-        # Keep only relevant columns
-        self.Transactions = self.Transactions_temp_2.drop(columns=['acc_name_1','acc_name_2','tr_init_date','tr_close_date','tr_SKU_lifetime'])
-        print('finished preprocessing Transactions dataset')
+        return Enriched.reset_index(drop=True)
 
-    def add_fixture_depreciation_expense(self):
+    @instrument
+    def add_fixture_depreciation_expense(self,In_Window):
 
         """This block of code takes as input a list of capital expenditure (capex) transactions and generates
         a list of depreciation expense transactions (once for each month) between (1) the date of purchase and (2)
         the date of liquidation, which is currently set as purchase date + lifetime value (which is an input of
-        the data)"""
+        the data). Each capex category in Depreciable_Expenses gets its own aggregated depreciation entries. Every capex
+        item is depreciated (including those bought before Start_Date), but only the entries in the window are added
+        to In_Window; earlier ones go to the opening balances"""
+
+        Depex_Entries = build_depreciation_entries(self.Transactions,self.start_date,self.end_date)
+        return pd.concat([In_Window,self.push_down_window(Depex_Entries)],ignore_index=True)
+
+def get_qc_flags(Enriched):
+
+    """This block of code derives the per-transaction flags needed by the QC checks from the enriched transactions, so
+    that the columns they are derived from don't have to be kept for the rest of the run. Generated entries (e.g.
+    depreciation) have no amount flags"""
+
+    No_Flags = pd.Series(False,index=Enriched.index)
+    return pd.DataFrame({'Non_Chronological':(Enriched["tr_close_date"] < Enriched["tr_init_date"]).to_numpy(),
+                         'Missing_Amount':Enriched.get(Amount_Flag_Columns['missing_amounts'],No_Flags).fillna(False).to_numpy(dtype=bool),
+                         'Non_Numeric_Amount':Enriched.get(Amount_Flag_Columns['non_numeric_amounts'],No_Flags).fillna(False).to_numpy(dtype=bool)})
+
+def coerce_amounts(Transactions):
+
+    """This block of code reads tr_amt as numbers once, before anything is summed. Amounts which aren't numbers (e.g.
+    '12,50') become missing, like missing amounts, and are posted as 0; the flag columns of Amount_Flag_Columns record
+    which amounts were missing and which weren't numbers, for the QC checks"""
+
+    Amounts = pd.to_numeric(Transactions["tr_amt"],errors='coerce').astype(np.float64)
+    Transactions[Amount_Flag_Columns['missing_amounts']] = Transactions["tr_amt"].isnull().to_numpy()
+    Transactions[Amount_Flag_Columns['non_numeric_amounts']] = (Amounts.isnull() & Transactions["tr_amt"].notnull()).to_numpy()
+    Transactions["tr_amt"] = Amounts
+
+    return Transactions
+
+def compact_transactions(Transactions):
+
+    """This block of code stores the label columns as categoricals (an int8/int16 code per row plus one copy of each
+    label) instead of one Python string per row. It can be re-applied after concatenating compacted tables, whose
+    categories may differ"""
+
+    for column in Categorical_Columns:
+        if column in Transactions.columns:
+            Transactions[column] = Transactions[column].astype('category')
+
+    return Transactions
+
+def get_opening_balances(Earlier,Accounts):
+
+    """This block of code returns the net change and number of postings of every account (in the order of
+    posting_matrix.acc_IDs) from the given transactions. Both legs are first summed by (account name, sign), so only
+    those few sums are mapped to accounts and signs"""
+
+    acc_IDs = Accounts["acc_ID"].drop_duplicates().to_numpy()
+    Account_Codes = pd.Series(pd.Index(acc_IDs).get_indexer(Accounts.drop_duplicates(subset=["acc_name"])["acc_ID"]),index=Accounts.drop_duplicates(subset=["acc_name"])["acc_name"].to_numpy())
+    Net_Change, Postings_Count = np.zeros(len(acc_IDs)), np.zeros(len(acc_IDs),dtype=np.int64)
+    for leg in ['1','2']:
+        Legs = Earlier.groupby(['tr_impacted_acc_' + leg,'tr_impacted_acc_' + leg + '_sign'],dropna=False)["tr_amt"].agg(['sum','size']).reset_index()
+        code = Legs['tr_impacted_acc_' + leg].map(Account_Codes).fillna(-1).to_numpy().astype(np.int64)
+        known = code >= 0
+        Net_Change += np.bincount(code[known],weights=(sign_to_vector(Legs['tr_impacted_acc_' + leg + '_sign']) * Legs['sum'].to_numpy())[known],minlength=len(acc_IDs))
+        Postings_Count += np.bincount(code[known],weights=Legs['size'].to_numpy()[known],minlength=len(acc_IDs)).astype(np.int64)
+
+    return Net_Change, Postings_Count
+
+@instrument
+def build_depreciation_entries(Transactions,start_date=None,end_date=None,earlier_entry=True):
+
+    """This block of code returns the aggregated depreciation expense entries for the capex transactions found in
+    Transactions. With start_date / end_date, only the entries in that window are generated, and (unless earlier_entry
+    is False, e.g. when extending a window which already has them) the depreciation of all earlier months is summed
+    into one entry dated the day before start_date"""
+
+    Depex_Entries = []
+    for capex_category, entry in Depreciable_Expenses.items():
 
         # (1) Pull transactions that correspond to capex investments
-        capex = self.Transactions[self.Transactions["tr_expense"] == 'Housing Expense - Fixture Investment'][["tr_description","tr_amt","tr_close_date","tr_SKU_lifetime"]]
-        capex = capex.reset_index()    # reset has to be reset since we later perform indexing ops
-        capex['monthly_depreciation'] = capex['tr_amt'] / capex['tr_SKU_lifetime']
-
-        # (2) Initialize the depreciation expense entries
-        ls_SKU = []
-        ls_depex = []
-        ls_dep_date = []
-
-        # (3) Fill in the depreciation expense for each item i in each capex transaction
-        for i in list(range(0,len(capex))):
-
-            # (a) Extract the components
-            SKU = capex.iloc[i,1]
-            start_date = capex.iloc[i,3]
-            max_months = int(capex.iloc[i,4])    # default is float, which gives error in indexing ops in part (b)
-            depex = capex.iloc[i,5]
-
-            # (b) Loop and create depex items for each PP&E, once for each month, until the max. months is reached
-            for j in list(range(1,max_months+1)):
-                end_dep_date = start_date + pd.DateOffset(months=j)
-                ls_SKU += [SKU]
-                ls_depex += [depex]
-                ls_dep_date += [end_dep_date]
-
-        depex_table = pd.DataFrame({'tr_description':ls_SKU,'tr_amt':ls_depex,'tr_close_date':ls_dep_date})
-
-        # (4) Define  other columns for the depreciation expense transactions
+        capex = Transactions[Transactions["tr_expense"] == capex_category][["tr_description","tr_amt","tr_close_date","tr_SKU_lifetime"]]
+
+        # (2) Expand the monthly depreciation expense of every item in one batched operation
+        depex_table, earlier_depreciation = generate_depreciation_schedule(capex,start_date,end_date)
+
+        # (3) Define  other columns for the depreciation expense transactions
         depex_agg = depex_table.groupby(['tr_close_date'],as_index=False)['tr_amt'].sum()
-        depex_agg['tr_description'] = 'Fixture Depreciation'
-        depex_agg['tr_impacted_acc_1'] = 'PP&E - Fixtures'
-        depex_agg['tr_impacted_acc_1_sign'] = '[-ve]'
-        depex_agg['tr_impacted_acc_2'] = 'Expense - Housing'
-        depex_agg['tr_impacted_acc_2_sign'] = '[+ve]'
-        depex_agg['tr_expense'] = 'Housing Expense - Depreciation'
-
-        return self.Transactions.append(depex_agg,ignore_index=True)
+        if earlier_entry and earlier_depreciation != 0:
+            depex_agg = pd.concat([pd.DataFrame({'tr_close_date':[pd.Timestamp(start_date) - pd.Timedelta(days=1)],'tr_amt':[earlier_depreciation]}),depex_agg],ignore_index=True)
+        for column, value in entry.items():
+            depex_agg[column] = value
+        Depex_Entries += [depex_agg]
+
+    return pd.concat(Depex_Entries,ignore_index=True)
+
+@instrument
+def generate_depreciation_schedule(capex,start_date=None,end_date=None):
+
+    """This block of code expands each capex item into one depreciation entry per month of its lifetime, without
+    looping over items or months. Item i with lifetime n_i is repeated once per month of its lifetime which falls in
+    the window (start_date to end_date, if given), and its month number j is recovered from the running total of
+    those counts. The entry date is the purchase date shifted by j calendar months (see shift_months). Returns the
+    schedule and the total depreciation of the months before start_date"""
+
+    # (1) Find the months of each item's lifetime which fall in the window
+    lifetimes = np.clip(capex["tr_SKU_lifetime"].to_numpy().astype(int),0,None)    # truncated, as int() does
+    purchase_date = pd.to_datetime(capex["tr_close_date"]).to_numpy()
+    monthly_depreciation = (capex["tr_amt"] / capex["tr_SKU_lifetime"]).to_numpy()
+    lifetimes = np.where(np.isnat(purchase_date),0,lifetimes).astype(np.int64)    # undated items have no entries
+    first_month, last_month = np.ones(len(capex),dtype=np.int64), lifetimes
+    if start_date is not None:
+        first_month = np.maximum(first_month,last_month_on_or_before(purchase_date,np.datetime64(start_date,'D') - 1) + 1)
+    if end_date is not None:
+        last_month = np.minimum(last_month,last_month_on_or_before(purchase_date,np.datetime64(end_date,'D')))
+    months_in_window = np.clip(last_month - first_month + 1,0,None)
+    months_before_window = np.clip(np.minimum(first_month - 1,lifetimes),0,None)
+
+    # (2) Repeat each item once per month in the window
+    item = np.repeat(np.arange(len(capex)),months_in_window)
+    month_number = first_month[item] + np.arange(len(item)) - np.repeat(np.cumsum(months_in_window) - months_in_window,months_in_window)
+
+    # (3) Spread the purchase amount evenly over the lifetime, summing the months before the window
+    earlier = months_before_window > 0
+    earlier_depreciation = float((monthly_depreciation[earlier] * months_before_window[earlier]).sum())
+
+    return pd.DataFrame({'tr_description':capex["tr_description"].to_numpy()[item],
+                         'tr_amt':monthly_depreciation[item],
+                         'tr_close_date':shift_months(purchase_date[item],month_number)}), earlier_depreciation
+
+def shift_months(purchase_date,month_number):
+
+    """This block of code shifts datetime64 dates by month_number calendar months, with the day clamped to the end of
+    the target month (the same rule as pd.DateOffset(months=j))"""
+
+    purchase_day = purchase_date.astype('datetime64[D]')
+    purchase_month = purchase_date.astype('datetime64[M]')
+    target_month = purchase_month + month_number
+    days_in_target_month = ((target_month + 1).astype('datetime64[D]') - target_month.astype('datetime64[D]')).astype(int)
+    day_of_month = np.minimum((purchase_day - purchase_month.astype('datetime64[D]')).astype(int) + 1,days_in_target_month)
+    time_of_day = purchase_date - purchase_day
+
+    return target_month.astype('datetime64[D]') + (day_of_month - 1) + time_of_day
+
+def last_month_on_or_before(purchase_date,day):
+
+    """This block of code returns, for every purchase date, the largest month number j whose shifted date (see
+    shift_months) falls on or before day. The shifted date of j = (months from the purchase to day) is in the month of
+    day, so j is either that or one less"""
+
+    j = (np.datetime64(day,'M') - purchase_date.astype('datetime64[M]')).astype(np.int64)
+    return j - (shift_months(purchase_date,j).astype('datetime64[D]') > day)
@@ -0,0 +1,85 @@
+# This script contains a pre-aggregated cube of the income and expense flows by group, category, year and month, which
+# the trend reports query instead of re-merging and re-grouping the transaction dataset
+
+import copy
+import numpy as np
+import pandas as pd
+
+# Columns of the transactions and picklists which describe each kind of flow
+Flow_Kinds = {'income':{'label':'tr_income','name':'inc_name','grp_ID':'inc_grp_ID','grp':'inc_grp','active':'inc_is_operational'},
+              'expense':{'label':'tr_expense','name':'exp_name','grp_ID':'exp_grp_ID','grp':'exp_grp','active':'exp_is_live'}}
+
+class flow_cube(object):
+
+    """Sum and number of transactions per (label, year, month), joined to the picklist category and group"""
+    def __init__(
+            self,
+            Transactions,
+            kind,
+            Picklist,
+            Group_Picklist
+    ):
+        """Aggregates the preprocessed transactions once and then merges the (much smaller) aggregate with the
+        picklists, which gives the same sums as merging first. Labels which aren't in the picklist are kept, with no
+        category or group"""
+        self.kind = kind
+        self.columns = Flow_Kinds[kind]
+        self.Picklist = Picklist
+        self.Group_Picklist = Group_Picklist
+        label = self.columns["label"]
+
+        Flows = Transactions.groupby([label,"Tr_Year","Tr_Month"],observed=True)["tr_amt"].agg(tr_amt='sum',tr_count='size').reset_index()
+        Flows[label] = Flows[label].astype(object)
+        Cells = Flows.merge(Picklist,left_on=label,right_on=self.columns["name"],how='left')
+        Cells = Cells.merge(Group_Picklist,on=self.columns["grp_ID"],how='left')
+        Cells["Tr_Quarter"] = ((Cells["Tr_Month"] - 1) // 3 + 1).astype(np.int8)
+        self.Cells = Cells
+
+    def __len__(self):
+        return len(self.Cells)
+
+    def append(self,other):
+        """Returns a new cube with the flows of other (built against the same picklists) added to these ones. Only the
+        cells are combined; the transactions aren't rescanned"""
+        if other.kind != self.kind:
+            raise ValueError("cannot append " + other.kind + " flows to " + self.kind + " flows")
+        combined = copy.copy(self)
+        Keys = [column for column in self.Cells.columns if column not in ["tr_amt","tr_count"]]
+        combined.Cells = pd.concat([self.Cells,other.Cells],ignore_index=True).groupby(Keys,as_index=False,dropna=False,sort=False)[["tr_amt","tr_count"]].sum()
+        return combined
+
+    def rollup(self,by,active_only=True,years=None,up_to_month=None):
+        """Returns tr_amt summed by the columns in by (any of the label, category, group, Tr_Year, Tr_Quarter and
+        Tr_Month columns), sorted by them. With active_only, only operational income / live expenses are included.
+        years and up_to_month restrict the cells, e.g. years=[2022], up_to_month=6 for year-to-date figures. As in
+        DataFrame.groupby, cells with a missing key (e.g. no group) are left out"""
+        Cells = self.Cells
+        if active_only:
+            Cells = Cells[Cells[self.columns["active"]] == 1]
+        if years is not None:
+            Cells = Cells[Cells["Tr_Year"].isin(years)]
+        if up_to_month is not None:
+            Cells = Cells[Cells["Tr_Month"] <= up_to_month]
+        return Cells.groupby(by,as_index=False)["tr_amt"].sum()
+
+    def year_to_date(self,year,month,by=None):
+        """Returns tr_amt from January to month of year, summed by the columns in by (by default the group)"""
+        return self.rollup(by if by is not None else [self.columns["grp"]],years=[year],up_to_month=month)
+
+    def top_categories(self,n,years=None):
+        """Returns the n categories with the largest tr_amt, optionally within years"""
+        return self.rollup([self.columns["grp"],self.columns["name"]],years=years).nlargest(n,"tr_amt").reset_index(drop=True)
+
+    def unknown_label_count(self):
+        """Returns the number of transactions whose label has no group in the picklists"""
+        return int(self.Cells.loc[self.Cells[self.columns["grp_ID"]].isnull(),"tr_count"].sum())
+
+def pivot_by_month(List,index,values="tr_amt"):
+
+    """This block of code spreads a list summed by index + Tr_Year + Tr_Month into one column per (year, month), in the
+    layout of pd.pivot_table(...,aggfunc=[np.sum])"""
+
+    Pivot = List.set_index(index + ["Tr_Year","Tr_Month"])[values].unstack(["Tr_Year","Tr_Month"]).sort_index(axis=1)
+    Pivot.columns = pd.MultiIndex.from_tuples([("sum",values) + column for column in Pivot.columns],names=[None,None,"Tr_Year","Tr_Month"])
+
+    return Pivot
@@ -3,33 +3,31 @@
 
 import pandas as pd
 import numpy as np
+from instrumentation import instrument, report_progress
+from balance_sheet_calculations import cumulative_balance_index
+from flow_cube import pivot_by_month
 
+@instrument
 def get_revenue_trend(self):
 
-    """This block of code determines the operating revenue by month and year"""
+    """This block of code determines the operating revenue by month and year, from the income cube"""
 
-    self.Revenue_Subset = self.Transactions[~self.Transactions["tr_income"].isnull()].merge(self.Income_Picklist,left_on=["tr_income"],right_on=["inc_name"],how='left')
-    Revenue_Relevant_Dataset = self.Revenue_Subset[self.Revenue_Subset["inc_is_operational"] == 1]
-    Revenue_Relevant_Dataset = Revenue_Relevant_Dataset.merge(self.Income_Group_Picklist,on='inc_grp_ID',how='left')
-
-    self.Revenue_Breakdown = Revenue_Relevant_Dataset.groupby("inc_grp",as_index=False)["tr_amt"].sum()
+    self.Revenue_Breakdown = self.Revenue_Cube.rollup(["inc_grp"])
     self.Revenue_Breakdown["%"] = self.Revenue_Breakdown["tr_amt"]/self.Revenue_Breakdown["tr_amt"].sum()
 
-    self.Revenue_Trend = Revenue_Relevant_Dataset[["tr_amt","Tr_Year","Tr_Month"]].groupby(["Tr_Year","Tr_Month"],as_index=False)["tr_amt"].sum()
-    print('finished generating breakdown of operational revenue by month and year')
+    self.Revenue_Trend = self.Revenue_Cube.rollup(["Tr_Year","Tr_Month"])
+    report_progress('finished generating breakdown of operational revenue by month and year')
 
+@instrument
 def get_expenses_trend(self):
 
-    """This block of code determines the living expenses by month and year"""
-
-    self.Expenses_Subset = self.Transactions[~self.Transactions["tr_expense"].isnull()].merge(self.Expense_Picklist,left_on=["tr_expense"],right_on=["exp_name"],how='left')
-    Expenses_Relevant_Dataset = self.Expenses_Subset[self.Expenses_Subset["exp_is_live"] == 1]
-    Expenses_Relevant_Dataset = Expenses_Relevant_Dataset.merge(self.Expense_Group_Picklist,on=['exp_grp_ID'],how='left')
+    """This block of code determines the living expenses by month and year, from the expense cube"""
 
-    self.Expense_List = Expenses_Relevant_Dataset.groupby(['exp_grp','exp_name','Tr_Year','Tr_Month'],as_index=False)['tr_amt'].sum()
-    self.Expense_Pivot = pd.pivot_table(self.Expense_List,index=['exp_grp','exp_name'],values=['tr_amt'],columns=['Tr_Year','Tr_Month'],aggfunc=[np.sum])
-    print('finished generating breakdown of living expenses by month and year')
+    self.Expense_List = self.Expense_Cube.rollup(['exp_grp','exp_name','Tr_Year','Tr_Month'])
+    self.Expense_Pivot = pivot_by_month(self.Expense_List,['exp_grp','exp_name'])
+    report_progress('finished generating breakdown of living expenses by month and year')
 
+@instrument
 def calculate_financial_KPIs(self):
 
     """This block of code calculates primary financial KPIs based on the Class-Level Summary.
@@ -41,13 +39,63 @@ def calculate_financial_KPIs(self):
     revenue = self.Class_Level_Summary[self.Class_Level_Summary["acc_type"] == "Revenue"]["Net_Change_From_Operations"].sum()
     net_income = self.Class_Level_Summary[(self.Class_Level_Summary["acc_type"] == "Revenue") | (self.Class_Level_Summary["acc_type"] == "Gain")]["Net_Change_From_Operations"].sum() - self.Class_Level_Summary[(self.Class_Level_Summary["acc_type"] == "Expense") | (self.Class_Level_Summary["acc_type"] == "Loss")]["Net_Change_From_Operations"].sum()
     # Ratios
-    current_ratio = total_assets / total_liabilities
-    cash_ratio = liquid_net_assets / total_liabilities
-    asset_turnover = revenue / total_assets
-    net_profit_margin = net_income / revenue
-    ROA = net_income / total_assets
+    KPIs = get_KPIs(pd.DataFrame({"total_assets":[total_assets],"liquid_net_assets":[liquid_net_assets],"total_liabilities":[total_liabilities],"revenue":[revenue],"net_income":[net_income]}))
+
+    self.Summary_KPI = pd.DataFrame({'Metric':list(KPIs.columns),
+                                 'Value':list(KPIs.iloc[0])})
+
+    report_progress('finished generating breakdown of living expenses by month and year')
+
+@instrument
+def get_KPI_trend(self,frequency='M'):
+
+    """This block of code calculates the KPIs of calculate_financial_KPIs for every month (frequency='M') or week
+    (frequency='W') between Start_Date and End_Date in one pass. Balances at each period end are looked up in the
+    cumulative per-account postings (the Balance_Index shared with get_balance_sheets_as_of), and revenue and net
+    income are the change of the revenue / gain / expense / loss accounts within the period, whereas Summary_KPI uses
+    their change since the start of the ledger. Market value overwrites only apply to periods ending on End_Date"""
+
+    if getattr(self,'Balance_Index',None) is None:
+        self.Balance_Index = cumulative_balance_index(self.Postings)
+    Accounts = self.Accounts.drop_duplicates(subset=["acc_ID"])    # aligned with Balance_Index.acc_IDs
+
+    # (1) Period boundaries, clipped to the window
+    Periods = pd.period_range(start=self.start_date,end=self.end_date,freq=frequency)
+    Period_Start = pd.Series(Periods.start_time.normalize()).clip(lower=pd.Timestamp(self.start_date))
+    Period_End = pd.Series(Periods.end_time.normalize()).clip(upper=pd.Timestamp(self.end_date))
+
+    # (2) Net change of every account (rows) up to the day before the window and up to every period end (columns)
+    As_Of_Dates = [Period_Start[0] - pd.Timedelta(days=1)] + list(Period_End)
+    Change = self.Balance_Index.change_as_of(As_Of_Dates)["Net_Change"].to_numpy().reshape(len(Accounts),len(As_Of_Dates))
+    Balance = Accounts["acc_baseline_value"].to_numpy(dtype=np.float64)[:,None] + Change[:,1:]
+    Overwrite = Accounts["acc_end_value_overwrite"].to_numpy(dtype=np.float64)
+    on_end_date = (Period_End >= pd.Timestamp(self.end_date)).to_numpy()
+    Balance[:,on_end_date] = np.where(np.isnan(Overwrite)[:,None],Balance[:,on_end_date],Overwrite[:,None])
+    Flow = np.diff(Change,axis=1)
+
+    # (3) Roll the accounts up into the KPI components and calculate the ratios
+    acc_type, classification = Accounts["acc_type"].to_numpy(), Accounts["acc_A/L/E_classification"].to_numpy()
+    Components = pd.DataFrame({"total_assets":(classification == "Asset") @ Balance,
+                               "liquid_net_assets":np.isin(acc_type,["Cash","Marketable Securities"]) @ Balance,
+                               "total_liabilities":(classification == "Liability") @ Balance,
+                               "revenue":(acc_type == "Revenue") @ Flow,
+                               "net_income":(np.isin(acc_type,["Revenue","Gain"]).astype(int) - np.isin(acc_type,["Expense","Loss"])) @ Flow})
+    self.KPI_Trend = pd.concat([pd.DataFrame({"Period":Periods.astype(str),"Period_Start":Period_Start,"Period_End":Period_End}),
+                                Components,
+                                get_KPIs(Components)],axis=1)
+
+    report_progress('finished calculating KPIs for ' + str(len(Periods)) + ' periods')
+
+def get_KPIs(Components):
 
-    self.Summary_KPI = pd.DataFrame({'Metric':["liquid_net_assets minus liability","current_ratio","cash_ratio","asset_turnover","net_profit_margin","ROA"],
-                                 'Value':[liquid_net_assets-total_liabilities,current_ratio,cash_ratio,asset_turnover,net_profit_margin,ROA]})
+    """This block of code calculates the KPIs from their components, one row per period (or a single row for
+    Summary_KPI). A zero denominator (e.g. no liabilities, or a period without revenue) is treated as missing, so its
+    ratios come out as nan rather than inf"""
 
-    print('finished generating breakdown of living expenses by month and year')
+    Denominator = Components[["total_liabilities","total_assets","revenue"]].replace(0,np.nan)
+    return pd.DataFrame({"liquid_net_assets minus liability":Components["liquid_net_assets"] - Components["total_liabilities"],
+                         "current_ratio":Components["total_assets"] / Denominator["total_liabilities"],
+                         "cash_ratio":Components["liquid_net_assets"] / Denominator["total_liabilities"],
+                         "asset_turnover":Components["revenue"] / Denominator["total_assets"],
+                         "net_profit_margin":Components["net_income"] / Denominator["revenue"],
+                         "ROA":Components["net_income"] / Denominator["total_assets"]})
@@ -0,0 +1,148 @@
+# This script contains parts for preprocessing only the transactions which were added since the last run, by folding
+# them into the preprocessed transactions and per-account running balances stored by that run
+
+import datetime
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from data_ingestion import Depreciable_Expenses, Enrichment_Only_Columns, get_qc_flags, coerce_amounts, compact_transactions, build_depreciation_entries
+from input_cache import write_file_atomically
+from instrumentation import instrument, report_progress
+from posting_matrix import posting_matrix
+
+State_Format_Version = 9
+
+@instrument
+def preprocess_transactions_incrementally(self,state_dir=None):
+
+    """This block of code is a drop-in replacement for ingestion_pipeline.preprocess_transactions. Transactions are
+    identified by tr_ID and fingerprinted by a hash of their raw row. If the only differences from the stored state are
+    rows with new tr_IDs and a later End_Date, only the new rows and the rows closed between the stored End_Date and
+    the new one (with the depreciation entries of those days) are preprocessed and folded into the stored state.
+    Anything else (an edited or removed historical row, a new capex item whose depreciation changes past months,
+    changed accounts or picklists, a different Start_Date, an earlier End_Date, or missing / duplicated tr_IDs) falls
+    back to a full rebuild"""
+
+    if state_dir is None:
+        state_dir = os.path.join(self.path,'.ledger_state')
+    state_file = os.path.join(state_dir,os.path.splitext(self.filename)[0] + '.pkl')
+
+    # (1) Fingerprint the raw inputs before any column is dropped
+    Row_Hashes = pd.Series(pd.util.hash_pandas_object(self.Transactions,index=False).to_numpy(),index=self.Transactions["tr_ID"])
+    Context = get_context_fingerprint(self)
+
+    # (2) Compare against the stored state to find the new rows
+    state = load_state(state_file)
+    reason = find_rebuild_reason(state,Context,Row_Hashes,self.end_date)
+    New_Rows = None
+    if reason is None:
+        New_Rows = ~Row_Hashes.index.isin(state["Row_Hashes"].index)
+        if self.Transactions.loc[New_Rows,"tr_expense"].isin(list(Depreciable_Expenses)).any():
+            reason = 'new capex items change past depreciation entries'
+        Close_Day = pd.to_datetime(self.Transactions["tr_close_date"]).dt.normalize()
+        Newly_In_Window = (~New_Rows & (Close_Day > pd.Timestamp(state["End_Date"])) & (Close_Day <= pd.Timestamp(self.end_date))).to_numpy()
+
+    # (3a) Full rebuild
+    if reason is not None:
+        report_progress('incremental mode: full rebuild (' + reason + ')')
+        self.preprocess_transactions()
+
+    # (3b) Fold the new rows into the stored state
+    else:
+        report_progress('incremental mode: folding ' + str(New_Rows.sum()) + ' new transactions and ' + str(Newly_In_Window.sum()) + ' transactions up to the new End_Date into the stored state')
+        self.drop_unused_columns()
+        self.Transactions = coerce_amounts(self.Transactions)
+        self.Opening_Balances, self.QC_Pushed_Down_Counts = None, state["QC_Pushed_Down_Counts"]
+        Delta = self.Transactions[New_Rows | Newly_In_Window]
+        if self.end_date > state["End_Date"]:
+            # Depreciation entries of the days added to the window, on top of the stored ones
+            Depex_Entries = build_depreciation_entries(self.Transactions,state["End_Date"] + datetime.timedelta(days=1),self.end_date,earlier_entry=False)
+            Delta = pd.concat([Delta,Depex_Entries],ignore_index=True)
+        Delta = self.enrich_transactions(self.push_down_window(Delta))
+        # Rows closed after End_Date were counted against the stored End_Date, so count them again against the new one
+        self.QC_Pushed_Down_Counts['out_of_window_dates'] = int((Close_Day > pd.Timestamp(self.end_date)).sum())
+        QC_Flags = pd.concat([state["QC_Flags"],get_qc_flags(Delta)],ignore_index=True)
+        Delta = Delta.drop(columns=Enrichment_Only_Columns)
+        Transactions = pd.concat([state["Transactions"],Delta],ignore_index=True)
+        Postings = state["Postings"].append(posting_matrix(Delta,self.Accounts)).with_opening_balances(*self.Opening_Balances,self.start_date)
+
+        # Keep the transactions (and the QC flags and postings which line up with them) sorted by date
+        order = np.argsort(Transactions["Tr_Date"].to_numpy(),kind='stable')
+        self.Transactions = compact_transactions(Transactions.take(order).reset_index(drop=True))
+        self.QC_Flags = QC_Flags.take(order).reset_index(drop=True)
+        self.Postings = Postings.take(order)
+        self.Revenue_Cube, self.Expense_Cube = state["Revenue_Cube"], state["Expense_Cube"]
+        self.build_flow_cubes(Delta)
+        report_progress('finished preprocessing Transactions dataset')
+
+    # (4) Store the new state, including the per-account running balances, the income / expense cubes and the QC counts
+    # of the rows which aren't kept
+    self.Postings.net_change()
+    save_state(state_file,{"Version":State_Format_Version,
+                           "Context":Context,
+                           "End_Date":self.end_date,
+                           "Row_Hashes":Row_Hashes,
+                           "Transactions":self.Transactions,
+                           "QC_Flags":self.QC_Flags,
+                           "QC_Pushed_Down_Counts":self.QC_Pushed_Down_Counts,
+                           "Postings":self.Postings,
+                           "Revenue_Cube":self.Revenue_Cube,
+                           "Expense_Cube":self.Expense_Cube})
+
+def get_context_fingerprint(self):
+
+    """This block of code fingerprints every input other than the transactions and End_Date which affects the
+    preprocessed output. End_Date is stored separately, since moving it forward only adds to the stored state"""
+
+    digest = hashlib.sha256()
+    for df in [self.Accounts,self.Expense_Picklist,self.Expense_Group_Picklist,self.Income_Picklist,self.Income_Group_Picklist]:
+        digest.update(repr(list(df.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(df,index=False).to_numpy().tobytes())
+    digest.update(repr(self.start_date).encode())
+    digest.update(repr(Depreciable_Expenses).encode())
+
+    return digest.hexdigest()
+
+def find_rebuild_reason(state,Context,Row_Hashes,end_date):
+
+    """This block of code returns why the stored state can't be reused, or None if it can"""
+
+    if state is None:
+        return 'no stored state'
+    if state.get("Version") != State_Format_Version:
+        return 'stored state has an older format'
+    if state["Context"] != Context:
+        return 'accounts, picklists or Start_Date changed'
+    if end_date < state["End_Date"]:
+        return 'End_Date moved back'
+    if Row_Hashes.index.isnull().any() or Row_Hashes.index.duplicated().any():
+        return 'tr_ID is missing or duplicated'
+
+    Stored_Hashes = state["Row_Hashes"]
+    Current_Hashes = Row_Hashes.reindex(Stored_Hashes.index)
+    if Current_Hashes.isnull().any():
+        return 'historical transactions were removed'
+    if (Current_Hashes.to_numpy() != Stored_Hashes.to_numpy()).any():
+        return 'historical transactions were edited'
+
+    return None
+
+def load_state(state_file):
+
+    """This block of code loads the stored state, treating a missing or unreadable file as no state"""
+
+    try:
+        with open(state_file,'rb') as f:
+            return pickle.load(f)
+    except (OSError,EOFError,pickle.UnpicklingError,AttributeError,ImportError):
+        return None
+
+def save_state(state_file,state):
+
+    """This block of code writes the state through write_file_atomically, so that an interrupted (or concurrent) run
+    never leaves a half-written state behind"""
+
+    write_file_atomically(state_file,lambda f: pickle.dump(state,f,protocol=pickle.HIGHEST_PROTOCOL))
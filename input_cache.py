@@ -0,0 +1,128 @@
+# This script contains parts for reading the input workbook in a single pass and caching the parsed sheets locally,
+# so that reruns on an unchanged workbook skip Excel parsing completely
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+from instrumentation import instrument, report_progress
+
+Cache_Format_Version = 1
+
+@instrument
+def read_workbook_sheets(workbook,sheet_names,cache_dir=None):
+
+    """This block of code returns a dictionary of {sheet name: DataFrame} for the requested sheets. The workbook is
+    parsed once for all sheets (instead of once per sheet). If cache_dir is given, the parsed sheets are stored there
+    in pandas' native pickle format (which round-trips the column dtypes exactly) and reused on later runs as long as
+    the workbook's path, size, mtime and content hash are unchanged. The second return value is True on a cache hit and False on a miss"""
+
+    if cache_dir is None:
+        return pd.read_excel(workbook,sheet_name=list(sheet_names)), False
+
+    # (1) Compare the workbook's current key against the key stored alongside the cached sheets
+    key = get_workbook_key(workbook)
+    sheet_dir = os.path.join(cache_dir,hashlib.sha256((key["path"] + key["sha256"]).encode()).hexdigest()[:16])
+    cached = load_cached_sheets(sheet_dir,key,sheet_names)
+    if cached is not None:
+        report_progress("input cache hit: " + workbook)
+        return cached, True
+
+    # (2) On a miss, parse the workbook once and refresh the cache
+    report_progress("input cache miss: " + workbook)
+    sheets = pd.read_excel(workbook,sheet_name=list(sheet_names))
+    store_cached_sheets(cache_dir,sheet_dir,key,sheets)
+
+    return sheets, False
+
+def get_workbook_key(workbook):
+
+    """This block of code describes the workbook by its resolved path, size, mtime and the SHA-256 of its content. A
+    cache entry is only valid if all of these match"""
+
+    stat = os.stat(workbook)
+    digest = hashlib.sha256()
+    with open(workbook,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20),b''):
+            digest.update(block)
+
+    return {"version":Cache_Format_Version,
+            "path":os.path.abspath(workbook),
+            "size":stat.st_size,
+            "mtime_ns":stat.st_mtime_ns,
+            "sha256":digest.hexdigest()}
+
+def load_cached_sheets(sheet_dir,key,sheet_names):
+
+    """This block of code loads the cached sheets if the stored key matches the workbook's current key and every
+    requested sheet is present. Any mismatch or unreadable file is treated as a miss"""
+
+    manifest_file = os.path.join(sheet_dir,'manifest.json')
+    if not os.path.exists(manifest_file):
+        return None
+
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if manifest["key"] != key or not set(sheet_names).issubset(manifest["sheets"]):
+            return None
+        return {sheet:pd.read_pickle(os.path.join(sheet_dir,manifest["sheets"][sheet])) for sheet in sheet_names}
+    except (OSError,ValueError,KeyError,EOFError):
+        return None
+
+def store_cached_sheets(cache_dir,sheet_dir,key,sheets):
+
+    """This block of code writes the parsed sheets into a temporary directory and then swaps it into place, so that an
+    interrupted run never leaves a half-written cache entry behind. Each run gets its own temporary directory, so
+    concurrent runs on the same workbook (e.g. from batch_runner) don't write into each other's. Older entries for the
+    same workbook path are removed since they can no longer be valid"""
+
+    os.makedirs(cache_dir,exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=cache_dir,prefix=os.path.basename(sheet_dir) + '.',suffix='.tmp')
+
+    files = {}
+    for i, (sheet, df) in enumerate(sheets.items()):
+        files[sheet] = 'sheet_' + str(i) + '.pkl'
+        df.to_pickle(os.path.join(temp_dir,files[sheet]))
+    with open(os.path.join(temp_dir,'manifest.json'),'w') as f:
+        json.dump({"key":key,"sheets":files},f,indent=2)
+
+    # Remove stale entries written for the same workbook path before swapping in the new one
+    for entry in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir,entry)
+        manifest_file = os.path.join(entry_dir,'manifest.json')
+        if entry.endswith('.tmp') or not os.path.exists(manifest_file):    # other runs' entries in progress
+            continue
+        try:
+            with open(manifest_file) as f:
+                stale = json.load(f)["key"]["path"] == key["path"]
+        except (OSError,ValueError,KeyError):
+            stale = True
+        if stale:
+            shutil.rmtree(entry_dir,ignore_errors=True)
+
+    shutil.rmtree(sheet_dir,ignore_errors=True)
+    try:
+        os.replace(temp_dir,sheet_dir)
+    except OSError:
+        # A concurrent run swapped in the same entry first
+        shutil.rmtree(temp_dir,ignore_errors=True)
+
+def write_file_atomically(target_file,write):
+
+    """This block of code calls write(f) on a new temporary file next to target_file and then swaps it into place, so
+    that an interrupted run never leaves a half-written file behind. Like store_cached_sheets, each call gets its own
+    temporary file (ending in '.tmp'), so concurrent runs writing the same file don't write into each other's"""
+
+    os.makedirs(os.path.dirname(target_file),exist_ok=True)
+    handle, temp_file = tempfile.mkstemp(dir=os.path.dirname(target_file),prefix=os.path.basename(target_file) + '.',suffix='.tmp')
+    try:
+        with os.fdopen(handle,'wb') as f:
+            write(f)
+        os.replace(temp_file,target_file)
+    except BaseException:
+        os.remove(temp_file)
+        raise
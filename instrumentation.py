@@ -0,0 +1,143 @@
+# This script contains the instrumentation layer of the pipeline: every stage decorated with @instrument records its wall
+# time, CPU time, peak memory and row counts into a trace, and progress messages are routed through report_progress
+
+import functools
+import itertools
+import json
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+Trace_Enabled = False
+Trace_Memory = False
+Print_Progress = True
+Trace_Records = []
+
+_Trace_Lock = threading.Lock()
+_Open_Stages = threading.local()
+_Call_Order = itertools.count()
+
+def enable_tracing(memory=True):
+
+    """This block of code clears the trace and starts recording. With memory=True, tracemalloc is started to measure
+    each stage's peak memory, which slows the pipeline down noticeably"""
+
+    global Trace_Enabled, Trace_Memory
+    Trace_Records.clear()
+    Trace_Enabled, Trace_Memory = True, memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable_tracing():
+
+    """This block of code stops recording; the trace recorded so far is kept"""
+
+    global Trace_Enabled, Trace_Memory
+    if Trace_Memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    Trace_Enabled, Trace_Memory = False, False
+
+def instrument(function):
+
+    """This block of code wraps a pipeline stage so that, while tracing is enabled, each call appends a record to
+    Trace_Records. When tracing is disabled the wrapper only checks one flag before calling the stage. tracemalloc is
+    process-wide, so the memory of stages running concurrently (see stage_scheduler) is attributed to all of them"""
+
+    @functools.wraps(function)
+    def wrapper(*args,**kwargs):
+        if not Trace_Enabled:
+            return function(*args,**kwargs)
+
+        # (1) Open a record for this call, nested under the stage which called it (if any)
+        stack = getattr(_Open_Stages,'stack',None)
+        if stack is None:
+            stack = _Open_Stages.stack = []
+        record = {"stage":function.__qualname__,
+                  "order":next(_Call_Order),
+                  "parent":stack[-1]["stage"] if stack else None,
+                  "depth":len(stack),
+                  "rows_in":count_rows(args,None),
+                  "messages":[]}
+        if Trace_Memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["_peak"] = max(stack[-1]["_peak"],peak)    # keep the caller's peak before it is reset
+            tracemalloc.reset_peak()
+            record["_start_memory"], record["_peak"] = current, 0
+        stack.append(record)
+        wall, cpu = time.perf_counter(), time.process_time()
+
+        # (2) Run the stage and close the record, even if the stage fails (a failed stage has no rows_out)
+        status, result = 'failed', None
+        try:
+            result = function(*args,**kwargs)
+            status = 'succeeded'
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            record["status"] = status
+            record["rows_out"] = count_rows(args,result) if status == 'succeeded' else None
+            stack.pop()
+            if Trace_Memory:
+                peak = max(tracemalloc.get_traced_memory()[1],record.pop("_peak"))
+                record["peak_memory_delta_mb"] = (peak - record.pop("_start_memory")) / 2**20
+                if stack:
+                    stack[-1]["_peak"] = max(stack[-1]["_peak"],peak)
+            with _Trace_Lock:
+                Trace_Records.append(record)
+
+        return result
+
+    return wrapper
+
+def count_rows(args,result):
+
+    """This block of code returns the row count which best describes a stage's data: the DataFrame it was given or
+    returned, or else the pipeline object's Transactions"""
+
+    for value in [result] + list(args[1:]):
+        if isinstance(value,pd.DataFrame):
+            return len(value)
+    Transactions = getattr(args[0],'Transactions',None) if args else None
+    return len(Transactions) if isinstance(Transactions,pd.DataFrame) else None
+
+def report_progress(message):
+
+    """This block of code prints a progress message (unless Print_Progress is off) and, while tracing, attaches it to
+    the record of the stage which is currently running"""
+
+    if Print_Progress:
+        print(message)
+    if Trace_Enabled:
+        stack = getattr(_Open_Stages,'stack',None)
+        if stack:
+            stack[-1]["messages"] += [message]
+
+def write_trace(trace_file):
+
+    """This block of code writes the trace as JSON, in the order in which the stages finished"""
+
+    with _Trace_Lock:
+        Records = list(Trace_Records)
+    with open(trace_file,'w') as f:
+        json.dump({"stages":Records},f,indent=2,default=str)
+
+def summarize_trace():
+
+    """This block of code returns the trace as a table with one row per stage in call order (nested stages indented),
+    summing repeated calls and counting the failed ones"""
+
+    with _Trace_Lock:
+        Trace = pd.DataFrame(list(Trace_Records))
+    if Trace.empty:
+        return Trace
+    Trace["failed"] = Trace["status"] == 'failed'
+    Aggregations = {"order":("order","min"),"calls":("stage","size"),"failed_calls":("failed","sum"),"depth":("depth","min"),"wall_seconds":("wall_seconds","sum"),"cpu_seconds":("cpu_seconds","sum"),"rows_out":("rows_out","max")}
+    if "peak_memory_delta_mb" in Trace.columns:
+        Aggregations["peak_memory_delta_mb"] = ("peak_memory_delta_mb","max")
+    Summary = Trace.groupby("stage",as_index=False).agg(**Aggregations).sort_values(by=["order"])
+    Summary["stage"] = ["  " * depth + stage for stage, depth in zip(Summary["stage"],Summary["depth"])]
+
+    return Summary.drop(columns=["order","depth"]).reset_index(drop=True)
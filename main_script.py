@@ -11,10 +11,14 @@ Created on Sat Sep  4 20:55:14 2021
 
 import datetime
 from data_ingestion import ingestion_pipeline
-from balance_sheet_calculations import get_account_level_balance_sheet, get_account_type_level_balance_sheet, get_overall_balance_sheet
-from income_statement_calculations import get_revenue_trend, get_expenses_trend, calculate_financial_KPIs
-from run_qc_tests import verify_accounting_equation, ensure_closing_date_is_later_than_initiation_dates, ensure_no_non_standard_account_names
+from incremental_ledger import preprocess_transactions_incrementally
+from stage_scheduler import build_pipeline_stages, run_pipeline
+from streaming_ingestion import streaming_pipeline
+from balance_sheet_calculations import get_account_level_balance_sheet, get_account_type_level_balance_sheet, get_overall_balance_sheet, get_balance_sheets_as_of
+from income_statement_calculations import get_revenue_trend, get_expenses_trend, calculate_financial_KPIs, get_KPI_trend
+from run_qc_tests import verify_accounting_equation, run_qc_checks
 from output_generation import generate_csv_outputs
+from instrumentation import enable_tracing, disable_tracing, write_trace, summarize_trace
 
 ##############################################################################################################
 
@@ -29,7 +33,27 @@ filename = 'Data Structure.xlsx'
 
 # Part 3: Main script
 
-def main(path,filename,Start_Date,End_Date):
+def main(path,filename,Start_Date,End_Date,As_Of_Dates=None,incremental=False,scheduled=False,trace_file=None,output_format='xlsx',kpi_frequency='M'):
+
+    # Record per-stage timing, memory and row counts into a JSON trace, if requested
+    run_with_trace(trace_file,run_pipeline_stages,path,filename,Start_Date,End_Date,As_Of_Dates,incremental,scheduled,output_format,kpi_frequency)
+
+def run_with_trace(trace_file,run_stages,*args):
+
+    # Without a trace_file, the stages run untraced
+    if trace_file is None:
+        run_stages(*args)
+        return
+
+    enable_tracing()
+    try:
+        run_stages(*args)
+    finally:
+        disable_tracing()
+        write_trace(trace_file)
+        print(summarize_trace().to_string(index=False))
+
+def run_pipeline_stages(path,filename,Start_Date,End_Date,As_Of_Dates,incremental,scheduled,output_format,kpi_frequency):
 
     # (1) Initialization & cleaning
     data_path = path
@@ -41,6 +65,60 @@ def main(path,filename,Start_Date,End_Date):
         filename=filename,
         start_date=Start_Date,
         end_date=End_Date)
+
+    # Alternatively, run steps (1) to (6) as a DAG, with independent stages in parallel and unchanged stages skipped
+    if scheduled:
+        run_pipeline(datasets,build_pipeline_stages(incremental,As_Of_Dates,output_format,kpi_frequency))
+        print("run completed")
+        return
+
+    if incremental:
+        preprocess_transactions_incrementally(datasets)
+    else:
+        datasets.preprocess_transactions()
+
+    # (2) Get balance sheet level items
+    get_account_level_balance_sheet(datasets)
+    get_account_type_level_balance_sheet(datasets)
+    get_overall_balance_sheet(datasets)
+    if As_Of_Dates is not None:
+        get_balance_sheets_as_of(datasets,As_Of_Dates)
+
+    # (3) Get revenue and expense trends
+    get_revenue_trend(datasets)
+    get_expenses_trend(datasets)
+
+    # (4) Ratio calculations, at End_Date and for every month (or week) of the window
+    calculate_financial_KPIs(datasets)
+    get_KPI_trend(datasets,kpi_frequency)
+
+    # (5) Run QC tests (results in datasets.QC_Results, QC_Offending_Rows and QC_Equation_Breakdown)
+    run_qc_checks(datasets)
+
+    # (6) Generate output files (Output.xlsx, or one CSV / Parquet file per report)
+    generate_csv_outputs(datasets,output_format)
+
+    print("run completed")
+
+def main_streaming(path,filename,transactions_file,Start_Date,End_Date,chunksize=100000,output_format='xlsx',trace_file=None):
+
+    """Same reports as main, with the transactions streamed in chunks from a CSV / Parquet log (transactions_file)
+    instead of the workbook's Transactions sheet. The KPI trend and the checks which need every transaction row
+    (non-chronological dates and non-standard names) are not run in this mode"""
+
+    # Record per-stage timing, memory and row counts into a JSON trace, if requested
+    run_with_trace(trace_file,run_streaming_stages,path,filename,transactions_file,Start_Date,End_Date,chunksize,output_format)
+
+def run_streaming_stages(path,filename,transactions_file,Start_Date,End_Date,chunksize,output_format):
+
+    # (1) Initialization & streaming the transactions
+    datasets = streaming_pipeline(
+        path=path,
+        filename=filename,
+        transactions_file=transactions_file,
+        start_date=Start_Date,
+        end_date=End_Date,
+        chunksize=chunksize)
     datasets.preprocess_transactions()
 
     # (2) Get balance sheet level items
@@ -57,11 +135,9 @@ def main(path,filename,Start_Date,End_Date):
 
     # (5) Run QC tests
     verify_accounting_equation(datasets)
-    ensure_closing_date_is_later_than_initiation_dates(datasets)
-    ensure_no_non_standard_account_names(datasets)
 
-    # (6) Generate output files
-    generate_csv_outputs(datasets)
+    # (6) Generate output files (Output.xlsx, or one CSV / Parquet file per report)
+    generate_csv_outputs(datasets,output_format)
 
     print("run completed")
 
@@ -1,22 +1,204 @@
-# This script writes the output to a local location
+# This script writes the output to a local location, as one Excel workbook or as one CSV / Parquet file per report
 
+import datetime
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
+from instrumentation import instrument, report_progress
+
+# Reports written by generate_csv_outputs, as (sheet / file name, pipeline attribute). Reports whose attribute isn't
+# set (e.g. the as-of balance sheets when no As_Of_Dates were given) are left out
+Report_Sheets = [('Overall','BS_Level_Summary'),
+                 ('Class','Class_Level_Summary'),
+                 ('Account','Acct_Level_Summary'),
+                 ('Revenue_Breakdown','Revenue_Breakdown'),
+                 ('Revenue_Trend','Revenue_Trend'),
+                 ('Expenses_Trend','Expense_Pivot'),
+                 ('Summary_KPI','Summary_KPI'),
+                 ('KPI_Trend','KPI_Trend'),
+                 ('Overall_As_Of','BS_Level_Summary_As_Of'),
+                 ('Class_As_Of','Class_Level_Summary_As_Of'),
+                 ('Account_As_Of','Acct_Level_Summary_As_Of')]
+
+Output_Manifest = '.output_manifest.json'
+
+@instrument
+def generate_csv_outputs(self,output_format='xlsx',output_dir=None,max_workers=4,skip_unchanged=True):
+
+    """This block of code writes the reports in output_format: 'xlsx' writes every report to a sheet of Output.xlsx
+    (by default next to the workbook), 'csv' and 'parquet' write one file per report (by default into an 'Output'
+    folder next to the workbook), several at a time. With skip_unchanged, a content hash of every report is kept in
+    the output folder, and files whose reports haven't changed since the last run aren't rewritten"""
+
+    if output_format not in Output_Writers:
+        raise ValueError("unknown output format '" + str(output_format) + "', expected one of: " + ", ".join(Output_Writers))
+    if output_dir is None:
+        output_dir = self.path if output_format == 'xlsx' else os.path.join(self.path,'Output')
+    os.makedirs(output_dir,exist_ok=True)
+
+    # (1) Collect the reports and hash their content
+    Reports = [(sheet,getattr(self,attribute)) for sheet, attribute in Report_Sheets if getattr(self,attribute,None) is not None]
+    Hashes = {sheet:get_report_hash(Report) for sheet, Report in Reports}
+
+    # (2) Write the files whose content changed (or which are missing)
+    Manifest = load_manifest(output_dir) if skip_unchanged else {}
+    Written, Skipped = Output_Writers[output_format](Reports,Hashes,Manifest,output_dir,max_workers)
+    save_manifest(output_dir,Manifest)
+
+    report_progress("finish writing outputs (" + str(len(Written)) + " written, " + str(len(Skipped)) + " unchanged)")
+
+def write_excel_outputs(Reports,Hashes,Manifest,output_dir,max_workers):
+
+    """This block of code writes all reports to Output.xlsx, unless none of them changed. The workbook is written with
+    xlsxwriter's constant_memory mode, which flushes each row to disk once the next one starts, so memory doesn't
+    grow with the size of the reports"""
+
+    import xlsxwriter
+
+    output_file = os.path.join(output_dir,'Output.xlsx')
+    workbook_hash = hashlib.sha256(json.dumps(Hashes).encode()).hexdigest()
+    if Manifest.get('Output.xlsx') == workbook_hash and os.path.exists(output_file):
+        return [], ['Output.xlsx']
+
+    workbook = xlsxwriter.Workbook(output_file,{'constant_memory':True})
+    Formats = {'header':workbook.add_format({'bold':True,'border':1,'align':'center'}),
+               'datetime':workbook.add_format({'num_format':'yyyy-mm-dd hh:mm:ss'}),
+               'date':workbook.add_format({'num_format':'yyyy-mm-dd'})}
+    for sheet, Report in Reports:
+        write_excel_sheet(workbook.add_worksheet(sheet),Report,Formats)
+    workbook.close()
+    Manifest['Output.xlsx'] = workbook_hash
+
+    return ['Output.xlsx'], []
+
+def write_excel_sheet(worksheet,Report,Formats):
+
+    """This block of code writes one report in the layout of DataFrame.to_excel (index columns on the left, one header
+    row per column level), strictly row by row as constant_memory mode requires. Cells aren't merged"""
+
+    n_index = Report.index.nlevels
+    Index_Names = [name if name is not None else '' for name in Report.index.names]
+
+    # (1) Header rows: one per column level, then the index names if the columns have several levels. Like the merged
+    # cells of DataFrame.to_excel, an outer column label is only written on the first column of its group
+    row = 0
+    for level in range(Report.columns.nlevels):
+        if Report.columns.nlevels > 1:
+            Shown_Columns = [None if level < Report.columns.nlevels - 1 and i > 0 and labels[:level + 1] == Report.columns[i - 1][:level + 1] else labels[level] for i, labels in enumerate(Report.columns)]
+            Labels = [''] * (n_index - 1) + [Report.columns.names[level] or ''] + Shown_Columns
+        else:
+            Labels = Index_Names + list(Report.columns)
+        write_excel_row(worksheet,row,Labels,Formats,Formats['header'])
+        row += 1
+    if Report.columns.nlevels > 1 and any(Index_Names):
+        write_excel_row(worksheet,row,Index_Names,Formats,Formats['header'])
+        row += 1
+
+    # (2) One row per record, index first. Like the merged cells of DataFrame.to_excel, an outer index label is only
+    # written on the first row of its group
+    previous = ()
+    for record in Report.itertuples(index=True,name=None):
+        Index_Values = list(record[0]) if n_index > 1 else [record[0]]
+        Shown_Index = [None if level < n_index - 1 and tuple(Index_Values[:level + 1]) == previous[:level + 1] else value for level, value in enumerate(Index_Values)]
+        write_excel_row(worksheet,row,Shown_Index + list(record[1:]),Formats)
+        previous = tuple(Index_Values)
+        row += 1
+
+def write_excel_row(worksheet,row,Values,Formats,cell_format=None):
+
+    """This block of code writes one row of values, leaving missing values blank and writing infinite ones as 'inf' /
+    '-inf', as DataFrame.to_excel does (xlsxwriter can't write them as numbers)"""
+
+    for column, value in enumerate(Values):
+        if value is None or value is pd.NaT or value is pd.NA or (isinstance(value,(float,np.floating)) and value != value):
+            continue
+        if isinstance(value,(float,np.floating)) and np.isinf(value):
+            worksheet.write_string(row,column,'inf' if value > 0 else '-inf',cell_format)
+        elif isinstance(value,datetime.datetime):
+            worksheet.write_datetime(row,column,value.to_pydatetime() if isinstance(value,pd.Timestamp) else value,Formats['datetime'])
+        elif isinstance(value,datetime.date):
+            worksheet.write_datetime(row,column,value,Formats['date'])
+        elif hasattr(value,'item'):    # numpy scalars
+            worksheet.write(row,column,value.item(),cell_format)
+        else:
+            worksheet.write(row,column,value,cell_format)
+
+def write_csv_outputs(Reports,Hashes,Manifest,output_dir,max_workers):
+
+    """This block of code writes each changed report to <sheet>.csv, several at a time"""
+
+    return write_file_outputs(Reports,Hashes,Manifest,output_dir,max_workers,'.csv',lambda Report, output_file: Report.to_csv(output_file))
+
+def write_parquet_outputs(Reports,Hashes,Manifest,output_dir,max_workers):
+
+    """This block of code writes each changed report to <sheet>.parquet, several at a time. Parquet needs one level of
+    string column names, so multi-level columns (e.g. Expenses_Trend) are joined with '_'. Requires pyarrow"""
+
+    return write_file_outputs(Reports,Hashes,Manifest,output_dir,max_workers,'.parquet',lambda Report, output_file: flatten_columns(Report).to_parquet(output_file))
+
+def write_file_outputs(Reports,Hashes,Manifest,output_dir,max_workers,extension,write_report):
+
+    """This block of code writes one file per report with write_report on a thread pool, skipping the reports whose
+    hash matches the manifest"""
+
+    Pending = [(sheet + extension,Report,Hashes[sheet]) for sheet, Report in Reports]
+    Skipped = [file for file, Report, report_hash in Pending if Manifest.get(file) == report_hash and os.path.exists(os.path.join(output_dir,file))]
+    Pending = [(file,Report,report_hash) for file, Report, report_hash in Pending if file not in Skipped]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(lambda job: write_report(job[1],os.path.join(output_dir,job[0])),Pending))    # re-raises any failure
+    for file, Report, report_hash in Pending:
+        Manifest[file] = report_hash
+
+    return [file for file, Report, report_hash in Pending], Skipped
+
+def flatten_columns(Report):
+
+    """This block of code returns the report with string column names, joining the levels of multi-level columns"""
+
+    Flat = Report.copy(deep=False)
+    if Report.columns.nlevels > 1:
+        Flat.columns = ['_'.join(str(label) for label in labels) for labels in Report.columns]
+    else:
+        Flat.columns = [str(label) for label in Report.columns]
+
+    return Flat
+
+def get_report_hash(Report):
+
+    """This block of code hashes a report's content, including its column names, dtypes and index"""
+
+    digest = hashlib.sha256()
+    digest.update(repr(list(Report.columns)).encode())
+    digest.update(repr(list(Report.index.names)).encode())
+    digest.update(repr(list(Report.dtypes)).encode())
+    digest.update(pd.util.hash_pandas_object(Report,index=True).to_numpy().tobytes())
+
+    return digest.hexdigest()
+
+def load_manifest(output_dir):
+
+    """This block of code loads the report hashes of the last run, treating a missing or unreadable file as empty"""
 
-def generate_csv_outputs(self):
+    try:
+        with open(os.path.join(output_dir,Output_Manifest)) as f:
+            return json.load(f)
+    except (OSError,ValueError):
+        return {}
 
-    # Create a Pandas Excel writer using XlsxWriter as the engine.
-    writer = pd.ExcelWriter(self.path+'Output.xlsx', engine='xlsxwriter')
+def save_manifest(output_dir,Manifest):
 
-    # Write each dataframe to a different worksheet
-    self.BS_Level_Summary.to_excel(writer, sheet_name='Overall')
-    self.Class_Level_Summary.to_excel(writer, sheet_name='Class')
-    self.Acct_Level_Summary.to_excel(writer, sheet_name='Account')
-    self.Revenue_Breakdown.to_excel(writer, sheet_name='Revenue_Breakdown')
-    self.Revenue_Trend.to_excel(writer, sheet_name='Revenue_Trend')
-    self.Expense_Pivot.to_excel(writer,sheet_name='Expenses_Trend')
-    self.Summary_KPI.to_excel(writer,sheet_name='Summary_KPI')
+    """This block of code writes the report hashes to a temporary file and then swaps it into place"""
 
-    # Close the Pandas Excel writer and output the Excel file.
-    writer.save()
+    manifest_file = os.path.join(output_dir,Output_Manifest)
+    with open(manifest_file + '.tmp','w') as f:
+        json.dump(Manifest,f,indent=2)
+    os.replace(manifest_file + '.tmp',manifest_file)
 
-    print("finish writing outputs")
+Output_Writers = {'xlsx':write_excel_outputs,
+                  'csv':write_csv_outputs,
+                  'parquet':write_parquet_outputs}
@@ -0,0 +1,104 @@
+# This script contains a compact, integer-coded representation of the double-entry postings in the transaction dataset,
+# which the balance sheet and QC functions share instead of re-filtering the transactions
+
+import copy
+import numpy as np
+import pandas as pd
+
+class posting_matrix(object):
+
+    """Both legs of every transaction as dense account codes, signs and amounts"""
+    def __init__(
+            self,
+            Transactions,
+            Accounts
+    ):
+        """Encodes the preprocessed transactions once. Account codes index into acc_IDs (the accounts listed in
+        Accounts), with -1 for accounts that are missing or unknown; signs are +1 / -1, with 0 for unknown tokens;
+        missing amounts are stored as 0. Opening balances (postings before detail_start, which are only kept as
+        per-account totals) are added with with_opening_balances"""
+        self.acc_IDs = Accounts["acc_ID"].drop_duplicates().to_numpy()
+        Account_Index = pd.Index(self.acc_IDs)
+
+        self.code_1 = Account_Index.get_indexer(Transactions["Impacted_Acc_ID_1"]).astype(np.int32)
+        self.code_2 = Account_Index.get_indexer(Transactions["Impacted_Acc_ID_2"]).astype(np.int32)
+        self.sign_1 = sign_to_vector(Transactions["Impacted_Acc_1_Sign"])
+        self.sign_2 = sign_to_vector(Transactions["Impacted_Acc_2_Sign"])
+        self.amount_1 = np.nan_to_num(Transactions["Impacted_Acc_1_Mag"].to_numpy(dtype=np.float64))
+        self.amount_2 = np.nan_to_num(Transactions["Impacted_Acc_2_Mag"].to_numpy(dtype=np.float64))
+        self.day = pd.to_datetime(Transactions["Tr_Date"]).to_numpy().astype('datetime64[D]')
+        self.Opening = (np.zeros(len(self.acc_IDs)),np.zeros(len(self.acc_IDs),dtype=np.int64))
+        self.detail_start = None
+        self.Totals = None
+        self.net_change()
+
+    def __len__(self):
+        return len(self.code_1)
+
+    def legs(self):
+        """Returns (code, signed amount, day) for the postings of both legs that map to a known account. The legs of
+        each transaction are interleaved, so the postings keep the order of the transactions (e.g. by date)"""
+        code = np.stack([self.code_1,self.code_2],axis=1).ravel()
+        change = np.stack([self.sign_1 * self.amount_1,self.sign_2 * self.amount_2],axis=1).ravel()
+        day = np.repeat(self.day,2)
+        known = code >= 0
+        return code[known], change[known], day[known]
+
+    def net_change(self):
+        """Returns the net change and the number of postings of every account in acc_IDs. These running totals are
+        computed once on construction and then carried along by append"""
+        if self.Totals is None:
+            code, change, _ = self.legs()
+            self.Totals = (np.bincount(code,weights=change,minlength=len(self.acc_IDs)),np.bincount(code,minlength=len(self.acc_IDs)))
+        return self.Totals
+
+    def append(self,other):
+        """Returns a new posting matrix with the postings of other (encoded against the same acc_IDs) added after these
+        ones. The running totals are folded from both parts instead of being recomputed over all postings"""
+        if not np.array_equal(self.acc_IDs,other.acc_IDs):
+            raise ValueError("cannot append postings encoded against different accounts")
+        combined = copy.copy(self)
+        for attribute in ['code_1','code_2','sign_1','sign_2','amount_1','amount_2','day']:
+            setattr(combined,attribute,np.concatenate([getattr(self,attribute),getattr(other,attribute)]))
+        (Net_Change, Postings_Count), (Delta_Net_Change, Delta_Postings_Count) = self.net_change(), other.net_change()
+        combined.Totals = (Net_Change + Delta_Net_Change,Postings_Count + Delta_Postings_Count)
+        combined.Opening = (self.Opening[0] + other.Opening[0],self.Opening[1] + other.Opening[1])
+        combined.detail_start = self.detail_start if self.detail_start is not None else other.detail_start
+        return combined
+
+    def with_opening_balances(self,Net_Change,Postings_Count,detail_start):
+        """Returns a copy with the per-account net change and number of postings dated before detail_start added to
+        the opening balances and running totals. Those postings aren't kept individually, so the legs only cover
+        detail_start onwards"""
+        combined = copy.copy(self)
+        combined.Opening = (self.Opening[0] + Net_Change,self.Opening[1] + Postings_Count)
+        combined.Totals = (self.net_change()[0] + Net_Change,self.net_change()[1] + Postings_Count)
+        combined.detail_start = np.datetime64(detail_start,'D')
+        return combined
+
+    def take(self,positions):
+        """Returns a copy with the postings reordered / selected by positions, e.g. to follow the transactions when
+        they are re-sorted. The running totals are kept, so positions should select every posting"""
+        reordered = copy.copy(self)
+        for attribute in ['code_1','code_2','sign_1','sign_2','amount_1','amount_2','day']:
+            setattr(reordered,attribute,getattr(self,attribute)[positions])
+        return reordered
+
+    def totals_only(self):
+        """Returns a copy which keeps the running totals but none of the postings, so that totals can be folded chunk
+        by chunk with append in bounded memory"""
+        self.net_change()
+        summary = copy.copy(self)
+        for attribute in ['code_1','code_2','sign_1','sign_2','amount_1','amount_2','day']:
+            setattr(summary,attribute,getattr(self,attribute)[:0])
+        return summary
+
+    def unmapped_rows(self):
+        """Returns a boolean mask of the transactions with at least one leg that doesn't map to a known account"""
+        return (self.code_1 < 0) | (self.code_2 < 0)
+
+def sign_to_vector(Signs):
+
+    """This block of code maps the sign tokens to +1 / -1, and anything else to 0"""
+
+    return np.select([Signs == "[+ve]",Signs == "[-ve]"],[1,-1],default=0).astype(np.int8)
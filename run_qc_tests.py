@@ -1,37 +1,141 @@
 # This script performs various data checks
 
+import numpy as np
+import pandas as pd
+from instrumentation import instrument, report_progress
+from posting_matrix import sign_to_vector
+
+@instrument
 def verify_accounting_equation(self):
 
     """Check if the accounting equation: asset = liability + equity is preserved"""
 
-    LHS = self.Class_Level_Summary[(self.Class_Level_Summary["acc_A/L/E_classification"]=="Asset") & (self.Class_Level_Summary["acc_A/L/E_sign"]=="[+ve]")]["End_Value_Overwrite"].sum() - self.Class_Level_Summary[(self.Class_Level_Summary["acc_A/L/E_classification"]=="Asset") & (self.Class_Level_Summary["acc_A/L/E_sign"]=="[-ve]")]["End_Value_Overwrite"].sum()
-    RHS = self.Class_Level_Summary[(self.Class_Level_Summary["acc_A/L/E_classification"]!="Asset") & (self.Class_Level_Summary["acc_A/L/E_sign"]=="[+ve]")]["End_Value_Overwrite"].sum() - self.Class_Level_Summary[(self.Class_Level_Summary["acc_A/L/E_classification"]!="Asset") & (self.Class_Level_Summary["acc_A/L/E_sign"]=="[-ve]")]["End_Value_Overwrite"].sum()
+    Imbalance = get_accounting_equation_imbalance(self.Class_Level_Summary)
 
-    if abs(LHS - RHS) < 0.01:
-        print("(1) ✓ Accounting Equation Preserved")
+    if abs(Imbalance) < 0.01:
+        report_progress("(1) ✓ Accounting Equation Preserved")
     else:
-        print("(1) ❌ Account Equation Violated")
+        report_progress("(1) ❌ Account Equation Violated")
 
-def ensure_closing_date_is_later_than_initiation_dates(self):
+# Checks evaluated by run_qc_checks, with their severity. Errors make the reports wrong; warnings are worth a look
+QC_Checks = {'accounting_equation':'error',
+             'non_chronological_dates':'error',
+             'non_standard_account_names':'error',
+             'unknown_sign_tokens':'error',
+             'missing_amounts':'error',
+             'non_numeric_amounts':'error',
+             'undated_transactions':'error',
+             'duplicate_tr_IDs':'error',
+             'zero_amounts':'warning',
+             'duplicate_transactions':'warning',
+             'out_of_window_dates':'warning'}
 
-    """Check if closing date is always later than initial date in the transaction dataset"""
+# Columns which identify a transaction's content, for finding duplicates entered under different (or no) tr_IDs
+Duplicate_Key_Columns = ['tr_description','tr_amt','Tr_Date','Impacted_Acc_1','Impacted_Acc_1_Sign','Impacted_Acc_2','Impacted_Acc_2_Sign']
 
-    Non_chronological_dates = len(self.Transactions_temp_2[self.Transactions_temp_2["tr_close_date"] < self.Transactions_temp_2["tr_init_date"]])
+@instrument
+def run_qc_checks(self):
 
-    if Non_chronological_dates > 0:
-        print("(2) ❌ Non-chronological dates detected")
-    else:
-        print("(2) ✓ Dates Are Chronological")
+    """This block of code evaluates every check in QC_Checks in one pass over the preprocessed transactions, reusing
+    the encoded postings and QC flags rather than re-filtering the tables once per check. It sets
+    (1) QC_Results: one row per check with its severity, whether it passed and the number of offending rows,
+    (2) QC_Offending_Rows: {check: positions of the offending rows in Transactions}, and
+    (3) QC_Equation_Breakdown: each account's signed contribution to either side of the accounting equation.
+    Offending rows which preprocessing didn't keep (undated rows, rows closed after End_Date, and rows before
+    Start_Date which only went into the opening balances) are only counted, from QC_Pushed_Down_Counts"""
 
-def ensure_no_non_standard_account_names(self):
+    T = self.Transactions
 
-    """Check if there are non-standard account names in the transaction dataset"""
+    # (1) Flag the offending transactions of every row-level check
+    Flags = {'non_chronological_dates':self.QC_Flags["Non_Chronological"].to_numpy(),
+             'non_standard_account_names':self.Postings.unmapped_rows()
+                                          | get_unknown_labels(T["tr_income"],self.Income_Picklist,"inc_name","inc_grp_ID")
+                                          | get_unknown_labels(T["tr_expense"],self.Expense_Picklist,"exp_name","exp_grp_ID"),
+             'unknown_sign_tokens':(self.Postings.sign_1 == 0) | (self.Postings.sign_2 == 0),
+             'missing_amounts':self.QC_Flags["Missing_Amount"].to_numpy(),
+             'non_numeric_amounts':self.QC_Flags["Non_Numeric_Amount"].to_numpy(),
+             'undated_transactions':np.zeros(len(T),dtype=bool),    # none of them are kept
+             'duplicate_tr_IDs':(T["tr_ID"].duplicated(keep=False) & T["tr_ID"].notnull()).to_numpy(),
+             'zero_amounts':T["tr_amt"].to_numpy() == 0,
+             'duplicate_transactions':pd.Series(pd.util.hash_pandas_object(T[Duplicate_Key_Columns],index=False).to_numpy()).duplicated(keep=False).to_numpy(),
+             'out_of_window_dates':np.zeros(len(T),dtype=bool)}    # none of them are kept
+    self.QC_Offending_Rows = {check:np.flatnonzero(Flag) for check, Flag in Flags.items()}
 
-    Non_standard_acc_names = len(self.Transactions_temp_2[(self.Transactions_temp_2["Impacted_Acc_ID_1"].isnull()) | (self.Transactions_temp_2["Impacted_Acc_2"].isnull())])
-    Non_standard_rev_names = len(self.Revenue_Subset[self.Revenue_Subset["inc_grp_ID"].isnull()])
-    Non_standard_exp_names = len(self.Expenses_Subset[self.Expenses_Subset["exp_grp_ID"].isnull()])
+    # (2) Break the accounting equation down by account
+    self.QC_Equation_Breakdown = get_accounting_equation_breakdown(self.Acct_Level_Summary)
+    Imbalance = get_accounting_equation_imbalance(self.Class_Level_Summary)
 
-    if Non_standard_acc_names + Non_standard_rev_names + Non_standard_exp_names > 0:
-        print("(3) ❌ Non-standard account names detected")
-    else:
-        print("(3) ✓ Account names are standardized")
+    # (3) Collect the results, in the order of QC_Checks
+    Pushed_Down = self.QC_Pushed_Down_Counts if getattr(self,'QC_Pushed_Down_Counts',None) is not None else pd.Series(dtype=np.int64)
+    Counts = {check:len(Rows) + int(Pushed_Down.get(check,0)) for check, Rows in self.QC_Offending_Rows.items()}
+    Counts['accounting_equation'] = int(abs(Imbalance) >= 0.01)
+    self.QC_Results = pd.DataFrame({"check":list(QC_Checks),
+                                    "severity":list(QC_Checks.values()),
+                                    "passed":[Counts[check] == 0 for check in QC_Checks],
+                                    "count":[Counts[check] for check in QC_Checks]})
+    self.QC_Results["detail"] = [get_result_detail(check,count,len(T),int(Pushed_Down.get(check,0)),Imbalance) for check, count in zip(self.QC_Results["check"],self.QC_Results["count"])]
+
+    for number, result in enumerate(self.QC_Results.itertuples(index=False),start=1):
+        mark = "✓" if result.passed else ("❌" if result.severity == 'error' else "⚠")
+        report_progress("(" + str(number) + ") " + mark + " " + result.check + ": " + result.detail)
+
+def get_result_detail(check,count,n_transactions,pushed_down,Imbalance):
+
+    """This block of code describes one check's result, e.g. '3 of 1200 transactions, plus 2 undated or before
+    Start_Date'. The rows counted by out_of_window_dates are the ones closed after End_Date"""""
+
+    if check == 'accounting_equation':
+        return "imbalance of " + format(round(Imbalance,2) + 0.0,',.2f')
+    detail = str(count - pushed_down) + " of " + str(n_transactions) + " transactions"
+    if pushed_down > 0:
+        detail += ", plus " + str(pushed_down) + (" closed after End_Date" if check == 'out_of_window_dates' else " undated or before Start_Date")
+    return detail
+
+def count_pushed_down_offenders(self,Pushed_Down,Duplicate_ID):
+
+    """This block of code counts the offending rows of the row-level error checks among the raw transactions which
+    preprocessing doesn't keep (e.g. the rows before Start_Date, which only go into the opening balances), for
+    QC_Pushed_Down_Counts. Duplicate_ID flags the rows whose tr_ID is shared with any other row up to End_Date.
+    Generated entries (e.g. depreciation) may lack some of the columns, which then flag nothing"""
+
+    No_Values = pd.Series(np.nan,index=Pushed_Down.index,dtype=object)
+    Known_Accounts = self.Accounts.loc[self.Accounts["acc_ID"].notnull(),"acc_name"]
+    Flags = {'non_chronological_dates':(pd.to_datetime(Pushed_Down.get("tr_close_date",No_Values)) < pd.to_datetime(Pushed_Down.get("tr_init_date",No_Values))).to_numpy(),
+             'non_standard_account_names':~Pushed_Down["tr_impacted_acc_1"].isin(Known_Accounts).to_numpy()
+                                          | ~Pushed_Down["tr_impacted_acc_2"].isin(Known_Accounts).to_numpy()
+                                          | get_unknown_labels(Pushed_Down.get("tr_income",No_Values),self.Income_Picklist,"inc_name","inc_grp_ID")
+                                          | get_unknown_labels(Pushed_Down.get("tr_expense",No_Values),self.Expense_Picklist,"exp_name","exp_grp_ID"),
+             'unknown_sign_tokens':(sign_to_vector(Pushed_Down["tr_impacted_acc_1_sign"]) == 0) | (sign_to_vector(Pushed_Down["tr_impacted_acc_2_sign"]) == 0),
+             'missing_amounts':Pushed_Down.get("tr_amt_missing",No_Values).fillna(False).to_numpy(dtype=bool),
+             'non_numeric_amounts':Pushed_Down.get("tr_amt_non_numeric",No_Values).fillna(False).to_numpy(dtype=bool),
+             'duplicate_tr_IDs':np.asarray(Duplicate_ID,dtype=bool)}
+
+    return pd.Series({check:int(Flag.sum()) for check, Flag in Flags.items()},dtype=np.int64)
+
+def get_unknown_labels(Labels,Picklist,name_column,group_column):
+
+    """This block of code flags the income / expense labels which aren't in the picklist with a group, i.e. the rows
+    which get no group ID in the income / expense cubes"""
+
+    Known_Labels = Picklist.loc[Picklist[group_column].notnull(),name_column]
+    return (Labels.notnull() & ~Labels.isin(Known_Labels)).to_numpy()
+
+def get_accounting_equation_breakdown(Acct_Level_Summary):
+
+    """This block of code returns each account's value signed by its A/L/E sign, and the side of the accounting equation
+    (Asset or Liability + Equity) it counts towards. The imbalance is the Asset total minus the other side's total"""
+
+    Breakdown = Acct_Level_Summary[["acc_ID","acc_name","acc_A/L/E_classification","acc_A/L/E_sign"]].copy()
+    Breakdown["Side"] = np.where(Breakdown["acc_A/L/E_classification"] == "Asset","Asset","Liability + Equity")
+    sign = sign_to_vector(Breakdown["acc_A/L/E_sign"])
+    for column in ["Baseline_Value","Net_Change_From_Operations","Net_Change_From_Market_Adjustment","End_Value_Overwrite"]:
+        Breakdown["Signed_" + column] = Acct_Level_Summary[column].to_numpy() * sign
+
+    return Breakdown.reset_index(drop=True)
+
+def get_accounting_equation_imbalance(Class_Level_Summary):
+
+    """This block of code returns assets minus liabilities and equity, each class counted with its A/L/E sign"""
+
+    side = np.where(Class_Level_Summary["acc_A/L/E_classification"] == "Asset",1,-1)
+    return float((Class_Level_Summary["End_Value_Overwrite"].to_numpy() * sign_to_vector(Class_Level_Summary["acc_A/L/E_sign"]) * side).sum())
@@ -0,0 +1,204 @@
+# This script declares the pipeline stages of main_script.main as a DAG with explicit inputs and outputs, and runs
+# them with a scheduler which executes independent branches concurrently and skips stages whose inputs are unchanged
+
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+from data_ingestion import ingestion_pipeline
+from input_cache import write_file_atomically
+from instrumentation import report_progress
+from incremental_ledger import preprocess_transactions_incrementally
+from balance_sheet_calculations import get_account_level_balance_sheet, get_account_type_level_balance_sheet, get_overall_balance_sheet, get_balance_sheets_as_of
+from income_statement_calculations import get_revenue_trend, get_expenses_trend, calculate_financial_KPIs, get_KPI_trend
+from run_qc_tests import run_qc_checks
+from output_generation import generate_csv_outputs
+
+# Bumped when the layout of the stage cache changes, so that older cached outputs are never reused
+Stage_Cache_Format_Version = 1
+
+class pipeline_stage(object):
+
+    """One stage of the pipeline: a function of the pipeline object, the attributes it reads and the ones it sets"""
+    def __init__(
+            self,
+            function,
+            inputs,
+            outputs,
+            args=()
+    ):
+        """Stages without outputs only have side effects (printing QC results, writing files), so they always run"""
+        self.name = function.__name__
+        self.function = function
+        self.inputs = inputs
+        self.outputs = outputs
+        self.args = args
+
+def build_pipeline_stages(incremental=False,As_Of_Dates=None,output_format='xlsx',kpi_frequency='M'):
+
+    """This block of code returns the stages of main_script.main with their inputs and outputs"""
+
+    Preprocessed = ['Transactions','QC_Flags','QC_Pushed_Down_Counts','Accounts','Expense_Picklist','Income_Picklist','Postings','Revenue_Cube','Expense_Cube']
+    Stages = [
+        pipeline_stage(preprocess_transactions_incrementally if incremental else ingestion_pipeline.preprocess_transactions,
+                       ['Transactions','Accounts','Expense_Picklist','Expense_Group_Picklist','Income_Picklist','Income_Group_Picklist','start_date','end_date','path','filename'] if incremental else ['Transactions','Accounts','Expense_Picklist','Expense_Group_Picklist','Income_Picklist','Income_Group_Picklist','start_date','end_date'],
+                       Preprocessed),
+        pipeline_stage(get_account_level_balance_sheet,['Accounts','Postings'],['Acct_Level_Summary']),
+        pipeline_stage(get_account_type_level_balance_sheet,['Accounts','Acct_Level_Summary'],['Class_Level_Summary']),
+        pipeline_stage(get_overall_balance_sheet,['Accounts','Class_Level_Summary'],['BS_Level_Summary']),
+        pipeline_stage(get_revenue_trend,['Revenue_Cube'],['Revenue_Breakdown','Revenue_Trend']),
+        pipeline_stage(get_expenses_trend,['Expense_Cube'],['Expense_List','Expense_Pivot']),
+        pipeline_stage(calculate_financial_KPIs,['Class_Level_Summary'],['Summary_KPI']),
+        pipeline_stage(get_KPI_trend,['Accounts','Postings','start_date','end_date'],['KPI_Trend'],args=(kpi_frequency,)),
+        pipeline_stage(run_qc_checks,['Transactions','QC_Flags','QC_Pushed_Down_Counts','Postings','Income_Picklist','Expense_Picklist','Acct_Level_Summary','Class_Level_Summary'],[]),
+    ]
+    Report_Inputs = ['path','BS_Level_Summary','Class_Level_Summary','Acct_Level_Summary','Revenue_Breakdown','Revenue_Trend','Expense_Pivot','Summary_KPI','KPI_Trend']
+    if As_Of_Dates is not None:
+        Stages += [pipeline_stage(get_balance_sheets_as_of,['Accounts','Postings','end_date'],['Balance_Index','Acct_Level_Summary_As_Of','Class_Level_Summary_As_Of','BS_Level_Summary_As_Of'],args=(As_Of_Dates,))]
+        Report_Inputs += ['Acct_Level_Summary_As_Of','Class_Level_Summary_As_Of','BS_Level_Summary_As_Of']
+    Stages += [pipeline_stage(generate_csv_outputs,Report_Inputs,[],args=(output_format,))]
+
+    return Stages
+
+def run_pipeline(self,Stages=None,cache_dir=None,max_workers=4):
+
+    """This block of code runs the stages on the pipeline object. A stage starts as soon as the stages producing its
+    inputs have finished, so independent branches (e.g. the trends and the balance sheet chain) run concurrently on a
+    thread pool. Before a stage with outputs runs, its inputs are fingerprinted; if a previous run stored outputs for
+    the same fingerprint and pipeline code (by default in a '.stage_cache' folder next to the workbook), they are
+    loaded instead. Returns the status and timing of every stage"""
+
+    if Stages is None:
+        Stages = build_pipeline_stages()
+    if cache_dir is None:
+        cache_dir = os.path.join(self.path,'.stage_cache')
+
+    # (1) Resolve each stage's dependencies from the producers of its inputs
+    Producer = {}
+    for stage in Stages:
+        for output in stage.outputs:
+            Producer[output] = stage.name
+    Depends_On = {stage.name:{Producer[i] for i in stage.inputs if i in Producer and Producer[i] != stage.name} for stage in Stages}
+
+    # (2) Submit stages as their dependencies complete
+    code_fingerprint = get_code_fingerprint(Stages)
+    Status = []
+    Done, Running = set(), {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while len(Done) < len(Stages):
+            for stage in Stages:
+                if stage.name not in Done and stage.name not in Running.values() and Depends_On[stage.name] <= Done:
+                    Running[pool.submit(run_stage,self,stage,cache_dir,code_fingerprint)] = stage.name
+            if not Running:
+                raise ValueError("stage dependencies can't be resolved: " + ", ".join(s.name for s in Stages if s.name not in Done))
+            finished, _ = wait(list(Running),return_when=FIRST_COMPLETED)
+            for future in finished:
+                Status += [future.result()]    # re-raises the stage's exception, if any
+                Done.add(Running.pop(future))
+
+    return pd.DataFrame(Status)
+
+def run_stage(self,stage,cache_dir,code_fingerprint):
+
+    """This block of code runs one stage, or loads its outputs from the stage cache if its inputs are unchanged"""
+
+    start = time.perf_counter()
+    if not stage.outputs:
+        stage.function(self,*stage.args)
+        return {"stage":stage.name,"status":'ran',"seconds":time.perf_counter() - start}
+
+    fingerprint = get_stage_fingerprint(self,stage,code_fingerprint)
+    cache_file = os.path.join(cache_dir,stage.name,fingerprint + '.pkl')
+    try:
+        with open(cache_file,'rb') as f:
+            Outputs = pickle.load(f)
+        for output, value in Outputs.items():
+            setattr(self,output,value)
+        report_progress('skipped ' + stage.name + ' (inputs unchanged)')
+        return {"stage":stage.name,"status":'cached',"seconds":time.perf_counter() - start}
+    except (OSError,EOFError,pickle.UnpicklingError,AttributeError,ImportError):
+        pass
+
+    stage.function(self,*stage.args)
+
+    # Keep only the latest cached result of each stage (other runs' temporary files are left alone)
+    Outputs = {output:getattr(self,output,None) for output in stage.outputs}
+    write_file_atomically(cache_file,lambda f: pickle.dump(Outputs,f,protocol=pickle.HIGHEST_PROTOCOL))
+    for entry in os.listdir(os.path.dirname(cache_file)):
+        if entry.endswith('.pkl') and entry != os.path.basename(cache_file):
+            try:
+                os.remove(os.path.join(os.path.dirname(cache_file),entry))
+            except OSError:    # already removed by a concurrent run
+                pass
+
+    return {"stage":stage.name,"status":'ran',"seconds":time.perf_counter() - start}
+
+def get_stage_fingerprint(self,stage,code_fingerprint):
+
+    """This block of code hashes the pipeline's code (see get_code_fingerprint), the stage's name and extra arguments
+    and the current value of each of its inputs"""
+
+    digest = hashlib.sha256()
+    digest.update(code_fingerprint.encode())
+    digest.update(stage.name.encode())
+    digest.update(pickle.dumps(stage.args))
+    for name in stage.inputs:
+        digest.update(name.encode())
+        update_fingerprint(digest,getattr(self,name,None))
+
+    return digest.hexdigest()
+
+def update_fingerprint(digest,value):
+
+    """This block of code adds one input value to the fingerprint. DataFrames and arrays are hashed by content, and
+    objects (e.g. posting_matrix, flow_cube) attribute by attribute, since their pickled bytes can differ between an
+    object and its copy loaded from the cache"""
+
+    if isinstance(value,pd.DataFrame):
+        digest.update(repr(list(value.columns)).encode())
+        digest.update(repr(list(value.dtypes)).encode())
+        digest.update(pd.util.hash_pandas_object(value,index=True).to_numpy().tobytes())
+    elif isinstance(value,np.ndarray) and value.dtype != object:
+        digest.update(repr((value.dtype,value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value,(list,tuple)):
+        digest.update(repr((type(value).__name__,len(value))).encode())
+        for item in value:
+            update_fingerprint(digest,item)
+    elif hasattr(value,'__dict__') and not isinstance(value,type):
+        digest.update(type(value).__qualname__.encode())
+        for attribute in sorted(vars(value)):
+            digest.update(attribute.encode())
+            update_fingerprint(digest,vars(value)[attribute])
+    else:
+        digest.update(pickle.dumps(value,protocol=pickle.HIGHEST_PROTOCOL))
+
+def get_code_fingerprint(Stages):
+
+    """This block of code hashes Stage_Cache_Format_Version and the source of every loaded module of the pipeline
+    (those next to this script) and of the modules defining the stages. Hashing whole modules rather than the stage
+    functions' bytecode means that a changed constant, default argument or helper function also invalidates the
+    cached outputs; any code change invalidates all of them"""
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    Source_Files = {os.path.abspath(module.__file__) for module in list(sys.modules.values())
+                    if getattr(module,'__file__',None) and os.path.dirname(os.path.abspath(module.__file__)) == folder}
+    for stage in Stages:
+        source_file = inspect.getsourcefile(inspect.unwrap(stage.function))    # unwrap @instrument
+        if source_file is not None:
+            Source_Files.add(os.path.abspath(source_file))
+
+    digest = hashlib.sha256()
+    digest.update(str(Stage_Cache_Format_Version).encode())
+    for source_file in sorted(Source_Files):
+        digest.update(os.path.basename(source_file).encode())
+        with open(source_file,'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
@@ -0,0 +1,117 @@
+# This script contains parts for reading transaction logs which are too large to hold in memory. Transactions are read
+# from CSV or Parquet in fixed-size chunks, and the per-account and per-month aggregates which the reports need are
+# folded in as chunks arrive
+
+import os
+import pandas as pd
+from data_ingestion import ingestion_pipeline, Input_Sheets, Depreciable_Expenses, Unused_Transaction_Columns, build_depreciation_entries, coerce_amounts
+from input_cache import read_workbook_sheets
+from instrumentation import instrument, report_progress
+from posting_matrix import posting_matrix
+
+# Columns which hold text labels, read as object even when a chunk contains no labels at all
+Label_Columns = ['tr_description','tr_impacted_acc_1','tr_impacted_acc_1_sign','tr_impacted_acc_2','tr_impacted_acc_2_sign','tr_expense','tr_income']
+
+class streaming_pipeline(ingestion_pipeline):
+
+    """Pipeline object whose transactions are streamed from a CSV / Parquet log instead of the workbook"""
+    @instrument
+    def __init__(
+            self,
+            path,
+            filename,
+            transactions_file,
+            start_date,
+            end_date,
+            chunksize=100000,
+            use_cache=True,
+            cache_dir=None
+    ):
+        """Initializes Pipeline object with shared state and inputs. Accounts and picklists are still read from the
+        workbook; the Transactions sheet is not read"""
+        self.path = path
+        self.filename = filename
+        self.transactions_file = transactions_file
+        self.chunksize = chunksize
+        self.start_date = start_date
+        self.end_date = end_date
+        self.Days_Ellapsed = (end_date - start_date).days
+        if use_cache and cache_dir is None:
+            cache_dir = os.path.join(path,'.input_cache')
+        sheets, self.Input_Cache_Hit = read_workbook_sheets(path+filename,Input_Sheets[1:],cache_dir if use_cache else None)
+        self.Transactions = None
+        self.Accounts = sheets['Accounts']
+        self.Expense_Picklist = sheets['tblpl_expense']
+        self.Expense_Group_Picklist = sheets['tblpl_expense_group']
+        self.Income_Picklist = sheets['tblpl_income']
+        self.Income_Group_Picklist = sheets['tblpl_income_group']
+        report_progress("finished reading inputs")
+
+    @instrument
+    def preprocess_transactions(self):
+
+        """This block of code streams the transaction log chunk by chunk. Only the capex items (needed for the
+        depreciation schedule) and small aggregates are kept: the per-account running totals in Postings, and the
+        income and expense cubes (by group, category, year and month)"""
+
+        self.drop_unused_columns()
+        self.Postings = None
+        self.Revenue_Cube = self.Expense_Cube = None
+        self.Opening_Balances = self.QC_Pushed_Down_Counts = None
+
+        # (1) Fold each chunk into the aggregates, keeping aside the capex items
+        Capex_Items = []
+        Rows_Read = 0
+        for chunk in read_transaction_chunks(self.transactions_file,self.chunksize):
+            chunk.drop(columns=Unused_Transaction_Columns,inplace=True,errors='ignore')
+            chunk = coerce_amounts(chunk)
+            Capex_Items += [chunk[chunk["tr_expense"].isin(list(Depreciable_Expenses))]]
+            self.fold_transactions(chunk)
+            Rows_Read += len(chunk)
+        if not Capex_Items:
+            raise ValueError("no transactions found in " + self.transactions_file)
+
+        # (2) Fold in the depreciation expenses of the capex items (with the log's columns, as in the non-streamed path)
+        Capex = pd.concat(Capex_Items,ignore_index=True)
+        self.fold_transactions(pd.concat([Capex.iloc[:0],build_depreciation_entries(Capex,self.start_date,self.end_date)],ignore_index=True))
+        report_progress('finished adding depreciation expenses')
+
+        # (3) Add the opening balances of the transactions before Start_Date
+        self.Postings = self.Postings.with_opening_balances(*self.Opening_Balances,self.start_date)
+
+        report_progress('finished preprocessing ' + str(Rows_Read) + ' streamed transactions')
+
+    @instrument
+    def fold_transactions(self,Transactions):
+
+        """This block of code enriches a chunk of transactions exactly like preprocess_transactions does and folds it
+        into the running aggregates. Transactions before Start_Date only go into the opening balances"""
+
+        Enriched = self.enrich_transactions(self.push_down_window(Transactions))
+
+        # (1) Per-account running totals
+        Chunk_Postings = posting_matrix(Enriched,self.Accounts)
+        self.Postings = Chunk_Postings.totals_only() if self.Postings is None else self.Postings.append(Chunk_Postings).totals_only()
+
+        # (2) Income and expenses by category, year and month
+        self.build_flow_cubes(Enriched)
+
+def read_transaction_chunks(transactions_file,chunksize):
+
+    """This block of code yields the transaction log in chunks of at most chunksize rows, with the date columns parsed
+    and the label columns read as text. CSV and Parquet logs are supported; Parquet requires pyarrow"""
+
+    if transactions_file.lower().endswith('.parquet'):
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas() for batch in pq.ParquetFile(transactions_file).iter_batches(batch_size=chunksize))
+    else:
+        chunks = pd.read_csv(transactions_file,chunksize=chunksize,dtype={column:object for column in Label_Columns})
+
+    for chunk in chunks:
+        for column in ['tr_close_date','tr_init_date']:
+            if column in chunk.columns:
+                chunk[column] = pd.to_datetime(chunk[column])
+        for column in Label_Columns:
+            if column in chunk.columns:
+                chunk[column] = chunk[column].astype(object)
+        yield chunk
@@ -0,0 +1,225 @@
+# This script generates realistic synthetic input workbooks (Transactions, Accounts and the expense / income picklists),
+# so that the framework can be run and benchmarked without a private Data Structure.xlsx
+
+import argparse
+import datetime
+
+import numpy as np
+import pandas as pd
+
+Excel_Max_Rows = 1048575    # excluding the header row
+
+Expense_Groups = ['Housing','Food','Transportation','Utilities','Health','Entertainment','Travel','Education','Personal Care','Insurance']
+Income_Categories = [('Salary','Employment',1),('Bonus','Employment',1),('Freelance','Side Business',1),('Interest','Investment',1),('Dividends','Investment',0)]
+
+def generate_ledger(n_transactions=10000,n_accounts=16,n_capex=50,n_expense_categories=40,start_date=datetime.date(2015,1,1),end_date=datetime.date(2022,12,31),seed=0):
+
+    """This block of code returns {sheet name: DataFrame} for a synthetic household ledger, with the same sheets and
+    columns as Data Structure.xlsx. Every transaction is balanced, so the accounting equation holds on the output.
+    n_transactions counts the regular transactions; the n_capex fixture purchases (depreciated over 1-30 years) come on
+    top of them"""
+
+    rng = np.random.default_rng(seed)
+    Accounts = generate_accounts(n_accounts,rng)
+    Expense_Picklist, Expense_Group_Picklist = generate_expense_picklists(n_expense_categories)
+    Income_Group_ID, Income_Groups = pd.factorize(pd.Series([c[1] for c in Income_Categories]))
+    Income_Picklist = pd.DataFrame({'inc_ID':np.arange(1,len(Income_Categories) + 1),
+                                    'inc_name':[c[0] for c in Income_Categories],
+                                    'inc_grp_ID':Income_Group_ID + 1,
+                                    'inc_is_operational':[c[2] for c in Income_Categories]})
+    Income_Group_Picklist = pd.DataFrame({'inc_grp_ID':np.arange(1,len(Income_Groups) + 1),'inc_grp':Income_Groups})
+
+    Transactions = pd.concat([generate_regular_transactions(n_transactions,Accounts,Expense_Picklist,Income_Picklist,start_date,end_date,rng),
+                              generate_capex_transactions(n_capex,Accounts,start_date,end_date,rng)],ignore_index=True)
+    Transactions.sort_values(by=['tr_close_date'],inplace=True,kind='stable')
+    Transactions.insert(0,'tr_ID',np.arange(1,len(Transactions) + 1))
+    Transactions['tr_supplier'] = 'Supplier ' + pd.Series(rng.integers(1,200,len(Transactions))).astype(str).to_numpy()
+    Transactions['tr_qty'] = 1
+    Transactions['tr_qty_units'] = 'unit'
+    Transactions['tr_rate'] = Transactions['tr_amt']
+    Transactions['tr_notes'] = ''
+    Transactions = Transactions[['tr_ID','tr_description','tr_supplier','tr_qty','tr_qty_units','tr_rate','tr_amt','tr_init_date','tr_close_date','tr_SKU_lifetime',
+                                 'tr_impacted_acc_1','tr_impacted_acc_1_sign','tr_impacted_acc_2','tr_impacted_acc_2_sign','tr_expense','tr_income','tr_notes']]
+
+    return {'Transactions':Transactions.reset_index(drop=True),
+            'Accounts':Accounts,
+            'tblpl_expense':Expense_Picklist,
+            'tblpl_expense_group':Expense_Group_Picklist,
+            'tblpl_income':Income_Picklist,
+            'tblpl_income_group':Income_Group_Picklist}
+
+def generate_accounts(n_accounts,rng):
+
+    """This block of code generates the chart of accounts. The accounts the framework refers to by name (PP&E -
+    Fixtures, Expense - Housing and the unrealized gain / loss accounts) are always present; accounts beyond the
+    minimum set are split between extra bank accounts and credit cards. Owner Equity balances the baselines"""
+
+    Rows = [('Checking','Cash','Asset','[+ve]'),
+            ('Savings','Cash','Asset','[+ve]'),
+            ('Brokerage','Marketable Securities','Asset','[+ve]'),
+            ('PP&E - Fixtures','Fixtures','Asset','[+ve]'),
+            ('Credit Card','Credit Card','Liability','[+ve]'),
+            ('Owner Equity','Equity','Equity','[+ve]'),
+            ('Revenue - Salary','Revenue','Equity','[+ve]'),
+            ('Revenue - Other','Revenue','Equity','[+ve]'),
+            ('Expense - Housing','Expense','Equity','[-ve]'),
+            ('Expense - Living','Expense','Equity','[-ve]'),
+            ('Unrealized Investment Gain','Gain','Equity','[+ve]'),
+            ('Unrealized Investment Loss','Loss','Equity','[-ve]')]
+    for i in range(max(n_accounts - len(Rows),0)):
+        Rows += [('Checking ' + str(i + 2),'Cash','Asset','[+ve]') if i % 2 == 0 else ('Credit Card ' + str(i + 2),'Credit Card','Liability','[+ve]')]
+
+    Accounts = pd.DataFrame(Rows,columns=['acc_name','acc_type','acc_A/L/E_classification','acc_A/L/E_sign'])
+    Accounts.insert(0,'acc_ID',np.arange(1,len(Accounts) + 1))
+    Accounts['acc_report_rank'] = Accounts['acc_ID']
+
+    # Baselines: positive balances for bank, brokerage and card accounts; Owner Equity balances the equation
+    Baseline = np.where(Accounts['acc_type'].isin(['Cash','Marketable Securities','Credit Card']),np.round(rng.uniform(1000,20000,len(Accounts)),2),0.0)
+    Asset = (Accounts['acc_A/L/E_classification'] == 'Asset').to_numpy()
+    Liability = (Accounts['acc_A/L/E_classification'] == 'Liability').to_numpy()
+    Baseline[Accounts['acc_name'].to_numpy() == 'Owner Equity'] = Baseline[Asset].sum() - Baseline[Liability].sum()
+
+    # Market value overwrite for the brokerage account
+    Overwrite = np.where(Accounts['acc_type'] == 'Marketable Securities',np.round(Baseline * rng.uniform(0.8,1.6),2),np.nan)
+
+    # Same column layout as the Accounts sheet of Data Structure.xlsx, including the two untitled columns
+    Accounts['acc_end_value_overwrite'] = Overwrite
+    Accounts['acc_notes'] = ''
+    Accounts['acc_last_refresh'] = pd.Timestamp('today').normalize()
+    Accounts['acc_baseline_date'] = pd.Timestamp('2000-01-01')
+    Accounts['acc_baseline_value'] = Baseline
+    Accounts['Signs'] = Accounts['acc_A/L/E_sign']
+    Accounts['Unnamed: 12'] = '-'
+    Accounts['Unnamed: 13'] = '-'
+
+    return Accounts
+
+def generate_expense_picklists(n_expense_categories):
+
+    """This block of code generates the expense categories, spread round-robin over the expense groups. The fixture
+    investment (capex, not a living expense) and its depreciation are always present"""
+
+    Groups = pd.DataFrame({'exp_grp_ID':np.arange(1,len(Expense_Groups) + 1),'exp_grp':Expense_Groups})
+    group = np.arange(n_expense_categories) % len(Expense_Groups)
+    Categories = pd.DataFrame({'exp_name':[Expense_Groups[g] + ' Expense - Category ' + str(i + 1) for i, g in enumerate(group)],
+                               'exp_grp_ID':group + 1,
+                               'exp_is_live':1})
+    Categories = pd.concat([Categories,
+                            pd.DataFrame({'exp_name':['Housing Expense - Fixture Investment','Housing Expense - Depreciation'],
+                                          'exp_grp_ID':[1,1],
+                                          'exp_is_live':[0,1]})],ignore_index=True)
+    Categories.insert(0,'exp_ID',np.arange(1,len(Categories) + 1))
+
+    return Categories, Groups
+
+def generate_regular_transactions(n_transactions,Accounts,Expense_Picklist,Income_Picklist,start_date,end_date,rng):
+
+    """This block of code generates income, expense (paid from a bank account or by card), card payment and brokerage
+    transfer transactions"""
+
+    Cash = Accounts[Accounts['acc_type'] == 'Cash']['acc_name'].to_numpy()
+    Cards = Accounts[Accounts['acc_type'] == 'Credit Card']['acc_name'].to_numpy()
+    Living = Expense_Picklist[Expense_Picklist['exp_is_live'] == 1]
+    Living = Living[Living['exp_name'] != 'Housing Expense - Depreciation']
+    Expense_Account = np.where(Living['exp_grp_ID'].to_numpy() == 1,'Expense - Housing','Expense - Living')
+
+    n = n_transactions
+    kind = rng.choice(5,size=n,p=[0.08,0.35,0.37,0.15,0.05])
+    cash = rng.choice(Cash,n)
+    card = rng.choice(Cards,n)
+    expense = rng.integers(0,len(Living),n)
+    income = rng.integers(0,len(Income_Picklist),n)
+    amount = np.round(np.exp(rng.normal(3.5,1.0,n)),2)
+    amount[kind == 0] *= 20    # paychecks are larger than purchases
+
+    Transactions = pd.DataFrame({
+        'tr_description':np.array(['Income','Purchase','Purchase','Card payment','Brokerage transfer'])[kind],
+        'tr_amt':amount,
+        'tr_impacted_acc_1':np.select([kind == 0,kind <= 2,kind == 3],[cash,Expense_Account[expense],card],'Brokerage'),
+        'tr_impacted_acc_1_sign':np.where(kind == 3,'[-ve]','[+ve]'),
+        'tr_impacted_acc_2':np.select([kind == 0,kind == 2],[np.where(Income_Picklist['inc_name'].to_numpy()[income] == 'Salary','Revenue - Salary','Revenue - Other'),card],cash),
+        'tr_impacted_acc_2_sign':np.where((kind == 0) | (kind == 2),'[+ve]','[-ve]'),
+        'tr_expense':np.where((kind == 1) | (kind == 2),Living['exp_name'].to_numpy()[expense],None),
+        'tr_income':np.where(kind == 0,Income_Picklist['inc_name'].to_numpy()[income],None),
+        'tr_SKU_lifetime':np.nan})
+    Transactions['tr_close_date'] = random_dates(n,start_date,end_date,rng)
+    Transactions['tr_init_date'] = Transactions['tr_close_date'] - pd.to_timedelta(rng.integers(0,4,n),unit='D')
+
+    return Transactions
+
+def generate_capex_transactions(n_capex,Accounts,start_date,end_date,rng):
+
+    """This block of code generates fixture purchases paid from a bank account, with lifetimes of 1 to 30 years"""
+
+    Cash = Accounts[Accounts['acc_type'] == 'Cash']['acc_name'].to_numpy()
+    Transactions = pd.DataFrame({
+        'tr_description':'Fixture ' + pd.Series(np.arange(1,n_capex + 1)).astype(str).to_numpy(),
+        'tr_amt':np.round(rng.uniform(200,5000,n_capex),2),
+        'tr_impacted_acc_1':'PP&E - Fixtures',
+        'tr_impacted_acc_1_sign':'[+ve]',
+        'tr_impacted_acc_2':rng.choice(Cash,n_capex),
+        'tr_impacted_acc_2_sign':'[-ve]',
+        'tr_expense':'Housing Expense - Fixture Investment',
+        'tr_income':None,
+        'tr_SKU_lifetime':rng.choice([12,24,36,60,84,120,180,240,360],n_capex).astype(float)})
+    Transactions['tr_close_date'] = random_dates(n_capex,start_date,end_date,rng)
+    Transactions['tr_init_date'] = Transactions['tr_close_date']
+
+    return Transactions
+
+def random_dates(n,start_date,end_date,rng):
+
+    """This block of code draws n dates uniformly between start_date and end_date"""
+
+    return pd.Timestamp(start_date) + pd.to_timedelta(rng.integers(0,(end_date - start_date).days + 1,n),unit='D')
+
+def write_workbook(sheets,workbook):
+
+    """This block of code writes the sheets into an Excel workbook laid out like Data Structure.xlsx. The untitled
+    columns of Accounts are written with blank headers, so they read back as 'Unnamed: 12' and 'Unnamed: 13'"""
+
+    if len(sheets['Transactions']) > Excel_Max_Rows:
+        raise ValueError(str(len(sheets['Transactions'])) + " transactions don't fit in one Excel sheet; write them to CSV / Parquet with write_transaction_log instead")
+
+    with pd.ExcelWriter(workbook,engine='xlsxwriter') as writer:
+        for sheet, df in sheets.items():
+            if sheet == 'Accounts':
+                df = df.rename(columns={'Unnamed: 12':'','Unnamed: 13':''})
+            df.to_excel(writer,sheet_name=sheet,index=False)
+
+    return workbook
+
+def write_transaction_log(sheets,transactions_file):
+
+    """This block of code writes the transactions to a CSV or Parquet log, for main_script.main_streaming"""
+
+    if transactions_file.lower().endswith('.parquet'):
+        sheets['Transactions'].to_parquet(transactions_file,index=False)
+    else:
+        sheets['Transactions'].to_csv(transactions_file,index=False)
+
+    return transactions_file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Data Structure.xlsx")
+    parser.add_argument("workbook",help="output workbook, e.g. 'Data Structure.xlsx'")
+    parser.add_argument("--transactions",type=int,default=10000)
+    parser.add_argument("--accounts",type=int,default=16)
+    parser.add_argument("--capex",type=int,default=50)
+    parser.add_argument("--expense-categories",type=int,default=40)
+    parser.add_argument("--start",default="2015-01-01",help="first transaction date (YYYY-MM-DD)")
+    parser.add_argument("--end",default="2022-12-31",help="last transaction date (YYYY-MM-DD)")
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--transactions-file",default=None,help="also write the transactions to this CSV / Parquet log")
+    args = parser.parse_args()
+
+    Sheets = generate_ledger(args.transactions,args.accounts,args.capex,args.expense_categories,
+                             datetime.date.fromisoformat(args.start),datetime.date.fromisoformat(args.end),args.seed)
+    if args.transactions_file is not None:
+        write_transaction_log(Sheets,args.transactions_file)
+    if len(Sheets['Transactions']) <= Excel_Max_Rows:
+        write_workbook(Sheets,args.workbook)
+    else:
+        Sheets['Transactions'] = Sheets['Transactions'].iloc[:0]
+        write_workbook(Sheets,args.workbook)
+        print("the transactions don't fit in one Excel sheet, so the workbook's Transactions sheet was left empty")
@@ -0,0 +1,47 @@
+# This script contains the shared fixtures of the tests: a small synthetic ledger (see synthetic_ledger) and a
+# workbook written from it
+
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_ledger import generate_ledger, write_workbook
+
+Start_Date = datetime.date(2020,3,15)
+End_Date = datetime.date(2021,9,30)
+
+@pytest.fixture(scope='session')
+def ledger():
+
+    """This block of code returns the sheets of a synthetic ledger running from 2019 to 2021, so that the test window
+    has history before Start_Date and transactions after End_Date. Tests copy the sheets before changing them"""
+
+    return generate_ledger(n_transactions=1500,n_accounts=14,n_capex=20,n_expense_categories=20,
+                           start_date=datetime.date(2019,1,1),end_date=datetime.date(2021,12,31),seed=7)
+
+@pytest.fixture
+def workbook(ledger,tmp_path):
+
+    """This block of code writes the ledger into Data Structure.xlsx in a temporary folder and returns (path,
+    filename) in the form main_script.main takes them"""
+
+    write_workbook(ledger,str(tmp_path / 'Data Structure.xlsx'))
+
+    return str(tmp_path) + os.sep, 'Data Structure.xlsx'
+
+@pytest.fixture
+def datasets(ledger):
+
+    """This block of code returns a pipeline object for the ledger with its transactions preprocessed over the test
+    window"""
+
+    from data_ingestion import ingestion_pipeline
+
+    datasets = ingestion_pipeline(path='',filename='',start_date=Start_Date,end_date=End_Date,use_cache=False,sheets=ledger)
+    datasets.preprocess_transactions()
+
+    return datasets
@@ -0,0 +1,53 @@
+import datetime
+
+import pandas as pd
+import pytest
+from balance_sheet_calculations import get_account_level_balance_sheet, get_account_type_level_balance_sheet, get_overall_balance_sheet, get_balance_sheets_as_of
+from data_ingestion import ingestion_pipeline
+from conftest import Start_Date, End_Date
+
+def get_balance_sheets(datasets):
+    get_account_level_balance_sheet(datasets)
+    get_account_type_level_balance_sheet(datasets)
+    get_overall_balance_sheet(datasets)
+    return datasets
+
+def test_end_date_matches_the_balance_sheet(datasets):
+    get_balance_sheets(datasets)
+    get_balance_sheets_as_of(datasets,[End_Date])
+
+    As_Of = datasets.Acct_Level_Summary_As_Of.drop(columns=["As_Of_Date"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(As_Of,datasets.Acct_Level_Summary.reset_index(drop=True))
+
+def test_earlier_dates_match_a_run_ending_on_them(datasets,ledger):
+    As_Of_Date = datetime.date(2020,11,30)
+    get_balance_sheets_as_of(datasets,[As_Of_Date,End_Date])
+    Shorter = ingestion_pipeline(path='',filename='',start_date=Start_Date,end_date=As_Of_Date,use_cache=False,sheets=ledger)
+    Shorter.preprocess_transactions()
+    get_balance_sheets(Shorter)
+
+    As_Of = datasets.Acct_Level_Summary_As_Of
+    As_Of = As_Of[As_Of["As_Of_Date"] == pd.Timestamp(As_Of_Date)].set_index("acc_ID")["Net_Change_From_Operations"]
+    Expected = Shorter.Acct_Level_Summary.set_index("acc_ID")["Net_Change_From_Operations"]
+    pd.testing.assert_series_equal(As_Of.reindex(Expected.index,fill_value=0.0),Expected,check_exact=False)    # accounts with nothing to report are left out
+
+def test_repeated_dates_are_reported_once_in_order(datasets):
+    get_balance_sheets_as_of(datasets,[datetime.date(2021,1,31),End_Date])
+    Once = datasets.BS_Level_Summary_As_Of
+    get_balance_sheets_as_of(datasets,[End_Date,datetime.date(2021,1,31),pd.Timestamp('2021-01-31'),End_Date])
+
+    pd.testing.assert_frame_equal(datasets.BS_Level_Summary_As_Of,Once)
+
+def test_no_dates_give_empty_reports_with_the_usual_columns(datasets):
+    get_balance_sheets_as_of(datasets,[End_Date])
+    Columns = {name:list(getattr(datasets,name).columns) for name in ['Acct_Level_Summary_As_Of','Class_Level_Summary_As_Of','BS_Level_Summary_As_Of']}
+    get_balance_sheets_as_of(datasets,[])
+
+    for name, columns in Columns.items():
+        assert getattr(datasets,name).empty
+        assert list(getattr(datasets,name).columns) == columns
+
+def test_dates_before_the_window_are_rejected(datasets):
+    with pytest.raises(ValueError):
+        get_balance_sheets_as_of(datasets,[Start_Date - datetime.timedelta(days=2)])
+    get_balance_sheets_as_of(datasets,[Start_Date - datetime.timedelta(days=1)])
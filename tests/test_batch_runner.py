@@ -0,0 +1,68 @@
+import os
+
+import pandas as pd
+import pytest
+import batch_runner
+from batch_runner import read_manifest, run_batch
+from synthetic_ledger import write_workbook
+from conftest import Start_Date, End_Date
+
+def write_manifest(tmp_path,Jobs):
+    manifest_file = str(tmp_path / 'manifest.csv')
+    pd.DataFrame(Jobs).to_csv(manifest_file,index=False)
+    return manifest_file
+
+def test_batch_reports_every_job_in_manifest_order(ledger,tmp_path):
+    Jobs = []
+    for name in ['household_a','household_b','missing']:
+        os.makedirs(tmp_path / name)
+        if name != 'missing':
+            write_workbook(ledger,str(tmp_path / name / 'Data Structure.xlsx'))
+        Jobs += [{'path':str(tmp_path / name) + os.sep,'filename':'Data Structure.xlsx','start_date':Start_Date,'end_date':End_Date,'job_name':name}]
+
+    Batch_Status = run_batch(read_manifest(write_manifest(tmp_path,Jobs)),workers=2)
+
+    assert Batch_Status['job_name'].tolist() == ['household_a','household_b','missing']
+    assert Batch_Status['status'].tolist() == ['succeeded','succeeded','failed']
+    assert 'No such file' in Batch_Status['error'].iloc[2]
+    assert os.path.exists(tmp_path / 'household_a' / 'Output.xlsx') and os.path.exists(tmp_path / 'household_b' / 'Output.xlsx')
+
+def test_only_the_jobs_sharing_a_path_fail(ledger,tmp_path):
+    os.makedirs(tmp_path / 'household_a')
+    os.makedirs(tmp_path / 'shared')
+    write_workbook(ledger,str(tmp_path / 'household_a' / 'Data Structure.xlsx'))
+    Job = {'path':str(tmp_path / 'shared') + os.sep,'filename':'Data Structure.xlsx','start_date':Start_Date,'end_date':End_Date}
+    Jobs = [dict(Job,job_name='shared_1'),dict(Job,path=str(tmp_path / 'household_a') + os.sep,job_name='household_a'),dict(Job,filename='Other.xlsx',job_name='shared_2')]
+
+    Batch_Status = run_batch(read_manifest(write_manifest(tmp_path,Jobs)),workers=2)
+
+    assert Batch_Status['status'].tolist() == ['failed','succeeded','failed']
+    assert 'overwrite' in Batch_Status['error'].iloc[0] and 'overwrite' in Batch_Status['error'].iloc[2]
+    assert not os.path.exists(tmp_path / 'shared' / 'Output.xlsx')
+
+def test_manifest_rejects_missing_columns(tmp_path):
+    Job = {'path':str(tmp_path),'filename':'Data Structure.xlsx','start_date':Start_Date,'end_date':End_Date}
+    with pytest.raises(ValueError,match='end_date'):
+        read_manifest(write_manifest(tmp_path,[{key:value for key, value in Job.items() if key != 'end_date'}]))
+
+def test_job_names_default_to_the_filename(tmp_path):
+    Manifest = read_manifest(write_manifest(tmp_path,[{'path':str(tmp_path),'filename':'Data Structure.xlsx','start_date':Start_Date,'end_date':End_Date}]))
+
+    assert Manifest['job_name'].tolist() == ['Data Structure.xlsx']
+    assert Manifest['start_date'].tolist() == [Start_Date]
+
+def exit_on_crash_job(job):
+    if job["job_name"] == 'crash':
+        os._exit(1)    # e.g. killed for running out of memory
+    return {"job_name":job["job_name"],"status":'succeeded',"seconds":0.0,"worker_pid":os.getpid(),"error":''}
+
+def test_a_dying_worker_only_fails_its_own_job(monkeypatch,tmp_path):
+    monkeypatch.setattr(batch_runner,'run_job',exit_on_crash_job)
+    Names = ['a','b','crash','c','d','e']
+    Manifest = read_manifest(write_manifest(tmp_path,[{'path':str(tmp_path / name),'filename':'Data Structure.xlsx','start_date':Start_Date,'end_date':End_Date,'job_name':name} for name in Names]))
+
+    Batch_Status = run_batch(Manifest,workers=2)
+
+    assert Batch_Status['job_name'].tolist() == Names
+    assert Batch_Status['status'].tolist() == ['succeeded','succeeded','failed','succeeded','succeeded','succeeded']
+    assert 'exit code 1' in Batch_Status['error'].iloc[2]
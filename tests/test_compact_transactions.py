@@ -0,0 +1,26 @@
+import pandas as pd
+from data_ingestion import Categorical_Columns, Enrichment_Only_Columns, compact_transactions
+
+def test_preprocessed_transactions_use_compact_dtypes(datasets):
+    T = datasets.Transactions
+
+    for column in Categorical_Columns:
+        assert isinstance(T[column].dtype,pd.CategoricalDtype),column
+    assert T['Tr_Date'].dtype == 'datetime64[ns]'
+    assert (T['Tr_Month'].dtype,T['Tr_Week'].dtype) == ('int8','int8')
+    assert not set(Enrichment_Only_Columns) & set(T.columns)
+    assert not hasattr(datasets,'Transactions_temp_2')
+    assert len(datasets.QC_Flags) == len(T)
+
+def test_compact_table_is_smaller_and_holds_the_same_labels(datasets):
+    T = datasets.Transactions
+    As_Objects = T.astype({column:object for column in Categorical_Columns})
+
+    assert T.memory_usage(deep=True).sum() < As_Objects.memory_usage(deep=True).sum() / 2
+    pd.testing.assert_frame_equal(compact_transactions(As_Objects.copy()),T)
+
+def test_concatenated_tables_can_be_compacted_again(datasets):
+    T = datasets.Transactions
+    Halves = pd.concat([T.iloc[:500],T.iloc[500:].assign(tr_income=T['tr_income'].iloc[500:].cat.add_categories(['New label']))])
+
+    assert isinstance(compact_transactions(Halves)['tr_income'].dtype,pd.CategoricalDtype)
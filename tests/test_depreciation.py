@@ -0,0 +1,51 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from data_ingestion import generate_depreciation_schedule, build_depreciation_entries
+
+def get_looped_schedule(capex):
+
+    """The schedule as the original nested loop built it: one entry per item and month, dated purchase + j months"""
+
+    Rows = []
+    for description, amount, purchase_date, lifetime in capex.itertuples(index=False):
+        for j in range(1,int(lifetime) + 1):
+            Rows += [(description,amount / lifetime,purchase_date + pd.DateOffset(months=j))]
+    return pd.DataFrame(Rows,columns=['tr_description','tr_amt','tr_close_date'])
+
+@pytest.fixture
+def capex():
+    return pd.DataFrame({'tr_description':['Couch','Lamp','Table','Desk','Rug'],
+                         'tr_amt':[1200.0,90.0,640.0,310.0,75.0],
+                         'tr_close_date':pd.to_datetime(['2020-01-31','2020-02-29','2019-12-31 18:30','2021-03-15','2020-08-30']),
+                         'tr_SKU_lifetime':[12.0,7.9,36.0,24.0,1.0]})
+
+def test_schedule_matches_the_monthly_loop(capex):
+    Schedule, earlier_depreciation = generate_depreciation_schedule(capex)
+
+    pd.testing.assert_frame_equal(Schedule,get_looped_schedule(capex))
+    assert earlier_depreciation == 0
+
+@pytest.mark.parametrize('start_date,end_date',[(datetime.date(2020,6,1),datetime.date(2021,2,28)),
+                                                (datetime.date(2020,2,29),datetime.date(2020,3,31)),
+                                                (datetime.date(2030,1,1),datetime.date(2031,1,1))])
+def test_windowed_schedule_splits_the_full_schedule(capex,start_date,end_date):
+    Full = get_looped_schedule(capex)
+    Schedule, earlier_depreciation = generate_depreciation_schedule(capex,start_date,end_date)
+
+    Day = Full['tr_close_date'].dt.normalize()
+    In_Window = Full[(Day >= pd.Timestamp(start_date)) & (Day <= pd.Timestamp(end_date))].reset_index(drop=True)
+    pd.testing.assert_frame_equal(Schedule,In_Window)
+    assert earlier_depreciation == pytest.approx(Full.loc[Day < pd.Timestamp(start_date),'tr_amt'].sum())
+
+def test_entries_carry_earlier_depreciation_on_the_day_before_the_window(capex):
+    Transactions = capex.assign(tr_expense=['Housing Expense - Fixture Investment'] * 4 + ['Housing Expense - Rent'])
+    Entries = build_depreciation_entries(Transactions,datetime.date(2020,6,1),datetime.date(2020,12,31))
+
+    assert Entries['tr_close_date'].iloc[0] == pd.Timestamp('2020-05-31')
+    Full = get_looped_schedule(capex.iloc[:4])
+    assert Entries['tr_amt'].sum() == pytest.approx(Full.loc[Full['tr_close_date'].dt.normalize() <= pd.Timestamp('2020-12-31'),'tr_amt'].sum())
+    assert (Entries['tr_expense'] == 'Housing Expense - Depreciation').all()
+    assert np.all(np.diff(Entries['tr_close_date'].to_numpy()) > np.timedelta64(0))
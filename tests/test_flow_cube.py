@@ -0,0 +1,84 @@
+import datetime
+
+import pandas as pd
+import pytest
+from data_ingestion import ingestion_pipeline
+from flow_cube import flow_cube, pivot_by_month
+from income_statement_calculations import get_revenue_trend, get_expenses_trend
+
+def get_merged_expenses(datasets):
+
+    """The living expenses merged with the picklists, as the original get_expenses_trend did before grouping"""
+
+    T = datasets.Transactions.astype({'tr_expense':object})
+    Expenses = T[T['tr_expense'].notnull()].merge(datasets.Expense_Picklist,left_on='tr_expense',right_on='exp_name',how='left')
+    Expenses = Expenses[Expenses['exp_is_live'] == 1]
+    return Expenses.merge(datasets.Expense_Group_Picklist,on='exp_grp_ID',how='left')
+
+def test_trends_match_grouping_the_merged_transactions(datasets):
+    get_revenue_trend(datasets)
+    get_expenses_trend(datasets)
+
+    T = datasets.Transactions.astype({'tr_income':object})
+    Revenue = T[T['tr_income'].notnull()].merge(datasets.Income_Picklist,left_on='tr_income',right_on='inc_name',how='left')
+    Revenue = Revenue[Revenue['inc_is_operational'] == 1]
+    Revenue_Trend = Revenue.groupby(['Tr_Year','Tr_Month'],as_index=False)['tr_amt'].sum()
+    pd.testing.assert_frame_equal(datasets.Revenue_Trend,Revenue_Trend,check_dtype=False)
+
+    Expense_List = get_merged_expenses(datasets).groupby(['exp_grp','exp_name','Tr_Year','Tr_Month'],as_index=False)['tr_amt'].sum()
+    Expense_Pivot = pd.pivot_table(Expense_List,index=['exp_grp','exp_name'],values=['tr_amt'],columns=['Tr_Year','Tr_Month'],aggfunc=['sum'])
+    pd.testing.assert_frame_equal(datasets.Expense_Pivot,Expense_Pivot,check_dtype=False,check_column_type=False)
+
+def test_appended_cubes_match_one_cube(datasets):
+    T = datasets.Transactions
+    Whole = flow_cube(T,'expense',datasets.Expense_Picklist,datasets.Expense_Group_Picklist)
+    Halves = flow_cube(T.iloc[:600],'expense',datasets.Expense_Picklist,datasets.Expense_Group_Picklist).append(
+             flow_cube(T.iloc[600:],'expense',datasets.Expense_Picklist,datasets.Expense_Group_Picklist))
+
+    for by in [['exp_grp'],['exp_name','Tr_Year','Tr_Quarter'],['Tr_Year','Tr_Month']]:
+        pd.testing.assert_frame_equal(Halves.rollup(by),Whole.rollup(by))
+    with pytest.raises(ValueError):
+        Whole.append(datasets.Revenue_Cube)
+
+def test_drill_down_queries(datasets):
+    Cube = datasets.Expense_Cube
+    Expenses = get_merged_expenses(datasets)
+
+    Year_To_Date = Cube.year_to_date(2021,6)
+    Expected = Expenses[(Expenses['Tr_Year'] == 2021) & (Expenses['Tr_Month'] <= 6)].groupby('exp_grp',as_index=False)['tr_amt'].sum()
+    pd.testing.assert_frame_equal(Year_To_Date,Expected,check_dtype=False)
+
+    Top = Cube.top_categories(3)
+    assert len(Top) == 3 and Top['tr_amt'].is_monotonic_decreasing
+    assert Top['tr_amt'].iloc[0] == pytest.approx(Expenses.groupby('exp_name')['tr_amt'].sum().max())
+
+def test_unknown_labels_are_counted(datasets):
+    T = datasets.Transactions.astype({'tr_expense':object})
+    T.loc[T.index[T['tr_expense'].notnull()][:3],'tr_expense'] = 'Groceries (typo)'
+
+    assert flow_cube(T,'expense',datasets.Expense_Picklist,datasets.Expense_Group_Picklist).unknown_label_count() == 3
+    assert datasets.Expense_Cube.unknown_label_count() == 0
+
+def test_new_year_days_are_keyed_by_their_calendar_year(ledger):
+    T = ledger['Transactions']
+    Expense = T[T['tr_SKU_lifetime'].isnull() & T['tr_expense'].notnull()].iloc[:4].copy()
+    Expense['tr_expense'] = Expense['tr_expense'].iloc[0]
+    Expense['tr_amt'] = [1.0,2.0,4.0,8.0]
+    Expense['tr_close_date'] = pd.to_datetime(['2019-12-30','2020-12-31','2021-01-01','2021-01-04'])    # ISO years 2020, 2020, 2020, 2021
+    Expense['tr_init_date'] = Expense['tr_close_date']
+    datasets = ingestion_pipeline(path='',filename='',start_date=datetime.date(2019,12,1),end_date=datetime.date(2021,1,31),use_cache=False,
+                                  sheets=dict(ledger,Transactions=Expense))
+    datasets.preprocess_transactions()
+
+    Cells = datasets.Expense_Cube.rollup(['Tr_Year','Tr_Quarter','Tr_Month'])
+    assert Cells[['Tr_Year','Tr_Quarter','Tr_Month']].values.tolist() == [[2019,4,12],[2020,4,12],[2021,1,1]]
+    assert Cells['tr_amt'].tolist() == [1.0,2.0,12.0]
+    assert datasets.Expense_Cube.year_to_date(2021,1)['tr_amt'].sum() == 12.0
+    T = datasets.Transactions
+    assert T[['Tr_Week_Year','Tr_Week']].values.tolist() == [[2020,1],[2020,53],[2020,53],[2021,1]]
+
+def test_pivot_matches_pivot_table():
+    List = pd.DataFrame({'grp':['a','a','b'],'Tr_Year':[2020,2021,2021],'Tr_Month':[12,1,1],'tr_amt':[1.0,2.0,3.0]})
+    Expected = pd.pivot_table(List,index=['grp'],values=['tr_amt'],columns=['Tr_Year','Tr_Month'],aggfunc=['sum'])
+
+    pd.testing.assert_frame_equal(pivot_by_month(List,['grp']),Expected,check_column_type=False)
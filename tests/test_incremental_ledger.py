@@ -0,0 +1,106 @@
+import datetime
+
+import pandas as pd
+import pytest
+from balance_sheet_calculations import get_account_level_balance_sheet
+from data_ingestion import ingestion_pipeline
+from incremental_ledger import preprocess_transactions_incrementally
+from income_statement_calculations import get_revenue_trend, get_expenses_trend
+from conftest import Start_Date, End_Date
+
+def run(Sheets,state_dir,incremental=True,end_date=End_Date):
+    datasets = ingestion_pipeline(path='',filename='Data Structure.xlsx',start_date=Start_Date,end_date=end_date,use_cache=False,sheets=Sheets)
+    if incremental:
+        preprocess_transactions_incrementally(datasets,str(state_dir))
+    else:
+        datasets.preprocess_transactions()
+    get_account_level_balance_sheet(datasets)
+    get_revenue_trend(datasets)
+    get_expenses_trend(datasets)
+    return datasets
+
+def with_transactions(ledger,Transactions):
+    return dict(ledger,Transactions=Transactions.reset_index(drop=True))
+
+def get_new_rows(ledger,dates):
+
+    """Copies of regular (non-capex) transactions with new tr_IDs, closed on the given dates"""
+
+    Transactions = ledger['Transactions']
+    New_Rows = Transactions[Transactions['tr_SKU_lifetime'].isnull()].iloc[:len(dates)].copy()
+    New_Rows['tr_ID'] += Transactions['tr_ID'].max()
+    New_Rows['tr_close_date'] = pd.to_datetime(dates)
+    New_Rows['tr_init_date'] = New_Rows['tr_close_date']
+    return New_Rows
+
+def test_folding_new_rows_matches_a_full_rebuild(ledger,tmp_path,capsys):
+    Transactions = ledger['Transactions']
+    Before = with_transactions(ledger,Transactions.drop(index=Transactions[Transactions['tr_SKU_lifetime'].isnull()].index[-200:]))
+    run(Before,tmp_path)
+    New_Rows = get_new_rows(ledger,['2019-05-01','2020-03-14','2020-03-15','2020-12-31','2021-09-30','2021-10-01'])
+    After = with_transactions(ledger,pd.concat([ledger['Transactions'],New_Rows]))
+
+    capsys.readouterr()
+    Folded = run(After,tmp_path)
+    assert 'folding 206 new transactions' in capsys.readouterr().out
+    Rebuilt = run(After,tmp_path,incremental=False)
+
+    pd.testing.assert_frame_equal(Folded.Acct_Level_Summary,Rebuilt.Acct_Level_Summary,check_exact=False)
+    pd.testing.assert_frame_equal(Folded.Revenue_Trend,Rebuilt.Revenue_Trend,check_exact=False)
+    pd.testing.assert_frame_equal(Folded.Expense_Pivot,Rebuilt.Expense_Pivot,check_exact=False)
+    assert Folded.Transactions['Tr_Date'].is_monotonic_increasing
+    assert len(Folded.Postings) == len(Folded.QC_Flags) == len(Folded.Transactions) == len(Rebuilt.Transactions)
+    assert (Folded.Transactions.dtypes == Rebuilt.Transactions.dtypes).all()
+    Order = ['Tr_Date','tr_ID']
+    pd.testing.assert_frame_equal(Folded.Transactions.sort_values(Order).reset_index(drop=True).astype(object),
+                                  Rebuilt.Transactions.sort_values(Order).reset_index(drop=True).astype(object))
+
+@pytest.mark.parametrize('change,reason',[('edit','historical transactions were edited'),
+                                          ('remove','historical transactions were removed'),
+                                          ('capex','new capex items change past depreciation entries')])
+def test_other_changes_fall_back_to_a_full_rebuild(ledger,tmp_path,capsys,change,reason):
+    run(ledger,tmp_path)
+    Transactions = ledger['Transactions'].copy()
+    if change == 'edit':
+        Transactions.loc[5,'tr_amt'] += 1
+    elif change == 'remove':
+        Transactions = Transactions.drop(index=5)
+    else:
+        Capex = Transactions[Transactions['tr_SKU_lifetime'].notnull()].iloc[:1].copy()
+        Capex['tr_ID'] = Transactions['tr_ID'].max() + 1
+        Transactions = pd.concat([Transactions,Capex])
+
+    capsys.readouterr()
+    Rerun = run(with_transactions(ledger,Transactions),tmp_path)
+    assert 'full rebuild (' + reason + ')' in capsys.readouterr().out
+    pd.testing.assert_frame_equal(Rerun.Acct_Level_Summary,run(with_transactions(ledger,Transactions),tmp_path,incremental=False).Acct_Level_Summary)
+
+def test_a_different_start_or_earlier_end_falls_back_to_a_full_rebuild(ledger,tmp_path,capsys):
+    run(ledger,tmp_path)
+    datasets = ingestion_pipeline(path='',filename='Data Structure.xlsx',start_date=datetime.date(2020,1,1),end_date=End_Date,use_cache=False,sheets=ledger)
+
+    capsys.readouterr()
+    preprocess_transactions_incrementally(datasets,str(tmp_path))
+    assert 'Start_Date changed' in capsys.readouterr().out
+
+    run(ledger,tmp_path)
+    capsys.readouterr()
+    run(ledger,tmp_path,end_date=End_Date - datetime.timedelta(days=1))
+    assert 'full rebuild (End_Date moved back)' in capsys.readouterr().out
+
+def test_advancing_end_date_daily_folds_like_a_full_rebuild(ledger,tmp_path,capsys):
+    Transactions = ledger['Transactions']
+    Days = [End_Date + datetime.timedelta(days=day) for day in range(1,36)]    # past a month end, so every capex item depreciates
+    run(with_transactions(ledger,Transactions),tmp_path)
+    for day, end_date in enumerate(Days,start=1):
+        Transactions = pd.concat([Transactions,get_new_rows(ledger,[end_date]).assign(tr_ID=lambda New_Rows: New_Rows['tr_ID'] + day)])
+        capsys.readouterr()
+        Folded = run(with_transactions(ledger,Transactions),tmp_path,end_date=end_date)
+        assert 'folding 1 new transactions' in capsys.readouterr().out
+
+    Rebuilt = run(with_transactions(ledger,Transactions),tmp_path,incremental=False,end_date=Days[-1])
+    pd.testing.assert_frame_equal(Folded.Acct_Level_Summary,Rebuilt.Acct_Level_Summary,check_exact=False)
+    pd.testing.assert_frame_equal(Folded.Expense_Pivot,Rebuilt.Expense_Pivot,check_exact=False)
+    pd.testing.assert_series_equal(Folded.QC_Pushed_Down_Counts.sort_index(),Rebuilt.QC_Pushed_Down_Counts.sort_index())
+    assert len(Folded.Transactions) == len(Rebuilt.Transactions)
+    assert Folded.Transactions['Tr_Date'].max() == pd.Timestamp(Days[-1])
@@ -0,0 +1,60 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from data_ingestion import Input_Sheets
+from input_cache import read_workbook_sheets, write_file_atomically
+from synthetic_ledger import write_workbook
+
+def test_cache_round_trips_the_sheets(workbook,tmp_path):
+    path, filename = workbook
+    cache_dir = str(tmp_path / 'cache')
+
+    Parsed, hit = read_workbook_sheets(path + filename,Input_Sheets,cache_dir)
+    Cached, cached_hit = read_workbook_sheets(path + filename,Input_Sheets,cache_dir)
+
+    assert not hit and cached_hit
+    for sheet in Input_Sheets:
+        pd.testing.assert_frame_equal(Cached[sheet],Parsed[sheet])
+
+def test_cache_misses_after_the_workbook_changes(workbook,ledger,tmp_path):
+    path, filename = workbook
+    cache_dir = str(tmp_path / 'cache')
+    read_workbook_sheets(path + filename,Input_Sheets,cache_dir)
+
+    Sheets = dict(ledger)
+    Sheets['Transactions'] = ledger['Transactions'].iloc[:100]
+    write_workbook(Sheets,path + filename)
+    Reread, hit = read_workbook_sheets(path + filename,Input_Sheets,cache_dir)
+
+    assert not hit
+    assert len(Reread['Transactions']) == 100
+    assert len(os.listdir(cache_dir)) == 1    # the stale entry was replaced
+
+def test_concurrent_misses_on_one_workbook_dont_collide(workbook,tmp_path):
+    path, filename = workbook
+    cache_dir = str(tmp_path / 'cache')
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        Results = list(pool.map(lambda _: read_workbook_sheets(path + filename,Input_Sheets,cache_dir),range(6)))
+
+    for Sheets, hit in Results:
+        pd.testing.assert_frame_equal(Sheets['Transactions'],Results[0][0]['Transactions'])
+    assert [entry for entry in os.listdir(cache_dir) if entry.endswith('.tmp')] == []
+    assert read_workbook_sheets(path + filename,Input_Sheets,cache_dir)[1]
+
+def test_atomic_writes_use_their_own_temporary_file(tmp_path):
+    target_file = str(tmp_path / 'state' / 'ledger.pkl')
+    write_file_atomically(target_file,lambda f: f.write(b'first'))
+    Other_Run = tmp_path / 'state' / 'ledger.pkl.other.tmp'    # another run's write in progress
+    Other_Run.write_bytes(b'partial')
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda i: write_file_atomically(target_file,lambda f: f.write(b'run ' + str(i).encode())),range(8)))
+    try:
+        write_file_atomically(target_file,lambda f: 1 / 0)
+    except ZeroDivisionError:
+        pass
+
+    assert open(target_file,'rb').read().startswith(b'run ')
+    assert sorted(os.listdir(tmp_path / 'state')) == ['ledger.pkl','ledger.pkl.other.tmp']
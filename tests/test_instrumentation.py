@@ -0,0 +1,71 @@
+import json
+
+import pandas as pd
+import pytest
+import instrumentation
+from instrumentation import instrument, report_progress, enable_tracing, disable_tracing, summarize_trace
+from main_script import main, main_streaming
+from synthetic_ledger import write_transaction_log
+from conftest import Start_Date, End_Date
+
+@instrument
+def split_rows(self,Rows):
+    report_progress('splitting ' + str(len(Rows)) + ' rows')
+    return count_first_half(self,Rows.iloc[:len(Rows) // 2])
+
+@instrument
+def count_first_half(self,Rows):
+    return Rows
+
+@instrument
+def fail(self,Rows):
+    raise RuntimeError('stage failed')
+
+@pytest.fixture
+def tracing():
+    enable_tracing(memory=True)
+    yield
+    disable_tracing()
+
+def test_nested_stages_are_recorded_with_rows_and_messages(tracing):
+    split_rows(None,pd.DataFrame({'a':range(10)}))
+    Records = {record['stage']:record for record in instrumentation.Trace_Records}
+
+    assert Records['split_rows']['rows_in'] == 10 and Records['split_rows']['rows_out'] == 5
+    assert Records['count_first_half']['parent'] == 'split_rows' and Records['count_first_half']['depth'] == 1
+    assert Records['split_rows']['messages'] == ['splitting 10 rows']
+    assert Records['split_rows']['peak_memory_delta_mb'] >= 0
+
+def test_failed_stages_are_traced_and_summarized(tracing):
+    with pytest.raises(RuntimeError):
+        fail(None,pd.DataFrame({'a':range(3)}))
+    split_rows(None,pd.DataFrame({'a':range(4)}))
+
+    assert instrumentation.Trace_Records[0]['status'] == 'failed' and instrumentation.Trace_Records[0]['rows_out'] is None
+    Summary = summarize_trace().set_index('stage')
+    assert Summary.loc['fail','failed_calls'] == 1 and Summary.loc['split_rows','failed_calls'] == 0
+
+def test_disabled_tracing_records_nothing():
+    disable_tracing()
+    instrumentation.Trace_Records.clear()
+    split_rows(None,pd.DataFrame({'a':range(4)}))
+
+    assert instrumentation.Trace_Records == []
+
+def test_main_writes_a_trace_of_every_stage(workbook,tmp_path):
+    path, filename = workbook
+    main(path,filename,Start_Date,End_Date,trace_file=str(tmp_path / 'trace.json'))
+
+    with open(tmp_path / 'trace.json') as f:
+        Stages = {record['stage'] for record in json.load(f)['stages']}
+    assert {'ingestion_pipeline.preprocess_transactions','get_account_level_balance_sheet','get_KPI_trend','run_qc_checks','generate_csv_outputs'} <= Stages
+
+def test_main_streaming_writes_a_trace(workbook,ledger,tmp_path):
+    path, filename = workbook
+    transactions_file = write_transaction_log(ledger,str(tmp_path / 'transactions.csv'))
+    main_streaming(path,filename,transactions_file,Start_Date,End_Date,chunksize=500,trace_file=str(tmp_path / 'trace.json'))
+
+    with open(tmp_path / 'trace.json') as f:
+        Records = json.load(f)['stages']
+    assert sum(record['stage'] == 'streaming_pipeline.fold_transactions' for record in Records) == 5    # 4 chunks and the depreciation
+    assert not instrumentation.Trace_Enabled
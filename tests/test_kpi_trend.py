@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from balance_sheet_calculations import get_account_level_balance_sheet, get_account_type_level_balance_sheet
+from income_statement_calculations import calculate_financial_KPIs, get_KPI_trend, get_KPIs
+from main_script import main
+from conftest import Start_Date, End_Date
+
+def test_zero_denominators_give_nan_not_inf():
+    KPIs = get_KPIs(pd.DataFrame({"total_assets":[0.0,100.0],"liquid_net_assets":[5.0,50.0],"total_liabilities":[0.0,25.0],"revenue":[0.0,10.0],"net_income":[-3.0,4.0]}))
+
+    assert not np.isinf(KPIs.to_numpy()).any()
+    assert KPIs.iloc[0,1:].isnull().all()
+    assert KPIs.iloc[1].tolist() == [25.0,4.0,2.0,0.1,0.4,0.04]
+
+@pytest.mark.parametrize('frequency',['M','W'])
+def test_last_period_balances_match_the_balance_sheet(datasets,frequency):
+    get_account_level_balance_sheet(datasets)
+    get_account_type_level_balance_sheet(datasets)
+    calculate_financial_KPIs(datasets)
+    get_KPI_trend(datasets,frequency)
+
+    Trend = datasets.KPI_Trend
+    assert Trend["Period_Start"].iloc[0] == pd.Timestamp(Start_Date) and Trend["Period_End"].iloc[-1] == pd.Timestamp(End_Date)
+    assert (Trend["Period_Start"].iloc[1:].to_numpy() == (Trend["Period_End"].iloc[:-1] + pd.Timedelta(days=1)).to_numpy()).all()
+    Summary = datasets.Summary_KPI.set_index("Metric")["Value"]
+    for metric in ["liquid_net_assets minus liability","current_ratio","cash_ratio"]:
+        assert Trend[metric].iloc[-1] == pytest.approx(Summary[metric])
+    assert not np.isinf(Trend.select_dtypes('number').to_numpy()).any()
+
+def test_weekly_trend_runs_end_to_end(workbook):
+    path, filename = workbook
+    main(path,filename,Start_Date,End_Date,kpi_frequency='W')
+
+    KPI_Trend = pd.read_excel(os.path.join(path,'Output.xlsx'),sheet_name='KPI_Trend',index_col=0)
+    assert len(KPI_Trend) == len(pd.period_range(Start_Date,End_Date,freq='W'))
+    assert not KPI_Trend.isin(['inf','-inf']).any().any()
+    assert KPI_Trend['net_profit_margin'].isnull().any()    # weeks without revenue
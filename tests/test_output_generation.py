@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from output_generation import generate_csv_outputs, Output_Manifest
+from flow_cube import pivot_by_month
+
+class report_holder(object):
+
+    """Stands in for the pipeline object: only the report attributes which generate_csv_outputs reads"""
+    def __init__(self,path,**Reports):
+        self.path = path
+        for attribute, Report in Reports.items():
+            setattr(self,attribute,Report)
+
+@pytest.fixture
+def reports():
+    Summary_KPI = pd.DataFrame({'Metric':['current_ratio','cash_ratio','net_profit_margin','ROA'],
+                                'Value':[np.inf,-np.inf,np.nan,0.25]})
+    Expense_List = pd.DataFrame({'exp_grp':['Food','Food','Food','Housing'],'exp_name':['Groceries','Groceries','Groceries','Rent'],
+                                 'Tr_Year':[2020,2021,2021,2021],'Tr_Month':[12,1,2,1],'tr_amt':[3.0,10.5,np.inf,900.0]})
+    KPI_Trend = pd.DataFrame({'Period':['2021-01','2021-02'],'Period_End':pd.to_datetime(['2021-01-31','2021-02-28']),'current_ratio':[np.nan,2.0]})
+    return {'Summary_KPI':Summary_KPI,'Expense_Pivot':pivot_by_month(Expense_List,['exp_grp','exp_name']),'KPI_Trend':KPI_Trend}
+
+def test_xlsx_matches_to_excel_including_inf_and_nan(reports,tmp_path):
+    generate_csv_outputs(report_holder(str(tmp_path) + os.sep,**reports),'xlsx')
+
+    with pd.ExcelWriter(str(tmp_path / 'Expected.xlsx')) as writer:
+        for sheet, attribute in [('Expenses_Trend','Expense_Pivot'),('Summary_KPI','Summary_KPI'),('KPI_Trend','KPI_Trend')]:
+            reports[attribute].to_excel(writer,sheet_name=sheet)
+    Written = pd.read_excel(str(tmp_path / 'Output.xlsx'),sheet_name=None,header=None)
+    Expected = pd.read_excel(str(tmp_path / 'Expected.xlsx'),sheet_name=None,header=None)
+
+    assert list(Written) == ['Expenses_Trend','Summary_KPI','KPI_Trend']
+    for sheet in Written:
+        pd.testing.assert_frame_equal(Written[sheet],Expected[sheet],obj=sheet)
+    assert Written['Summary_KPI'].iloc[1:4,2].tolist()[:2] == ['inf','-inf']
+
+@pytest.mark.parametrize('output_format',['csv','parquet'])
+def test_files_round_trip_inf_and_nan(reports,tmp_path,output_format):
+    generate_csv_outputs(report_holder(str(tmp_path) + os.sep,**reports),output_format)
+
+    output_file = str(tmp_path / 'Output' / ('Summary_KPI.' + output_format))
+    Read = pd.read_csv(output_file,index_col=0) if output_format == 'csv' else pd.read_parquet(output_file)
+    pd.testing.assert_frame_equal(Read,reports['Summary_KPI'])
+
+def test_unchanged_reports_are_not_rewritten(reports,tmp_path,capsys):
+    path = str(tmp_path) + os.sep
+    generate_csv_outputs(report_holder(path,**reports),'csv')
+    written = os.path.getmtime(str(tmp_path / 'Output' / 'KPI_Trend.csv'))
+
+    reports['Summary_KPI'].loc[3,'Value'] = 0.5
+    capsys.readouterr()
+    generate_csv_outputs(report_holder(path,**reports),'csv')
+
+    assert '(1 written, 2 unchanged)' in capsys.readouterr().out
+    assert os.path.getmtime(str(tmp_path / 'Output' / 'KPI_Trend.csv')) == written
+    assert os.path.exists(str(tmp_path / 'Output' / Output_Manifest))
+
+def test_unknown_formats_are_rejected(reports,tmp_path):
+    with pytest.raises(ValueError,match='unknown output format'):
+        generate_csv_outputs(report_holder(str(tmp_path) + os.sep,**reports),'json')
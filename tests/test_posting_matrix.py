@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from posting_matrix import posting_matrix, sign_to_vector
+
+def get_looped_net_change(Transactions,acc_IDs):
+
+    """Net change of every account, leg by leg and sign by sign as the original calculate_change filtered them"""
+
+    Net_Change = pd.Series(0.0,index=acc_IDs)
+    for leg in ['1','2']:
+        for sign, vector in [('[+ve]',1),('[-ve]',-1)]:
+            Legs = Transactions[Transactions['Impacted_Acc_' + leg + '_Sign'] == sign]
+            Sums = Legs.groupby('Impacted_Acc_ID_' + leg)['Impacted_Acc_' + leg + '_Mag'].sum()
+            Net_Change = Net_Change.add(vector * Sums.reindex(acc_IDs).fillna(0),fill_value=0)
+    return Net_Change.to_numpy()
+
+def test_net_change_matches_the_filtered_sums(datasets):
+    Postings = posting_matrix(datasets.Transactions,datasets.Accounts)
+
+    assert np.allclose(Postings.net_change()[0],get_looped_net_change(datasets.Transactions,Postings.acc_IDs))
+
+def test_opening_balances_are_part_of_the_totals(datasets):
+    Postings = datasets.Postings
+    In_Window = posting_matrix(datasets.Transactions,datasets.Accounts)
+
+    assert np.allclose(Postings.net_change()[0],In_Window.net_change()[0] + Postings.Opening[0])
+    assert (Postings.net_change()[1] == In_Window.net_change()[1] + Postings.Opening[1]).all()
+    assert Postings.detail_start == np.datetime64(datasets.start_date,'D')
+
+def test_appended_halves_match_the_whole(datasets):
+    Transactions = datasets.Transactions
+    Whole = posting_matrix(Transactions,datasets.Accounts)
+    Halves = posting_matrix(Transactions.iloc[:700],datasets.Accounts).append(posting_matrix(Transactions.iloc[700:],datasets.Accounts))
+
+    for Combined, Expected in zip(Halves.net_change(),Whole.net_change()):
+        assert np.allclose(Combined,Expected)
+    for Combined, Expected in zip(Halves.legs(),Whole.legs()):
+        assert np.array_equal(Combined,Expected)
+
+def test_take_reorders_the_postings_and_keeps_the_totals(datasets):
+    Postings = datasets.Postings
+    order = np.arange(len(Postings))[::-1]
+    Reversed = Postings.take(order)
+
+    assert np.array_equal(Reversed.day,Postings.day[order])
+    assert np.array_equal(Reversed.net_change()[0],Postings.net_change()[0])
+
+def test_unknown_accounts_and_signs_are_not_posted(datasets):
+    Transactions = datasets.Transactions.iloc[:3].copy()
+    Transactions['Impacted_Acc_ID_1'] = [np.nan,999,Transactions['Impacted_Acc_ID_1'].iloc[2]]
+    Transactions['Impacted_Acc_2_Sign'] = Transactions['Impacted_Acc_2_Sign'].astype(object)
+    Transactions.iloc[2,Transactions.columns.get_loc('Impacted_Acc_2_Sign')] = 'positive'
+    Postings = posting_matrix(Transactions,datasets.Accounts)
+
+    assert Postings.unmapped_rows().tolist() == [True,True,False]
+    assert Postings.sign_2[2] == 0
+    assert Postings.net_change()[1].sum() == 4    # both legs of row 3 and the second leg of rows 1 and 2
+
+def test_sign_tokens():
+    assert sign_to_vector(pd.Series(['[+ve]','[-ve]','+',None])).tolist() == [1,-1,0,0]
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+from balance_sheet_calculations import get_account_level_balance_sheet, get_account_type_level_balance_sheet
+from data_ingestion import ingestion_pipeline
+from incremental_ledger import preprocess_transactions_incrementally
+from run_qc_tests import run_qc_checks, QC_Checks
+from conftest import Start_Date, End_Date
+
+def run_checks(Sheets,state_dir=None):
+    datasets = ingestion_pipeline(path='',filename='Data Structure.xlsx',start_date=Start_Date,end_date=End_Date,use_cache=False,sheets=Sheets)
+    if state_dir is None:
+        datasets.preprocess_transactions()
+    else:
+        preprocess_transactions_incrementally(datasets,str(state_dir))
+    get_account_level_balance_sheet(datasets)
+    get_account_type_level_balance_sheet(datasets)
+    run_qc_checks(datasets)
+    return datasets
+
+@pytest.fixture
+def bad_ledger(ledger):
+
+    """The ledger with known problems, in regular transactions inside the window (tr_IDs 'in_window') and before it
+    ('earlier')"""
+
+    T = ledger['Transactions'].copy()
+    T['tr_amt'] = T['tr_amt'].astype(object)
+    Regular = T['tr_SKU_lifetime'].isnull()
+    In_Window = T.index[Regular & (T['tr_close_date'] >= pd.Timestamp(Start_Date)) & (T['tr_close_date'] <= pd.Timestamp(End_Date))]
+    Earlier = T.index[Regular & (T['tr_close_date'] < pd.Timestamp(Start_Date))]
+
+    T.loc[In_Window[0],'tr_amt'] = '12,50'
+    T.loc[In_Window[1],'tr_amt'] = np.nan
+    T.loc[Earlier[0],'tr_amt'] = 'abc'
+    T.loc[Earlier[1],'tr_amt'] = np.nan
+    T.loc[In_Window[2],'tr_close_date'] = pd.NaT
+    T.loc[In_Window[3],'tr_init_date'] = T.loc[In_Window[3],'tr_close_date'] + pd.Timedelta(days=2)
+    T.loc[In_Window[4],'tr_impacted_acc_1'] = 'Chequing'
+    T.loc[In_Window[5],'tr_impacted_acc_2_sign'] = '+'
+    T.loc[In_Window[6],'tr_ID'] = T.loc[In_Window[7],'tr_ID']
+    T.loc[In_Window[8],'tr_amt'] = 0.0
+
+    Sheets = dict(ledger,Transactions=T)
+    Sheets['IDs'] = {'non_numeric_amounts':T.loc[In_Window[0],'tr_ID'],'missing_amounts':T.loc[In_Window[1],'tr_ID'],
+                     'non_chronological_dates':T.loc[In_Window[3],'tr_ID'],'non_standard_account_names':T.loc[In_Window[4],'tr_ID'],
+                     'unknown_sign_tokens':T.loc[In_Window[5],'tr_ID'],'zero_amounts':T.loc[In_Window[8],'tr_ID']}
+    return Sheets
+
+def test_clean_ledger_passes_every_check(ledger):
+    Results = run_checks(ledger).QC_Results.set_index('check')
+    Later = (ledger['Transactions']['tr_close_date'] > pd.Timestamp(End_Date)).sum()
+
+    assert Results.index.tolist() == list(QC_Checks)
+    assert Results['passed'].drop('out_of_window_dates').all(),Results
+    assert Results.loc['out_of_window_dates','count'] == Later > 0    # the ledger runs past End_Date
+
+def test_mistyped_dates_are_reported_as_out_of_window(ledger):
+    T = ledger['Transactions'].copy()
+    Later = (T['tr_close_date'] > pd.Timestamp(End_Date)).sum()
+    In_Window = T.index[(T['tr_close_date'] >= pd.Timestamp(Start_Date)) & (T['tr_close_date'] <= pd.Timestamp(End_Date))]
+    T.loc[In_Window[0],'tr_close_date'] = pd.Timestamp(2202,1,5)
+
+    datasets = run_checks(dict(ledger,Transactions=T))
+    Result = datasets.QC_Results.set_index('check').loc['out_of_window_dates']
+
+    assert Result['severity'] == 'warning' and Result['count'] == Later + 1
+    assert Result['detail'] == '0 of ' + str(len(datasets.Transactions)) + ' transactions, plus ' + str(Later + 1) + ' closed after End_Date'
+
+def test_bad_input_is_reported_instead_of_failing_preprocessing(bad_ledger):
+    datasets = run_checks(bad_ledger)
+    Counts = datasets.QC_Results.set_index('check')['count']
+    Later = (bad_ledger['Transactions']['tr_close_date'] > pd.Timestamp(End_Date)).sum()
+
+    assert Counts.to_dict() == {'accounting_equation':1,'non_chronological_dates':1,'non_standard_account_names':1,'unknown_sign_tokens':1,
+                                'missing_amounts':2,'non_numeric_amounts':2,'undated_transactions':1,'duplicate_tr_IDs':2,
+                                'zero_amounts':1,'duplicate_transactions':0,'out_of_window_dates':Later}
+    for check, tr_ID in bad_ledger['IDs'].items():
+        assert datasets.Transactions['tr_ID'].iloc[datasets.QC_Offending_Rows[check]].tolist() == [tr_ID],check
+    Details = datasets.QC_Results.set_index('check')['detail']
+    assert Details['non_numeric_amounts'] == '1 of ' + str(len(datasets.Transactions)) + ' transactions, plus 1 undated or before Start_Date'
+    assert datasets.Transactions['tr_amt'].dtype == np.float64
+
+def test_folded_rows_are_checked_like_a_full_rebuild(bad_ledger,tmp_path,capsys):
+    T = bad_ledger['Transactions'].assign(tr_ID=np.arange(1,len(bad_ledger['Transactions']) + 1))    # duplicate tr_IDs force a rebuild
+    Bad_Amounts = T['tr_amt'].map(lambda amount: amount == '12,50' or amount != amount)    # 'abc' stays, so tr_amt is mixed in both runs
+    run_checks(dict(bad_ledger,Transactions=T[~Bad_Amounts]),tmp_path)
+
+    capsys.readouterr()
+    Folded = run_checks(dict(bad_ledger,Transactions=T),tmp_path)
+    assert 'folding 3 new transactions' in capsys.readouterr().out
+    Rebuilt = run_checks(dict(bad_ledger,Transactions=T))
+    pd.testing.assert_frame_equal(Folded.QC_Results,Rebuilt.QC_Results)
+    assert Folded.QC_Results.set_index('check').loc[['missing_amounts','non_numeric_amounts'],'count'].tolist() == [2,2]
+
+def test_problems_before_the_window_are_reported(ledger):
+    T = ledger['Transactions'].copy()
+    Earlier = T.index[T['tr_SKU_lifetime'].isnull() & (T['tr_close_date'] < pd.Timestamp(Start_Date))]
+    T.loc[Earlier[0],'tr_init_date'] = T.loc[Earlier[0],'tr_close_date'] + pd.Timedelta(days=2)
+    T.loc[Earlier[1],'tr_impacted_acc_1'] = 'Chequing'
+    T.loc[Earlier[2],'tr_expense'] = 'Groceries'
+    T.loc[Earlier[3],'tr_impacted_acc_2_sign'] = '+'
+    T.loc[Earlier[4],'tr_ID'] = T.loc[Earlier[5],'tr_ID']
+    T.loc[T.index[-1],'tr_ID'] = T.loc[Earlier[6],'tr_ID']    # closed after End_Date, so not a duplicate
+
+    datasets = run_checks(dict(ledger,Transactions=T))
+    Counts = datasets.QC_Results.set_index('check')['count']
+
+    assert Counts[['non_chronological_dates','non_standard_account_names','unknown_sign_tokens','duplicate_tr_IDs']].tolist() == [1,2,1,2]
+    assert all(len(datasets.QC_Offending_Rows[check]) == 0 for check in ['non_chronological_dates','non_standard_account_names','unknown_sign_tokens','duplicate_tr_IDs'])
+    assert datasets.QC_Results.set_index('check')['detail']['unknown_sign_tokens'] == '0 of ' + str(len(datasets.Transactions)) + ' transactions, plus 1 undated or before Start_Date'
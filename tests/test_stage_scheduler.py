@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+import stage_scheduler
+from data_ingestion import ingestion_pipeline
+from stage_scheduler import build_pipeline_stages, run_pipeline, pipeline_stage, get_code_fingerprint
+from conftest import Start_Date, End_Date
+
+Reports = ['Acct_Level_Summary','Class_Level_Summary','BS_Level_Summary','Revenue_Breakdown','Revenue_Trend','Expense_Pivot','Summary_KPI','KPI_Trend','BS_Level_Summary_As_Of']
+
+def get_datasets(ledger,tmp_path):
+    return ingestion_pipeline(path=str(tmp_path) + os.sep,filename='Data Structure.xlsx',start_date=Start_Date,end_date=End_Date,use_cache=False,sheets=ledger)
+
+def run_sequentially(datasets):
+    for stage in build_pipeline_stages(As_Of_Dates=[End_Date]):
+        stage.function(datasets,*stage.args)
+    return datasets
+
+def test_scheduled_run_matches_the_sequential_run_and_is_then_cached(ledger,tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    Sequential = run_sequentially(get_datasets(ledger,tmp_path))
+
+    Scheduled = get_datasets(ledger,tmp_path)
+    First = run_pipeline(Scheduled,build_pipeline_stages(As_Of_Dates=[End_Date]),cache_dir)
+    Cached = get_datasets(ledger,tmp_path)
+    Second = run_pipeline(Cached,build_pipeline_stages(As_Of_Dates=[End_Date]),cache_dir)
+
+    for report in Reports:
+        pd.testing.assert_frame_equal(getattr(Scheduled,report),getattr(Sequential,report),obj=report)
+        pd.testing.assert_frame_equal(getattr(Cached,report),getattr(Sequential,report),obj=report)
+    assert (First["status"] == 'ran').all()
+    assert set(Second.loc[Second["status"] == 'ran',"stage"]) == {'run_qc_checks','generate_csv_outputs'}    # side effects only
+
+def test_changed_inputs_rerun_only_the_affected_stages(ledger,tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    run_pipeline(get_datasets(ledger,tmp_path),build_pipeline_stages(),cache_dir)
+
+    Changed = dict(ledger,tblpl_income_group=ledger['tblpl_income_group'].assign(inc_grp=lambda df: df['inc_grp'] + ' (renamed)'))
+    Status = run_pipeline(get_datasets(Changed,tmp_path),build_pipeline_stages(),cache_dir).set_index("stage")["status"]
+
+    assert Status['preprocess_transactions'] == 'ran' and Status['get_revenue_trend'] == 'ran'
+    assert Status['get_account_level_balance_sheet'] == 'cached' and Status['get_KPI_trend'] == 'cached'
+
+def test_code_changes_outside_the_stage_function_invalidate_the_cache(ledger,tmp_path,monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    module_dir = tmp_path / 'stages'
+    module_dir.mkdir()
+    (module_dir / 'custom_stages.py').write_text("Scale = 2\n\ndef scaled(n):\n    return n * Scale\n\ndef count_transactions(self):\n    self.Count = scaled(len(self.Transactions))\n")
+    monkeypatch.syspath_prepend(str(module_dir))
+    from custom_stages import count_transactions
+    Stages = [pipeline_stage(count_transactions,['Transactions'],['Count'])]
+
+    def get_status():
+        return run_pipeline(get_datasets(ledger,tmp_path),Stages,cache_dir)["status"].iloc[0]
+
+    assert get_status() == 'ran'
+    assert get_status() == 'cached'
+    (module_dir / 'custom_stages.py').write_text((module_dir / 'custom_stages.py').read_text().replace('Scale = 2','Scale = 3'))
+    assert get_status() == 'ran'
+    monkeypatch.setattr(stage_scheduler,'Stage_Cache_Format_Version',stage_scheduler.Stage_Cache_Format_Version + 1)
+    assert get_status() == 'ran'
+    sys.modules.pop('custom_stages')
+
+def test_code_fingerprint_covers_the_pipeline_modules():
+    before = get_code_fingerprint([])
+    assert get_code_fingerprint(build_pipeline_stages()) == before    # the stages' modules are already covered
+
+def test_unresolvable_dependencies_are_reported(ledger,tmp_path):
+    Stages = [pipeline_stage(lambda self: None,['Missing'],['Found']),pipeline_stage(lambda self: None,['Found'],['Missing'])]
+    with pytest.raises(ValueError,match="can't be resolved"):
+        run_pipeline(get_datasets(ledger,tmp_path),Stages,str(tmp_path / 'cache'))
+
+def test_caching_a_stage_leaves_other_runs_temporary_files_alone(ledger,tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    run_pipeline(get_datasets(ledger,tmp_path),build_pipeline_stages(),cache_dir)
+    Stage_Dir = tmp_path / 'cache' / 'get_revenue_trend'
+    (Stage_Dir / 'other_run.pkl.abc.tmp').write_bytes(b'partial')
+
+    Changed = dict(ledger,tblpl_income_group=ledger['tblpl_income_group'].assign(inc_grp=lambda df: df['inc_grp'] + ' (renamed)'))
+    run_pipeline(get_datasets(Changed,tmp_path),build_pipeline_stages(),cache_dir)
+
+    Entries = sorted(os.listdir(Stage_Dir))
+    assert len(Entries) == 2 and Entries[0].endswith('.pkl') and Entries[1] == 'other_run.pkl.abc.tmp'
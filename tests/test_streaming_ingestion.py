@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+from balance_sheet_calculations import get_account_level_balance_sheet, get_account_type_level_balance_sheet, get_overall_balance_sheet
+from data_ingestion import ingestion_pipeline
+from income_statement_calculations import get_revenue_trend, get_expenses_trend, calculate_financial_KPIs
+from streaming_ingestion import streaming_pipeline, read_transaction_chunks
+from synthetic_ledger import write_transaction_log
+from conftest import Start_Date, End_Date
+
+Reports = ['Acct_Level_Summary','Class_Level_Summary','BS_Level_Summary','Revenue_Breakdown','Revenue_Trend','Expense_Pivot','Summary_KPI']
+
+def get_reports(datasets):
+    datasets.preprocess_transactions()
+    get_account_level_balance_sheet(datasets)
+    get_account_type_level_balance_sheet(datasets)
+    get_overall_balance_sheet(datasets)
+    get_revenue_trend(datasets)
+    get_expenses_trend(datasets)
+    calculate_financial_KPIs(datasets)
+    return datasets
+
+@pytest.mark.parametrize('extension',['.csv','.parquet'])
+def test_streamed_reports_match_the_in_memory_run(workbook,ledger,tmp_path,extension):
+    path, filename = workbook
+    transactions_file = write_transaction_log(ledger,str(tmp_path / ('transactions' + extension)))
+
+    In_Memory = get_reports(ingestion_pipeline(path,filename,Start_Date,End_Date,use_cache=False))
+    Streamed = get_reports(streaming_pipeline(path,filename,transactions_file,Start_Date,End_Date,chunksize=250,use_cache=False))
+
+    for report in Reports:
+        pd.testing.assert_frame_equal(getattr(Streamed,report),getattr(In_Memory,report),check_exact=False,obj=report)
+    assert len(Streamed.Postings) == 0    # only the running totals are kept
+
+def test_chunks_are_bounded_and_typed(ledger,tmp_path):
+    transactions_file = write_transaction_log(ledger,str(tmp_path / 'transactions.csv'))
+    Chunks = list(read_transaction_chunks(transactions_file,400))
+
+    assert [len(chunk) for chunk in Chunks[:-1]] == [400] * (len(Chunks) - 1)
+    assert sum(len(chunk) for chunk in Chunks) == len(ledger['Transactions'])
+    assert all(chunk['tr_close_date'].dtype.kind == 'M' and chunk['tr_income'].dtype == object for chunk in Chunks)
@@ -0,0 +1,38 @@
+import datetime
+
+import pandas as pd
+import pytest
+import synthetic_ledger
+from balance_sheet_calculations import get_account_level_balance_sheet, get_account_type_level_balance_sheet
+from benchmark_pipeline import benchmark_pipeline
+from data_ingestion import Input_Sheets
+from run_qc_tests import get_accounting_equation_imbalance
+from stage_scheduler import build_pipeline_stages
+from synthetic_ledger import generate_ledger, write_workbook
+
+def test_ledger_has_the_workbook_layout(ledger,workbook):
+    path, filename = workbook
+    Read = pd.read_excel(path + filename,sheet_name=None)
+
+    assert list(ledger) == Input_Sheets
+    for sheet in Input_Sheets:
+        assert list(Read[sheet].columns) == list(ledger[sheet].columns)
+    assert len(ledger['Transactions']) == 1520 and ledger['Transactions']['tr_ID'].is_unique
+
+def test_ledger_is_balanced_and_reproducible(datasets):
+    get_account_level_balance_sheet(datasets)
+    get_account_type_level_balance_sheet(datasets)
+
+    assert get_accounting_equation_imbalance(datasets.Class_Level_Summary) == pytest.approx(0,abs=0.01)
+    pd.testing.assert_frame_equal(generate_ledger(200,seed=3)['Transactions'],generate_ledger(200,seed=3)['Transactions'])
+
+def test_ledgers_too_large_for_excel_are_refused(ledger,tmp_path,monkeypatch):
+    monkeypatch.setattr(synthetic_ledger,'Excel_Max_Rows',1000)
+    with pytest.raises(ValueError,match="don't fit in one Excel sheet"):
+        write_workbook(ledger,str(tmp_path / 'Data Structure.xlsx'))
+
+def test_benchmark_times_every_stage():
+    Results = benchmark_pipeline(sizes=(300,),start_date=datetime.date(2020,1,1),end_date=datetime.date(2021,6,30),with_memory=False)
+
+    assert Results['stage'].tolist() == ['load_sheets'] + [stage.name for stage in build_pipeline_stages()]
+    assert (Results['wall_seconds'] >= 0).all() and (Results['transactions'] == 300).all()
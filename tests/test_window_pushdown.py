@@ -0,0 +1,62 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from balance_sheet_calculations import get_account_level_balance_sheet, get_account_type_level_balance_sheet, get_overall_balance_sheet, cumulative_balance_index
+from data_ingestion import ingestion_pipeline
+from income_statement_calculations import get_revenue_trend, calculate_financial_KPIs
+from conftest import Start_Date, End_Date
+
+def get_reports(ledger,start_date):
+    datasets = ingestion_pipeline(path='',filename='',start_date=start_date,end_date=End_Date,use_cache=False,sheets=ledger)
+    datasets.preprocess_transactions()
+    get_account_level_balance_sheet(datasets)
+    get_account_type_level_balance_sheet(datasets)
+    get_overall_balance_sheet(datasets)
+    get_revenue_trend(datasets)
+    calculate_financial_KPIs(datasets)
+    return datasets
+
+def test_balance_sheets_match_a_run_over_the_full_history(ledger):
+    Windowed = get_reports(ledger,Start_Date)
+    Full_History = get_reports(ledger,datetime.date(2000,1,1))
+
+    for report in ['Acct_Level_Summary','Class_Level_Summary','BS_Level_Summary','Summary_KPI']:
+        pd.testing.assert_frame_equal(getattr(Windowed,report),getattr(Full_History,report),check_exact=False,obj=report)
+    assert len(Windowed.Transactions) < len(Full_History.Transactions)
+
+def test_only_the_window_is_kept_sorted_by_date(datasets):
+    Days = datasets.Transactions['Tr_Date']
+
+    assert Days.is_monotonic_increasing
+    assert Days.min() >= pd.Timestamp(Start_Date) and Days.max() <= pd.Timestamp(End_Date)
+
+def test_later_and_undated_rows_are_dropped_and_counted(datasets,ledger):
+    Sheets = dict(ledger)
+    Sheets['Transactions'] = ledger['Transactions'].copy()
+    Sheets['Transactions'].loc[Sheets['Transactions'].index[-1],'tr_close_date'] = pd.NaT
+    Later = (Sheets['Transactions']['tr_close_date'] > pd.Timestamp(End_Date)).sum()
+
+    Undated = ingestion_pipeline(path='',filename='',start_date=Start_Date,end_date=End_Date,use_cache=False,sheets=Sheets)
+    Undated.preprocess_transactions()
+
+    # the blanked row closed after End_Date, so the same rows are kept
+    assert Later > 0
+    assert Undated.Transactions['Tr_Date'].max() <= pd.Timestamp(End_Date)
+    pd.testing.assert_frame_equal(Undated.Transactions,datasets.Transactions)
+    assert Undated.QC_Pushed_Down_Counts['undated_transactions'] == 1
+    assert datasets.QC_Pushed_Down_Counts['undated_transactions'] == 0
+
+def test_trends_cover_only_the_window(ledger):
+    Trend = get_reports(ledger,Start_Date).Revenue_Trend
+    Months = pd.to_datetime(dict(year=Trend['Tr_Year'],month=Trend['Tr_Month'],day=1))
+
+    assert Months.min() >= pd.Timestamp(Start_Date).replace(day=1) and Months.max() <= pd.Timestamp(End_Date)
+
+def test_balance_index_uses_the_date_order_of_the_postings(datasets):
+    Sorted = cumulative_balance_index(datasets.Postings)
+    Shuffled = cumulative_balance_index(datasets.Postings.take(np.random.default_rng(0).permutation(len(datasets.Postings))))
+    As_Of_Dates = pd.date_range(Start_Date,End_Date,freq='MS')
+
+    assert np.array_equal(Sorted.key,Shuffled.key)
+    pd.testing.assert_frame_equal(Sorted.change_as_of(As_Of_Dates),Shuffled.change_as_of(As_Of_Dates))